@@ -15,7 +15,6 @@
 
 import datetime
 import os
-import queue
 import sys
 import threading
 import uuid
@@ -34,6 +33,7 @@ import pytz
 
 from plexpy.app import common
 from plexpy.db import maintenance
+from plexpy.db import rollups
 from plexpy.db.migrations import manager as migration_manager
 from plexpy.services import exporter
 from plexpy.services import libraries
@@ -43,12 +43,16 @@ from plexpy.services import notifiers
 from plexpy.services import users
 from plexpy.services import versioncheck
 from plexpy.config import core as config
+from plexpy.integrations import image_cache
 from plexpy.integrations import plex
 from plexpy.integrations import plextv
 from plexpy.services import activity_handler
 from plexpy.services import activity_pinger
+from plexpy.services import image_prewarm
 from plexpy.services import newsletter_handler
+from plexpy.services import notification_delivery
 from plexpy.services import notification_handler
+from plexpy.services import notification_queue
 from plexpy.util import helpers
 from plexpy.util import logger
 from plexpy.web import web_socket
@@ -79,7 +83,7 @@ FROZEN = False
 SCHED = None
 SCHED_LOCK = threading.Lock()
 
-NOTIFY_QUEUE = queue.Queue()
+NOTIFY_QUEUE = notification_queue.NotificationQueue()
 
 INIT_LOCK = threading.Lock()
 _INITIALIZED = False
@@ -483,6 +487,8 @@ def initialize_scheduler():
                      hours=backup_hours, minutes=0, seconds=0, args=(True, True))
         schedule_job(config.make_backup, 'Backup Tautulli config',
                      hours=backup_hours, minutes=0, seconds=0, args=(True, True))
+        schedule_job(image_cache.prune, 'Prune image cache',
+                     hours=1 * bool(CONFIG.CACHE_IMAGES and CONFIG.IMAGE_CACHE_MAX_MB), minutes=0, seconds=0)
 
         if WS_CONNECTED and CONFIG.PMS_IP and CONFIG.PMS_TOKEN:
             schedule_job(plextv.get_server_resources, 'Refresh Plex server URLs',
@@ -508,6 +514,10 @@ def initialize_scheduler():
             schedule_job(plextv.notify_token_expired, 'Check Tautulli Plex token',
                          hours=1, minutes=0, seconds=0)
 
+            prewarm_hours = CONFIG.IMAGE_PREWARM_INTERVAL if 0 <= CONFIG.IMAGE_PREWARM_INTERVAL <= 24 else 1
+            schedule_job(image_prewarm.prewarm_images, 'Pre-warm image cache',
+                         hours=prewarm_hours * bool(CONFIG.CACHE_IMAGES), minutes=0, seconds=0)
+
         else:
             # Cancel all jobs
             schedule_job(plextv.get_server_resources, 'Refresh Plex server URLs',
@@ -530,6 +540,9 @@ def initialize_scheduler():
             schedule_job(plextv.notify_token_expired, 'Check Tautulli Plex token',
                          hours=0, minutes=0, seconds=0)
 
+            schedule_job(image_prewarm.prewarm_images, 'Pre-warm image cache',
+                         hours=0, minutes=0, seconds=0)
+
         # Start scheduler
         if start_jobs and len(SCHED.get_jobs()):
             try:
@@ -574,6 +587,9 @@ def start():
         # Start refreshes on a separate thread
         threading.Thread(target=startup_refresh).start()
 
+        # Refresh local history dates and the history rollup if the server timezone changed
+        threading.Thread(target=rollups.check_history_rollup).start()
+
         global SCHED
         SCHED = BackgroundScheduler(timezone=pytz.UTC)
         activity_handler.ACTIVITY_SCHED = BackgroundScheduler(timezone=pytz.UTC)
@@ -593,6 +609,10 @@ def start():
         # Cancel processing exports
         exporter.cancel_exports()
 
+        # Measure the image cache so the size limit applies before the first scheduled prune
+        if CONFIG.CACHE_IMAGES and CONFIG.IMAGE_CACHE_MAX_MB:
+            image_cache.start_janitor()
+
         if CONFIG.SYSTEM_ANALYTICS:
             global TRACKER
             TRACKER = initialize_tracker()
@@ -664,6 +684,8 @@ def shutdown(restart=False, update=False, checkout=False, reset=False):
     # Stop the notification threads
     for i in range(CONFIG.NOTIFICATION_THREADS):
         NOTIFY_QUEUE.put(None)
+    notification_queue.stop_threads()
+    notification_delivery.stop()
 
     CONFIG.write()
 
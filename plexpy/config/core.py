@@ -17,6 +17,7 @@ import os
 import re
 import time
 import threading
+from types import MappingProxyType
 import zipfile
 
 from configobj import ConfigObj, ParseError
@@ -93,6 +94,7 @@ _CONFIG_DEFINITIONS = {
     'CLOUDINARY_API_KEY': (str, 'Cloudinary', ''),
     'CLOUDINARY_API_SECRET': (str, 'Cloudinary', ''),
     'CONFIG_VERSION': (int, 'Advanced', 0),
+    'DATATABLES_COUNT_ESTIMATE_ROWS': (int, 'Advanced', 1000000),
     'DB_HOST': (str, 'Database', 'localhost'),
     'DB_PORT': (int, 'Database', 5432),
     'DB_NAME': (str, 'Database', 'tautulli'),
@@ -146,6 +148,9 @@ _CONFIG_DEFINITIONS = {
     'HTTP_RATE_LIMIT_LOCKOUT_TIME': (int, 'General', 300),
     'HTTP_THREAD_POOL': (int, 'General', 10),
     'INTERFACE': (str, 'General', 'default'),
+    'IMAGE_CACHE_MAX_MB': (int, 'Advanced', 1024),
+    'IMAGE_PREWARM_INTERVAL': (int, 'Advanced', 1),
+    'IMAGE_PREWARM_THREADS': (int, 'Advanced', 2),
     'IMGUR_CLIENT_ID': (str, 'Monitoring', ''),
     'LAUNCH_BROWSER': (int, 'General', 1),
     'LAUNCH_STARTUP': (int, 'General', 1),
@@ -153,6 +158,8 @@ _CONFIG_DEFINITIONS = {
     'LOG_BLACKLIST_USERNAMES': (int, 'General', 1),
     'LOG_DIR': (str, 'General', ''),
     'LOGGING_IGNORE_INTERVAL': (int, 'Monitoring', 120),
+    'METADATA_CACHE_DISK': (int, 'Advanced', 0),
+    'METADATA_CACHE_MAX_ITEMS': (int, 'Advanced', 1000),
     'METADATA_CACHE_SECONDS': (int, 'Advanced', 1800),
     'MOVIE_WATCHED_PERCENT': (int, 'Monitoring', 85),
     'MUSIC_WATCHED_PERCENT': (int, 'Monitoring', 85),
@@ -166,7 +173,14 @@ _CONFIG_DEFINITIONS = {
     'NEWSLETTER_TEMPLATES': (str, 'Newsletter', 'newsletters'),
     'NEWSLETTER_DIR': (str, 'Newsletter', ''),
     'NEWSLETTER_SELF_HOSTED': (int, 'Newsletter', 0),
+    'NOTIFICATION_AGENT_QUEUE_SIZE': (int, 'Advanced', 100),
+    'NOTIFICATION_AGENT_RATE_LIMIT': (int, 'Advanced', 60),
+    'NOTIFICATION_AGENT_THREADS': (int, 'Advanced', 2),
     'NOTIFICATION_THREADS': (int, 'Advanced', 2),
+    'NOTIFICATION_QUEUE_AGENT_CONCURRENCY': (int, 'Advanced', 2),
+    'NOTIFICATION_QUEUE_BATCH_SIZE': (int, 'Advanced', 10),
+    'NOTIFICATION_QUEUE_DURABLE': (int, 'Advanced', 0),
+    'NOTIFICATION_QUEUE_MAX_ATTEMPTS': (int, 'Advanced', 5),
     'NOTIFY_CONSECUTIVE': (int, 'Monitoring', 1),
     'NOTIFY_CONTINUED_SESSION_THRESHOLD': (int, 'Monitoring', 15),
     'NOTIFY_GROUP_RECENTLY_ADDED_GRANDPARENT': (int, 'Monitoring', 1),
@@ -204,6 +218,7 @@ _CONFIG_DEFINITIONS = {
     'WEBSOCKET_MONITOR_PING_PONG': (int, 'Advanced', 0),
     'WEBSOCKET_CONNECTION_ATTEMPTS': (int, 'Advanced', 5),
     'WEBSOCKET_CONNECTION_TIMEOUT': (int, 'Advanced', 5),
+    'WEBSOCKET_EVENT_THREADS': (int, 'Advanced', 4),
     'WEEK_START_MONDAY': (int, 'General', 0),
     'JWT_SECRET': (str, 'Advanced', ''),
     'JWT_UPDATE_SECRET': (bool_int, 'Advanced', 0),
@@ -443,11 +458,21 @@ def make_backup(cleanup=False, scheduler=False):
 # pylint:disable=R0902
 # it might be nice to refactor for fewer instance variables
 class Config(object):
-    """ Wraps access to particular values in a config file """
+    """
+    Wraps access to particular values in a config file
+
+    Settings are read from an immutable snapshot of the cast values, so reading
+    a setting is a dict lookup. The snapshot is replaced as a whole when the
+    config is loaded or written and copied with the new value when a setting
+    is changed, both under a lock. Environment variable overrides are read
+    when it is built.
+    """
 
     def __init__(self, config_file, is_import=False):
         """ Initialize the config with values from a file """
         self._config_file = config_file
+        self._snapshot = MappingProxyType({})
+        self._snapshot_lock = threading.Lock()
         try:
             self._config = ConfigObj(self._config_file, encoding='utf-8')
         except ParseError as e:
@@ -456,6 +481,7 @@ class Config(object):
 
         for key in _CONFIG_DEFINITIONS:
             self.check_setting(key)
+        self._build_snapshot()
         if not is_import:
             self._upgrade()
             self._blacklist()
@@ -472,6 +498,21 @@ class Config(object):
 
         logger._BLACKLIST_WORDS.update(blacklist)
 
+    def _build_snapshot(self):
+        """ Replace the snapshot with freshly cast values of all settings """
+        with self._snapshot_lock:
+            self._snapshot = MappingProxyType({key: self.get_setting(key) for key in _CONFIG_DEFINITIONS})
+
+    def _update_snapshot(self, name):
+        """ Replace the snapshot with a copy holding the current value of one setting """
+        key = name.upper()
+        if key in _CONFIG_DEFINITIONS:
+            # Concurrent updates must not copy the same old snapshot and drop each other's value
+            with self._snapshot_lock:
+                snapshot = dict(self._snapshot)
+                snapshot[key] = self.get_setting(key)
+                self._snapshot = MappingProxyType(snapshot)
+
     def _define(self, name):
         key = name.upper()
         ini_key = name.lower()
@@ -515,6 +556,7 @@ class Config(object):
 
         # If not, set the value in the config file
         self._config[section][ini_key] = self._cast_setting(definition_type, value, default)
+        self._update_snapshot(key)
         return self._config[section][ini_key]
     
     def _from_env(self, key):
@@ -558,6 +600,7 @@ class Config(object):
         except IOError as e:
             logger.error("Tautulli Config :: Error writing configuration file: %s", e)
 
+        self._build_snapshot()
         self._blacklist()
 
     def __getattr__(self, name):
@@ -565,6 +608,16 @@ class Config(object):
         Returns something from the ini unless it is a real property
         of the configuration object or is not all caps.
         """
+        try:
+            value = self.__dict__['_snapshot'][name]
+        except KeyError:
+            pass
+        else:
+            # Hand out copies of lists and dicts so callers can't change the snapshot
+            if isinstance(value, (list, dict)):
+                return type(value)(value)
+            return value
+
         if not re.match(r'[A-Z0-9_]+$', name):
             return super(Config, self).__getattr__(name)
         else:
@@ -590,6 +643,7 @@ class Config(object):
         else:
             key, definition_type, section, ini_key, default = self._define(name)
             del self._config[section][ini_key]
+            self._update_snapshot(key)
 
     def process_kwargs(self, kwargs):
         """
@@ -2,6 +2,8 @@ from typing import Iterable, List, Optional
 
 from sqlalchemy import delete, select
 
+from plexpy.db import counts
+from plexpy.db import rollups
 from plexpy.db.models import (
     RecentlyAdded,
     Session,
@@ -36,6 +38,8 @@ def delete_session_history_rows(row_ids: Optional[Iterable[int]] = None) -> bool
     if not clean_ids:
         return True
 
+    rollup_buckets = rollups.get_rollup_buckets(clean_ids)
+
     with session_scope() as session:
         session.execute(
             delete(SessionHistoryMediaInfo).where(SessionHistoryMediaInfo.id.in_(clean_ids))
@@ -47,6 +51,9 @@ def delete_session_history_rows(row_ids: Optional[Iterable[int]] = None) -> bool
             delete(SessionHistory).where(SessionHistory.id.in_(clean_ids))
         )
 
+    counts.invalidate_total_count('session_history')
+    rollups.refresh_rollup_buckets(rollup_buckets)
+
     return True
 
 
@@ -0,0 +1,78 @@
+"""
+Cached total row counts for DataTables ``recordsTotal``.
+
+An exact ``COUNT(*)`` is a sequential scan on PostgreSQL, so counts for
+tables listed in ``CACHED_TABLES`` are kept in memory and invalidated by
+the code paths that write to them. Very large tables fall back to the
+planner estimate in ``pg_class.reltuples``.
+"""
+
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+import plexpy
+from plexpy.db.engine import get_engine
+
+
+# Tables with invalidation hooks on every insert/delete path
+CACHED_TABLES = ('session_history',)
+
+_TOTAL_COUNTS: Dict[str, int] = {}
+_GENERATION = 0
+_COUNT_LOCK = threading.Lock()
+
+
+def _estimate_threshold() -> int:
+    if plexpy.CONFIG is None:
+        return 0
+    return plexpy.CONFIG.DATATABLES_COUNT_ESTIMATE_ROWS
+
+
+def _estimate_count(connection, table_name: str) -> Optional[int]:
+    # reltuples is -1 for tables that have never been vacuumed or analyzed
+    estimate = connection.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table_name)"),
+        {'table_name': table_name},
+    ).scalar()
+    if estimate is None or estimate < 0:
+        return None
+    return int(estimate)
+
+
+def _exact_count(connection, table_name: str) -> int:
+    return connection.execute(text("SELECT COUNT(*) FROM %s" % table_name)).scalar() or 0
+
+
+def get_total_count(table_name: str) -> int:
+    """Return the total row count for a trusted table name."""
+    with _COUNT_LOCK:
+        if table_name in _TOTAL_COUNTS:
+            return _TOTAL_COUNTS[table_name]
+        generation = _GENERATION
+
+    with get_engine().connect() as connection:
+        threshold = _estimate_threshold()
+        count = _estimate_count(connection, table_name) if threshold > 0 else None
+        if count is None or count < threshold:
+            count = _exact_count(connection, table_name)
+
+    if table_name in CACHED_TABLES:
+        with _COUNT_LOCK:
+            # Don't cache a count that raced with a write
+            if generation == _GENERATION:
+                _TOTAL_COUNTS[table_name] = count
+
+    return count
+
+
+def invalidate_total_count(table_name: Optional[str] = None) -> None:
+    """Drop the cached count for ``table_name``, or all cached counts."""
+    global _GENERATION
+    with _COUNT_LOCK:
+        _GENERATION += 1
+        if table_name is None:
+            _TOTAL_COUNTS.clear()
+        else:
+            _TOTAL_COUNTS.pop(table_name, None)
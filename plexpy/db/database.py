@@ -1,12 +1,14 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Iterable, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence
 
-from sqlalchemy import MetaData, Table, and_, insert, text
+from sqlalchemy import MetaData, Table, and_, insert
 from sqlalchemy.engine import Engine
 
 from plexpy.db.engine import get_engine
 from plexpy.db.models import Base
+from plexpy.db.queries import compiled
+from plexpy.db.queries import has_unique_key, upsert_many
 
 
 class MonitorDatabase(object):
@@ -15,18 +17,6 @@ class MonitorDatabase(object):
         self._last_insert_id: Optional[int] = None
         self._tables: Dict[str, Table] = {}
 
-    def _bind_params(self, query: str, args: Iterable[Any]) -> Tuple[str, Dict[str, Any]]:
-        if not args:
-            return query, {}
-
-        params: Dict[str, Any] = {}
-        for idx, value in enumerate(args, start=1):
-            param_name = f"param_{idx}"
-            query = query.replace('?', f":{param_name}", 1)
-            params[param_name] = value
-
-        return query, params
-
     def _get_table(self, table_name: str) -> Table:
         table = self._tables.get(table_name)
         if table is not None:
@@ -43,20 +33,20 @@ class MonitorDatabase(object):
         if query is None:
             return None
 
-        query, params = self._bind_params(query, args or [])
+        query, params = compiled.bind(query, args or [])
         with self.engine.begin() as connection:
-            return connection.execute(text(query), params)
+            return connection.execute(query, params)
 
     def select(self, query: str, args: Optional[Iterable[Any]] = None):
-        query, params = self._bind_params(query, args or [])
+        query, params = compiled.bind(query, args or [])
         with self.engine.connect() as connection:
-            result = connection.execute(text(query), params)
+            result = connection.execute(query, params)
             return [dict(row) for row in result.mappings().all()]
 
     def select_single(self, query: str, args: Optional[Iterable[Any]] = None):
-        query, params = self._bind_params(query, args or [])
+        query, params = compiled.bind(query, args or [])
         with self.engine.connect() as connection:
-            result = connection.execute(text(query), params).mappings().first()
+            result = connection.execute(query, params).mappings().first()
             if not result:
                 return {}
             return dict(result)
@@ -73,6 +63,19 @@ class MonitorDatabase(object):
 
         pk_columns = list(table.primary_key.columns)
 
+        if cleaned_keys and has_unique_key(table, cleaned_keys):
+            with self.engine.begin() as connection:
+                rows = upsert_many(connection, table, [insert_values], list(cleaned_keys),
+                                   update_columns=list(value_dict),
+                                   returning=[c.name for c in pk_columns[:1]])
+            # DO NOTHING returns no row for an existing key
+            row = rows[0] if rows else {'inserted': False}
+            if not row['inserted']:
+                return 'update'
+            if pk_columns:
+                self._last_insert_id = row.get(pk_columns[0].name)
+            return 'insert'
+
         with self.engine.begin() as connection:
             if cleaned_keys:
                 conditions = [table.c[key] == value for key, value in cleaned_keys.items()]
@@ -93,5 +96,15 @@ class MonitorDatabase(object):
 
         return 'insert'
 
+    def upsert_many(self, table_name: str, rows: Iterable[Mapping[str, Any]], key_names: Sequence[str],
+                    returning: Sequence[str] = ()) -> List[Dict[str, Any]]:
+        """Upsert many rows with batched ``INSERT ... ON CONFLICT`` statements in one transaction."""
+        table = self._get_table(table_name)
+        if not has_unique_key(table, key_names):
+            raise ValueError("No unique index on %s (%s)" % (table_name, ', '.join(key_names)))
+
+        with self.engine.begin() as connection:
+            return upsert_many(connection, table, rows, key_names, returning=returning)
+
     def last_insert_id(self) -> Optional[int]:
         return self._last_insert_id
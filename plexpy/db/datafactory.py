@@ -23,7 +23,9 @@ from sqlalchemy.orm import aliased
 import plexpy
 from plexpy.app import common
 from plexpy.db import datatables
+from plexpy.db import localtime
 from plexpy.db import queries
+from plexpy.db import rollups
 from plexpy.db.models import (
     CloudinaryLookup,
     ImageHashLookup,
@@ -36,6 +38,7 @@ from plexpy.db.models import (
     Session,
     SessionContinued,
     SessionHistory,
+    SessionHistoryDaily,
     SessionHistoryMediaInfo,
     SessionHistoryMetadata,
     TheMovieDbLookup,
@@ -43,11 +46,11 @@ from plexpy.db.models import (
     User,
 )
 from plexpy.db.queries import raw_pg
-from plexpy.db.queries import time as time_queries
 from plexpy.db.session import session_scope
 from plexpy.integrations import pmsconnect
-from plexpy.services import users
+from plexpy.services import user_directory
 from plexpy.web import session
+from plexpy.util import concurrency
 from plexpy.util import helpers
 from plexpy.util import logger
 
@@ -82,19 +85,15 @@ class DataFactory(object):
 
     def _timeframe_filters(self, time_range, before=None, after=None):
         filters = []
-        started_date = time_queries.to_char(
-            time_queries.to_timestamp(SessionHistory.started),
-            'YYYY-MM-DD',
-        )
 
         if before:
-            filters.append(started_date <= before)
+            filters.append(SessionHistory.local_date <= before)
             if not after:
                 timestamp = helpers.YMD_to_timestamp(before) - time_range * 24 * 60 * 60
                 filters.append(SessionHistory.stopped >= timestamp)
 
         if after:
-            filters.append(started_date >= after)
+            filters.append(SessionHistory.local_date >= after)
             if not before:
                 timestamp = helpers.YMD_to_timestamp(after) + time_range * 24 * 60 * 60
                 filters.append(SessionHistory.stopped <= timestamp)
@@ -105,24 +104,52 @@ class DataFactory(object):
 
         return filters
 
-    def _bind_params(self, query, args):
-        if not args:
-            return query, {}
+    def _rollup_timeframe_filters(self, time_range, before=None, after=None):
+        filters = []
+        date_played = SessionHistoryDaily.date_played
+
+        # time_range local days, like the daily graphs
+        if before:
+            filters.append(date_played <= before)
+            if not after:
+                filters.append(date_played >= localtime.range_start_date(time_range, end=before))
 
-        params = {}
-        for idx, value in enumerate(args, start=1):
-            param_name = f"param_{idx}"
-            query = query.replace('?', f":{param_name}", 1)
-            params[param_name] = value
+        if after:
+            filters.append(date_played >= after)
+            if not before:
+                filters.append(date_played <= localtime.range_end_date(time_range, start=after))
+
+        if not (before or after):
+            filters.append(date_played >= localtime.range_start_date(time_range))
 
-        return query, params
+        return filters
 
-    def get_datatables_history(self, kwargs=None, custom_where=None, grouping=None, include_activity=None):
+    def get_datatables_history(self, kwargs=None, custom_where=None, grouping=None, include_activity=None,
+                               cursor=None):
         data_tables = datatables.DataTables()
 
+        default_return = {'recordsFiltered': 0,
+                          'recordsTotal': 0,
+                          'draw': 0,
+                          'data': [],
+                          'filter_duration': '0',
+                          'total_duration': '0'}
+
         if custom_where is None:
             custom_where = []
 
+        # Keyset pagination seeks on the ungrouped (started, id) history rows
+        seek_columns = seek_values = None
+        if cursor is not None:
+            seek_columns = [('session_history.started', 'started'), ('session_history.id', 'row_id')]
+            if cursor:
+                seek_values = datatables.decode_cursor(cursor)
+                if seek_values is None:
+                    logger.warn("Tautulli DataFactory :: Invalid history cursor: %s." % cursor)
+                    return default_return
+            grouping = False
+            include_activity = False
+
         reference_filter = any(
             clause.rstrip(' OR') == 'session_history.reference_id'
             for clause, _ in custom_where
@@ -317,20 +344,21 @@ class DataFactory(object):
                                           join_evals=[['session_history.user_id', 'users.user_id'],
                                                       ['session_history.id', 'session_history_metadata.id'],
                                                       ['session_history.id', 'session_history_media_info.id']],
+                                          seek_columns=seek_columns,
+                                          seek_values=seek_values,
                                           kwargs=kwargs)
         except Exception as e:
             logger.warn("Tautulli DataFactory :: Unable to execute database query for get_history: %s." % e)
-            return {'recordsFiltered': 0,
-                    'recordsTotal': 0,
-                    'draw': 0,
-                    'data': [],
-                    'filter_duration': '0',
-                    'total_duration': '0'}
+            return default_return
 
         history = query['result']
 
         filter_duration = 0
-        total_duration = self.get_total_duration(custom_where=custom_where)
+        if seek_columns:
+            # The total duration scans all of the history, so it is skipped for keyset pages
+            total_duration = 0
+        else:
+            total_duration = self.get_total_duration(custom_where=custom_where)
 
         watched_percent = {'movie': plexpy.CONFIG.MOVIE_WATCHED_PERCENT,
                            'episode': plexpy.CONFIG.TV_WATCHED_PERCENT,
@@ -341,16 +369,14 @@ class DataFactory(object):
 
         rows = []
 
-        users_lookup = {}
-
         for item in history:
             if item['state']:
-                # Get user thumb from database for current activity
-                if not users_lookup:
-                    # Cache user lookup
-                    users_lookup = {u['user_id']: u['thumb'] for u in users.Users().get_users()}
-
-                item['user_thumb'] = users_lookup.get(item['user_id'])
+                # Get user thumb from the user directory for current activity
+                user = user_directory.get_user(user_id=item['user_id'])
+                if user and not user['deleted_user']:
+                    item['user_thumb'] = user['custom_thumb'] or user['user_thumb']
+                else:
+                    item['user_thumb'] = None
 
             filter_duration += helpers.cast_to_int(item['play_duration'])
 
@@ -446,6 +472,10 @@ class DataFactory(object):
                 'total_duration': helpers.human_duration(total_duration, units='s')
                 }
 
+        if seek_columns:
+            dict['total_duration'] = None
+            dict['next_cursor'] = query['nextCursor']
+
         return dict
 
     def get_home_stats(self, grouping=None, time_range=30, stats_type='plays',
@@ -468,6 +498,13 @@ class DataFactory(object):
         if user_id:
             filters.append(SessionHistory.user_id == helpers.cast_to_int(user_id))
 
+        rollup_filters = self._rollup_timeframe_filters(time_range=time_range, before=before, after=after)
+        if section_id:
+            rollup_filters.append(SessionHistoryDaily.section_id == helpers.cast_to_int(section_id))
+        if user_id:
+            rollup_filters.append(SessionHistoryDaily.user_id == helpers.cast_to_int(user_id))
+        rollup_plays = SessionHistoryDaily.grouped_plays if grouping else SessionHistoryDaily.plays
+
         group_key = self._group_key_expr(grouping)
         duration_expr = self._duration_expr()
         sort_type = 'total_duration' if stats_type == 'duration' else 'total_plays'
@@ -479,6 +516,11 @@ class DataFactory(object):
                 stmt = stmt.where(cond)
             return stmt
 
+        def apply_rollup_filters(stmt):
+            for cond in rollup_filters:
+                stmt = stmt.where(cond)
+            return stmt
+
         friendly_name_expr = case(
             (or_(User.friendly_name.is_(None), func.trim(User.friendly_name) == ''), User.username),
             else_=User.friendly_name,
@@ -1176,22 +1218,18 @@ class DataFactory(object):
                 elif stat == 'top_libraries':
                     top_libraries = []
                     try:
-                        total_plays_expr = func.count(distinct(group_key)).label('total_plays')
-                        total_duration_expr = func.sum(duration_expr).label('total_duration')
-                        last_watch_expr = func.max(SessionHistory.started).label('last_watch')
-
-                        agg = (
-                            select(
-                                SessionHistory.section_id.label('section_id'),
-                                total_plays_expr,
-                                total_duration_expr,
-                                last_watch_expr,
-                            )
-                            .select_from(SessionHistory)
-                            .join(SessionHistoryMetadata, SessionHistoryMetadata.id == SessionHistory.id)
+                        total_plays_expr = func.sum(rollup_plays).label('total_plays')
+                        total_duration_expr = func.sum(SessionHistoryDaily.duration).label('total_duration')
+                        last_watch_expr = func.max(SessionHistoryDaily.last_started).label('last_watch')
+
+                        agg = select(
+                            SessionHistoryDaily.section_id.label('section_id'),
+                            total_plays_expr,
+                            total_duration_expr,
+                            last_watch_expr,
                         )
-                        agg = apply_filters(agg)
-                        agg = agg.group_by(SessionHistory.section_id).subquery()
+                        agg = apply_rollup_filters(agg)
+                        agg = agg.group_by(SessionHistoryDaily.section_id).subquery()
 
                         last_row_stmt = (
                             select(
@@ -1339,22 +1377,18 @@ class DataFactory(object):
                 elif stat == 'top_users':
                     top_users = []
                     try:
-                        total_plays_expr = func.count(distinct(group_key)).label('total_plays')
-                        total_duration_expr = func.sum(duration_expr).label('total_duration')
-                        last_watch_expr = func.max(SessionHistory.started).label('last_watch')
-
-                        agg = (
-                            select(
-                                SessionHistory.user_id.label('user_id'),
-                                total_plays_expr,
-                                total_duration_expr,
-                                last_watch_expr,
-                            )
-                            .select_from(SessionHistory)
-                            .join(SessionHistoryMetadata, SessionHistoryMetadata.id == SessionHistory.id)
+                        total_plays_expr = func.sum(rollup_plays).label('total_plays')
+                        total_duration_expr = func.sum(SessionHistoryDaily.duration).label('total_duration')
+                        last_watch_expr = func.max(SessionHistoryDaily.last_started).label('last_watch')
+
+                        agg = select(
+                            SessionHistoryDaily.user_id.label('user_id'),
+                            total_plays_expr,
+                            total_duration_expr,
+                            last_watch_expr,
                         )
-                        agg = apply_filters(agg)
-                        agg = agg.group_by(SessionHistory.user_id).subquery()
+                        agg = apply_rollup_filters(agg)
+                        agg = agg.group_by(SessionHistoryDaily.user_id).subquery()
 
                         last_row_stmt = (
                             select(
@@ -1481,23 +1515,20 @@ class DataFactory(object):
                     top_platform = []
 
                     try:
-                        total_plays_expr = func.count(distinct(group_key)).label('total_plays')
-                        total_duration_expr = func.sum(duration_expr).label('total_duration')
-                        last_watch_expr = func.max(SessionHistory.started).label('last_watch')
+                        total_plays_expr = func.sum(rollup_plays).label('total_plays')
+                        total_duration_expr = func.sum(SessionHistoryDaily.duration).label('total_duration')
+                        last_watch_expr = func.max(SessionHistoryDaily.last_started).label('last_watch')
                         sort_metric = total_duration_expr if sort_type == 'total_duration' else total_plays_expr
 
-                        stmt = (
-                            select(
-                                SessionHistory.platform,
-                                last_watch_expr,
-                                total_plays_expr,
-                                total_duration_expr,
-                            )
-                            .select_from(SessionHistory)
+                        stmt = select(
+                            SessionHistoryDaily.platform,
+                            last_watch_expr,
+                            total_plays_expr,
+                            total_duration_expr,
                         )
-                        stmt = apply_filters(stmt)
+                        stmt = apply_rollup_filters(stmt)
                         stmt = (
-                            stmt.group_by(SessionHistory.platform)
+                            stmt.group_by(SessionHistoryDaily.platform)
                             .order_by(sort_metric.desc(), last_watch_expr.desc())
                         )
                         stmt = queries.apply_pagination(stmt, stats_start, stats_count)
@@ -1674,38 +1705,6 @@ class DataFactory(object):
                                        'rows': session.mask_session_info(last_watched)})
 
                 elif stat == 'most_concurrent':
-
-                    def calc_most_concurrent(title, result):
-                        times = []
-                        for item in result:
-                            times.append({'time': str(item['started']) + 'B', 'count': 1})
-                            times.append({'time': str(item['stopped']) + 'A', 'count': -1})
-                        times = sorted(times, key=lambda k: k['time'])
-
-                        count = 0
-                        last_count = 0
-                        last_start = ''
-                        concurrent = {'title': title,
-                                      'count': 0,
-                                      'started': None,
-                                      'stopped': None
-                                      }
-
-                        for d in times:
-                            if d['count'] == 1:
-                                count += d['count']
-                                if count >= last_count:
-                                    last_start = d['time']
-                            else:
-                                if count >= last_count:
-                                    last_count = count
-                                    concurrent['count'] = count
-                                    concurrent['started'] = last_start[:-1]
-                                    concurrent['stopped'] = d['time'][:-1]
-                                count += d['count']
-
-                        return concurrent
-
                     most_concurrent = []
 
                     try:
@@ -1719,24 +1718,31 @@ class DataFactory(object):
                             .join(SessionHistoryMediaInfo, SessionHistoryMediaInfo.id == SessionHistory.id)
                         )
                         stmt = apply_filters(stmt)
-                        result = queries.fetch_mappings(db_session, stmt)
+                        result = db_session.execute(stmt).all()
                     except Exception as e:
                         logger.warn("Tautulli DataFactory :: Unable to execute database query for get_home_stats: most_concurrent: %s." % e)
                         return None
 
                     if result:
-                        most_concurrent.append(calc_most_concurrent('Concurrent Streams', result))
+                        peaks = concurrency.peak_concurrency(
+                            (started, stopped, ('all', ('decision', transcode_decision)))
+                            for started, stopped, transcode_decision in result
+                        )
 
-                        decision_map = (
-                            ('transcode', 'Concurrent Transcodes'),
-                            ('copy', 'Concurrent Direct Streams'),
-                            ('direct play', 'Concurrent Direct Plays'),
+                        title_map = (
+                            ('all', 'Concurrent Streams'),
+                            (('decision', 'transcode'), 'Concurrent Transcodes'),
+                            (('decision', 'copy'), 'Concurrent Direct Streams'),
+                            (('decision', 'direct play'), 'Concurrent Direct Plays'),
                         )
 
-                        for decision, title in decision_map:
-                            filtered = [row for row in result if row['transcode_decision'] == decision]
-                            if filtered:
-                                most_concurrent.append(calc_most_concurrent(title, filtered))
+                        for key, title in title_map:
+                            peak = peaks.get(key)
+                            if peak:
+                                most_concurrent.append({'title': title,
+                                                        'count': peak['count'],
+                                                        'started': str(peak['started']) if peak['started'] is not None else '',
+                                                        'stopped': str(peak['stopped'])})
 
                     home_stats.append({'stat_id': stat,
                                        'stat_title': 'Most Concurrent Streams',
@@ -2562,20 +2568,13 @@ class DataFactory(object):
                         "service not provided.")
             return
 
-        keys = {'img_hash': img_hash}
-        values = values or {}
-        cleaned_keys = {key: value for key, value in keys.items() if value is not None}
-        insert_values = {**values, **cleaned_keys}
-        if not insert_values:
+        if img_hash is None:
+            with session_scope() as db_session:
+                db_session.execute(insert(model).values(**values))
             return
 
         with session_scope() as db_session:
-            if cleaned_keys:
-                conditions = [getattr(model, key) == value for key, value in cleaned_keys.items()]
-                result = db_session.execute(update(model).where(*conditions).values(**values))
-                if result.rowcount and result.rowcount > 0:
-                    return
-            db_session.execute(insert(model).values(**insert_values))
+            queries.upsert_many(db_session, model.__table__, [{'img_hash': img_hash, **values}], ['img_hash'])
 
     def delete_img_info(self, rating_key=None, service='', delete_all=False):
         if not delete_all:
@@ -3145,6 +3144,9 @@ class DataFactory(object):
                     .values(**metadata_values)
                 )
 
+            # The section may have changed
+            rollups.refresh_history_rollup(ids)
+
     def get_notification_log(self, kwargs=None):
         data_tables = datatables.DataTables()
 
@@ -21,12 +21,15 @@ Datatables endpoints. Callers must supply trusted column/table expressions.
 Values are always bound as parameters to avoid injection.
 """
 
+import base64
+import binascii
 import re
 
 import plexpy
-from sqlalchemy import text
 
+from plexpy.db import counts
 from plexpy.db.engine import get_engine
+from plexpy.db.queries import compiled
 from plexpy.util import helpers
 from plexpy.util import logger
 
@@ -40,34 +43,26 @@ class DataTables(object):
         self.engine = get_engine()
 
     def _bind_params(self, query, args):
+        placeholder_count = compiled.placeholder_count(query)
         if not args:
-            if query.count('?'):
+            if placeholder_count:
                 logger.warn(
                     'Tautulli DataTables :: Query has placeholders without args (%s).',
                     query,
                 )
-            return query, {}
-
-        placeholder_count = query.count('?')
-        if placeholder_count != len(args):
+        elif placeholder_count != len(args):
             logger.warn(
                 'Tautulli DataTables :: Placeholder count %s does not match args %s.',
                 placeholder_count,
                 len(args),
             )
 
-        params = {}
-        for idx, value in enumerate(args, start=1):
-            param_name = f"param_{idx}"
-            query = query.replace('?', f":{param_name}", 1)
-            params[param_name] = value
-
-        return query, params
+        return compiled.bind(query, args)
 
     def _select(self, query, args=None):
         query, params = self._bind_params(query, args or [])
         with self.engine.connect() as connection:
-            result = connection.execute(text(query), params)
+            result = connection.execute(query, params)
             return [dict(row) for row in result.mappings().all()]
 
     def ssp_query(self,
@@ -82,6 +77,8 @@ class DataTables(object):
                   join_types=None,
                   join_tables=None,
                   join_evals=None,
+                  seek_columns=None,
+                  seek_values=None,
                   kwargs=None):
 
         if kwargs is None:
@@ -105,6 +102,8 @@ class DataTables(object):
             join_tables = []
         if join_evals is None:
             join_evals = []
+        if seek_columns is None:
+            seek_columns = []
 
         if not table_name:
             logger.error('Tautulli DataTables :: No table name received.')
@@ -142,34 +141,97 @@ class DataTables(object):
             union = ''
             cwu_args = []
 
+        start = max(helpers.cast_to_int(parameters.get('start')), 0)
+        length = helpers.cast_to_int(parameters.get('length', -1))
+
+        if seek_columns:
+            # Keyset pagination replaces the requested ordering and offset with a seek predicate.
+            # The ids of the page are selected from the ungrouped rows first, so the seek can use
+            # an index on the seek columns and only the rows of the page are joined and aggregated.
+            start = 0
+            page_where = [c_where[len('WHERE '):]] if c_where else []
+            page_args = list(cw_args)
+            if seek_values:
+                s_where, s_args = build_seek(seek_columns, seek_values)
+                page_where.append(s_where)
+                page_args += s_args
+            r_where, r_args = build_row_where(parameters['search']['value'],
+                                              extracted_columns,
+                                              parameters['columns'])
+            if r_where:
+                page_where.append(r_where)
+                page_args += r_args
+            page_where = ' AND '.join('(%s)' % w for w in page_where)
+
+            key = seek_columns[-1][0]
+            paging, p_args = build_paging(0, length)
+            page = 'SELECT %s FROM %s %s %s ORDER BY %s %s' \
+                   % (key, table_name, join, 'WHERE ' + page_where if page_where else '',
+                      ', '.join(column + ' DESC' for column, _ in seek_columns), paging)
+
+            c_where = 'WHERE %s IN (%s)' % (key, page)
+            cw_args = page_args + p_args
+            where = ''
+            w_args = []
+            order = 'ORDER BY ' + ', '.join(named + ' DESC' for _, named in seek_columns)
+            paging, p_args = '', []
+        else:
+            paging, p_args = build_paging(start, length)
+
         args = cw_args + cwu_args + w_args
 
+        # Drop rows where every column is NULL (a row-valued IS NULL is true when all fields are NULL)
+        if where:
+            where = 'WHERE (%s) AND NOT (data IS NULL)' % where[len('WHERE '):]
+        else:
+            where = 'WHERE NOT (data IS NULL)'
+
         # Build the query
-        query = 'SELECT * FROM (SELECT %s FROM %s %s %s %s %s) AS data %s %s' \
-                % (extracted_columns['column_string'], table_name, join, c_where, group, union, where, order)
+        subquery = '(SELECT %s FROM %s %s %s %s %s) AS data' \
+                   % (extracted_columns['column_string'], table_name, join, c_where, group, union)
 
-        # logger.debug("Query: %s" % query)
+        if seek_columns:
+            # Counting the remaining rows would scan past the page, so it is skipped for keyset queries
+            query = 'SELECT data.* FROM %s %s %s' % (subquery, where, order)
+        else:
+            query = 'SELECT data.*, COUNT(*) OVER () AS ssp_filtered_count FROM %s %s %s %s' \
+                    % (subquery, where, order, paging)
 
-        # Execute the query
-        filtered = self._select(query, args=args)
+        # logger.debug("Query: %s" % query)
 
-        # Remove NULL rows
-        filtered = [row for row in filtered if not all(v is None for v in row.values())]
+        # Execute the query, only the requested page is returned by the database
+        result = self._select(query, args=args + p_args)
+
+        if seek_columns:
+            filtered_count = None
+        elif result:
+            filtered_count = result[0]['ssp_filtered_count']
+            for row in result:
+                del row['ssp_filtered_count']
+        elif start:
+            # Requested page is past the end of the results, count the filtered rows separately
+            filtered_count = self._select('SELECT COUNT(*) AS filtered_count FROM %s %s' % (subquery, where),
+                                          args=args)[0]['filtered_count']
+        else:
+            filtered_count = 0
 
         # Build grand totals
-        totalcount = self._select('SELECT COUNT(id) as total_count from %s' % table_name)[0]['total_count']
+        totalcount = counts.get_total_count(table_name)
 
         # Get draw counter
         draw_counter = int(parameters['draw'])
 
-        # Paginate results
-        result = filtered[parameters['start']:(parameters['start'] + parameters['length'])]
-
         output = {'result': result,
                   'draw': draw_counter,
-                  'filteredCount': len(filtered),
+                  'filteredCount': filtered_count,
                   'totalCount': totalcount}
 
+        if seek_columns:
+            if result and length >= 0 and len(result) == length:
+                output['nextCursor'] = encode_cursor([result[-1][named] for _, named in seek_columns])
+            else:
+                output['nextCursor'] = None
+
         return output
 
 
@@ -187,6 +249,98 @@ def build_grouping(group_by=None):
     return group
 
 
+def build_paging(start=0, length=None):
+    # Build LIMIT/OFFSET parameters, a negative length returns all rows
+    paging = ''
+    args = []
+
+    if length is not None and length >= 0:
+        paging += 'LIMIT ? '
+        args.append(length)
+    if start:
+        paging += 'OFFSET ?'
+        args.append(start)
+
+    return paging.rstrip(), args
+
+
+def build_seek(seek_columns=None, seek_values=None):
+    # Build a descending row value comparison for keyset pagination
+    if seek_columns is None:
+        seek_columns = []
+    if seek_values is None:
+        seek_values = []
+
+    seek = '(%s) < (%s)' % (', '.join(column for column, _ in seek_columns),
+                            ', '.join(['?'] * len(seek_columns)))
+
+    return seek, list(seek_values)
+
+
+def build_row_where(search_param='', extracted_columns=None, dt_columns=None):
+    # Build the search parameters on the ungrouped rows of a keyset page. A column aggregated
+    # with MAX or MIN is searched on the aggregated expression, other aggregates can't be searched.
+    if extracted_columns is None:
+        extracted_columns = extract_columns()
+    if dt_columns is None:
+        dt_columns = []
+    where = ''
+    args = []
+
+    if search_param:
+        named = [n.lower() for n in extracted_columns['column_named']]
+        for s in dt_columns:
+            if not s['searchable'] or not s['data'] or s['data'].lower() not in named:
+                continue
+            row_column = row_expression(extracted_columns['column_literal'][named.index(s['data'].lower())])
+            if row_column:
+                where += row_column + ' ILIKE ? OR '
+                args.append('%' + search_param + '%')
+        where = where.rstrip(' OR ')
+
+    return where, args
+
+
+def row_expression(column_literal):
+    # Return the expression of a column for a single ungrouped row, or None if it is another aggregate
+    match = re.match(r'^(?:MAX|MIN)\((.*)\)$', column_literal.strip(), re.IGNORECASE | re.DOTALL)
+    if match:
+        inner = match.group(1)
+        # Make sure the parentheses of MAX(...) enclose the whole expression
+        depth = 0
+        for c in inner:
+            depth += (c == '(') - (c == ')')
+            if depth < 0:
+                return None
+        return inner
+    if re.search(r'\(', column_literal):
+        return None
+    return column_literal
+
+
+def encode_cursor(values):
+    # Encode the last seen row values as an opaque keyset pagination cursor
+    raw = ':'.join(str(helpers.cast_to_int(v)) for v in values)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('utf-8').rstrip('=')
+
+
+def decode_cursor(cursor, length=2):
+    # Decode a keyset pagination cursor, returns None if the cursor is invalid
+    if not cursor:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        values = [int(v) for v in raw.split(':')]
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+    if len(values) != length:
+        return None
+
+    return values
+
+
 def build_join(join_types=None, join_tables=None, join_evals=None):
     # Build join parameters
     if join_types is None:
@@ -221,8 +375,9 @@ def build_custom_where(custom_where=None):
             clause = clause[:-5] + ' ILIKE'
 
         if clause.endswith(' IN') and isinstance(w[1], (list, tuple)) and len(w[1]):
-            c_where += clause + '(' + ','.join(['?'] * len(w[1])) + ')' + and_or
-            args += w[1]
+            # One expanding parameter keeps the query shape independent of the list length
+            c_where += clause + ' ?' + and_or
+            args.append(compiled.InList(w[1]))
         elif isinstance(w[1], (list, tuple)) and len(w[1]):
             c_where += '('
             for w_ in w[1]:
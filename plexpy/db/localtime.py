@@ -0,0 +1,126 @@
+"""
+Precomputed local date, hour and day of week for ``session_history``.
+
+Grouping or filtering on ``to_char(timezone(tz, to_timestamp(started)))``
+can't use an index, so each history row stores its local date, hour and day
+of week in the server timezone. The timezone the columns were computed with is
+kept in ``version_info`` and the columns are recomputed when it changes.
+"""
+
+from typing import Any, Dict, Optional
+
+import arrow
+from sqlalchemy import Integer, cast, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import plexpy
+from plexpy.db.models import SessionHistory, VersionInfo
+from plexpy.db.queries import time as time_queries
+from plexpy.db.session import session_scope
+from plexpy.util import logger
+
+
+LOCAL_TIMEZONE_KEY = 'history_local_timezone'
+
+BACKFILL_BATCH_SIZE = 50000
+
+
+def timezone_name() -> str:
+    timezone = plexpy.SYS_TIMEZONE or 'UTC'
+    return getattr(timezone, 'zone', None) or str(timezone)
+
+
+def range_start_date(time_range: int, end: Any = None) -> str:
+    """Return the first local date of the time_range days ending on end, or today."""
+    end = arrow.get(end) if end else arrow.now(timezone_name())
+    return end.shift(days=-(time_range - 1)).format('YYYY-MM-DD')
+
+
+def range_end_date(time_range: int, start: Any) -> str:
+    """Return the last local date of the time_range days starting on start."""
+    return arrow.get(start).shift(days=time_range - 1).format('YYYY-MM-DD')
+
+
+def local_columns(started: Any, tz_name: Optional[str] = None) -> Dict[str, Any]:
+    """Return SQL expressions for the local time columns of a started timestamp."""
+    localtime = time_queries.timezone(tz_name or timezone_name(), time_queries.to_timestamp(started))
+    return {
+        'local_date': time_queries.to_char(localtime, 'YYYY-MM-DD'),
+        'local_hour': cast(time_queries.extract('hour', localtime), Integer),
+        'local_dow': cast(time_queries.extract('dow', localtime), Integer),
+    }
+
+
+def local_values(started: Any) -> Dict[str, Any]:
+    """Return insert values for the local time columns of a history row."""
+    if started is None:
+        return {}
+    return local_columns(started)
+
+
+def _set_local_timezone(db_session, tz_name: str) -> None:
+    stmt = pg_insert(VersionInfo).values(key=LOCAL_TIMEZONE_KEY, value=tz_name)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[VersionInfo.key],
+        set_={'value': stmt.excluded.value},
+    )
+    db_session.execute(stmt)
+
+
+def backfill_local_columns(only_missing: bool = False) -> bool:
+    """Compute the local time columns in batches of history row ids."""
+    tz_name = timezone_name()
+
+    with session_scope() as db_session:
+        min_id, max_id = db_session.execute(
+            select(func.min(SessionHistory.id), func.max(SessionHistory.id))
+        ).one()
+
+    if min_id is not None:
+        logger.info("Tautulli LocalTime :: Computing local history dates for timezone %s...", tz_name)
+
+        for batch_start in range(min_id, max_id + 1, BACKFILL_BATCH_SIZE):
+            stmt = (
+                update(SessionHistory)
+                .where(
+                    SessionHistory.id >= batch_start,
+                    SessionHistory.id < batch_start + BACKFILL_BATCH_SIZE,
+                    SessionHistory.started.isnot(None),
+                )
+                .values(**local_columns(SessionHistory.started, tz_name))
+            )
+            if only_missing:
+                stmt = stmt.where(SessionHistory.local_date.is_(None))
+            with session_scope() as db_session:
+                db_session.execute(stmt)
+
+    with session_scope() as db_session:
+        _set_local_timezone(db_session, tz_name)
+
+    return True
+
+
+def check_local_columns() -> bool:
+    """Fill in missing local time columns, or recompute them all if the server
+    timezone changed. Returns True if any columns were recomputed.
+    """
+    try:
+        with session_scope() as db_session:
+            stmt = select(VersionInfo.value).where(VersionInfo.key == LOCAL_TIMEZONE_KEY)
+            local_timezone = db_session.execute(stmt).scalar_one_or_none()
+
+            stmt = (
+                select(SessionHistory.id)
+                .where(SessionHistory.local_date.is_(None), SessionHistory.started.isnot(None))
+                .limit(1)
+            )
+            missing = db_session.execute(stmt).scalar_one_or_none() is not None
+
+        if local_timezone != timezone_name():
+            return backfill_local_columns()
+        if missing:
+            return backfill_local_columns(only_missing=True)
+    except Exception as e:
+        logger.warn("Tautulli LocalTime :: Unable to compute local history dates: %s." % e)
+
+    return False
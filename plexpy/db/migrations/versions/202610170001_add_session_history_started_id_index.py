@@ -0,0 +1,27 @@
+"""Add session history (started, id) index for keyset pagination.
+
+Revision ID: 202610170001
+Revises: 202602060001
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+from alembic import op
+
+
+revision = '202610170001'
+down_revision = '202602060001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'idx_session_history_started_id',
+        'session_history',
+        ['started', 'id'],
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_session_history_started_id', table_name='session_history', if_exists=True)
@@ -0,0 +1,46 @@
+"""Add session history daily rollup table.
+
+Revision ID: 202610170002
+Revises: 202610170001
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '202610170002'
+down_revision = '202610170001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'session_history_daily',
+        sa.Column('id', sa.Integer(), sa.Identity(always=False), nullable=False),
+        sa.Column('date_played', sa.Text(), nullable=False),
+        sa.Column('hour', sa.Integer(), nullable=True),
+        sa.Column('day_of_week', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('section_id', sa.Integer(), nullable=True),
+        sa.Column('platform', sa.Text(), nullable=True),
+        sa.Column('media_type', sa.Text(), nullable=True),
+        sa.Column('live', sa.Integer(), server_default=sa.text('0'), nullable=True),
+        sa.Column('transcode_decision', sa.Text(), nullable=True),
+        sa.Column('plays', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('grouped_plays', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('duration', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('last_started', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name='pk_session_history_daily'),
+    )
+    op.create_index('idx_session_history_daily_date_played', 'session_history_daily', ['date_played'], unique=False)
+    op.create_index('idx_session_history_daily_user_id_date_played', 'session_history_daily', ['user_id', 'date_played'], unique=False)
+    op.create_index('idx_session_history_daily_section_id_date_played', 'session_history_daily', ['section_id', 'date_played'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_session_history_daily_section_id_date_played', table_name='session_history_daily')
+    op.drop_index('idx_session_history_daily_user_id_date_played', table_name='session_history_daily')
+    op.drop_index('idx_session_history_daily_date_played', table_name='session_history_daily')
+    op.drop_table('session_history_daily')
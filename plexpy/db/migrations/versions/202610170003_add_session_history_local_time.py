@@ -0,0 +1,32 @@
+"""Add session history local date, hour and day of week columns.
+
+Revision ID: 202610170003
+Revises: 202610170002
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '202610170003'
+down_revision = '202610170002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Values depend on the server timezone and are backfilled at startup
+    op.add_column('session_history', sa.Column('local_date', sa.Text(), nullable=True))
+    op.add_column('session_history', sa.Column('local_hour', sa.Integer(), nullable=True))
+    op.add_column('session_history', sa.Column('local_dow', sa.Integer(), nullable=True))
+    op.create_index('idx_session_history_local_date', 'session_history', ['local_date'], unique=False)
+    op.create_index('idx_session_history_user_id_local_date', 'session_history', ['user_id', 'local_date'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_session_history_user_id_local_date', table_name='session_history')
+    op.drop_index('idx_session_history_local_date', table_name='session_history')
+    op.drop_column('session_history', 'local_dow')
+    op.drop_column('session_history', 'local_hour')
+    op.drop_column('session_history', 'local_date')
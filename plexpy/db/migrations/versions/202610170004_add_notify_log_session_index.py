@@ -0,0 +1,27 @@
+"""Add notify_log (session_key, rating_key, user_id, notify_action) index for notify state lookups.
+
+Revision ID: 202610170004
+Revises: 202610170003
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+from alembic import op
+
+
+revision = '202610170004'
+down_revision = '202610170003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'idx_notify_log_session_rating_user',
+        'notify_log',
+        ['session_key', 'rating_key', 'user_id', 'notify_action'],
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_notify_log_session_rating_user', table_name='notify_log', if_exists=True)
@@ -0,0 +1,39 @@
+"""Add durable notification queue table.
+
+Revision ID: 202610170005
+Revises: 202610170004
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '202610170005'
+down_revision = '202610170004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'notify_queue',
+        sa.Column('id', sa.Integer(), sa.Identity(always=False), nullable=False),
+        sa.Column('created_at', sa.Integer(), nullable=True),
+        sa.Column('available_at', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('locked_until', sa.Integer(), nullable=True),
+        sa.Column('locked_by', sa.Text(), nullable=True),
+        sa.Column('attempts', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('notifier_id', sa.Integer(), nullable=True),
+        sa.Column('agent_id', sa.Integer(), nullable=True),
+        sa.Column('notify_action', sa.Text(), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name='pk_notify_queue'),
+    )
+    op.create_index('idx_notify_queue_available_at', 'notify_queue', ['available_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_notify_queue_available_at', table_name='notify_queue')
+    op.drop_table('notify_queue')
@@ -0,0 +1,24 @@
+"""Add exports base export column for incremental exports.
+
+Revision ID: 202610170006
+Revises: 202610170005
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '202610170006'
+down_revision = '202610170005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The export an incremental export was merged with
+    op.add_column('exports', sa.Column('base_export_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('exports', 'base_export_id')
@@ -28,7 +28,12 @@ UTCDateTime = DateTime(timezone=True)
 
 from plexpy.db.models.common import VersionInfo
 from plexpy.db.models.exports import Export
-from plexpy.db.models.history import SessionHistory, SessionHistoryMediaInfo, SessionHistoryMetadata
+from plexpy.db.models.history import (
+    SessionHistory,
+    SessionHistoryDaily,
+    SessionHistoryMediaInfo,
+    SessionHistoryMetadata,
+)
 from plexpy.db.models.libraries import LibrarySection, RecentlyAdded
 from plexpy.db.models.lookups import (
     CloudinaryLookup,
@@ -40,7 +45,7 @@ from plexpy.db.models.lookups import (
 )
 from plexpy.db.models.mobile import MobileDevice
 from plexpy.db.models.newsletters import Newsletter, NewsletterLog
-from plexpy.db.models.notifications import Notifier, NotifyLog
+from plexpy.db.models.notifications import Notifier, NotifyLog, NotifyQueue
 from plexpy.db.models.sessions import Session, SessionContinued
 from plexpy.db.models.users import User, UserLogin
 
@@ -61,10 +66,12 @@ __all__ = [
     'NewsletterLog',
     'Notifier',
     'NotifyLog',
+    'NotifyQueue',
     'RecentlyAdded',
     'Session',
     'SessionContinued',
     'SessionHistory',
+    'SessionHistoryDaily',
     'SessionHistoryMediaInfo',
     'SessionHistoryMetadata',
     'TheMovieDbLookup',
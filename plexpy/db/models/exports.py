@@ -28,3 +28,4 @@ class Export(Base):
     complete: Mapped[Optional[int]] = mapped_column(Integer, server_default=text('0'))
     exported_items: Mapped[Optional[int]] = mapped_column(Integer, server_default=text('0'))
     total_items: Mapped[Optional[int]] = mapped_column(Integer, server_default=text('0'))
+    base_export_id: Mapped[Optional[int]] = mapped_column(Integer)
@@ -20,6 +20,9 @@ class SessionHistory(Base):
         Index('idx_session_history_section_id', 'section_id'),
         Index('idx_session_history_section_id_stopped', 'section_id', 'stopped'),
         Index('idx_session_history_reference_id', 'reference_id'),
+        Index('idx_session_history_started_id', 'started', 'id'),
+        Index('idx_session_history_local_date', 'local_date'),
+        Index('idx_session_history_user_id_local_date', 'user_id', 'local_date'),
     )
 
     id: Mapped[int] = auto_pk()
@@ -48,6 +51,10 @@ class SessionHistory(Base):
     media_type: Mapped[Optional[str]] = mapped_column(Text)
     section_id: Mapped[Optional[int]] = mapped_column(Integer)
     view_offset: Mapped[Optional[int]] = mapped_column(Integer, server_default=text('0'))
+    # Local time of started in the server timezone, see plexpy.db.localtime
+    local_date: Mapped[Optional[str]] = mapped_column(Text)
+    local_hour: Mapped[Optional[int]] = mapped_column(Integer)
+    local_dow: Mapped[Optional[int]] = mapped_column(Integer)
 
 
 class SessionHistoryMediaInfo(Base):
@@ -195,3 +202,27 @@ class SessionHistoryMetadata(Base):
     channel_vcn: Mapped[Optional[str]] = mapped_column(Text)
     marker_credits_first: Mapped[Optional[int]] = mapped_column(Integer)
     marker_credits_final: Mapped[Optional[int]] = mapped_column(Integer)
+
+
+class SessionHistoryDaily(Base):
+    __tablename__ = 'session_history_daily'
+    __table_args__ = (
+        Index('idx_session_history_daily_date_played', 'date_played'),
+        Index('idx_session_history_daily_user_id_date_played', 'user_id', 'date_played'),
+        Index('idx_session_history_daily_section_id_date_played', 'section_id', 'date_played'),
+    )
+
+    id: Mapped[int] = auto_pk()
+    date_played: Mapped[str] = mapped_column(Text, nullable=False)
+    hour: Mapped[Optional[int]] = mapped_column(Integer)
+    day_of_week: Mapped[Optional[int]] = mapped_column(Integer)
+    user_id: Mapped[Optional[int]] = mapped_column(Integer)
+    section_id: Mapped[Optional[int]] = mapped_column(Integer)
+    platform: Mapped[Optional[str]] = mapped_column(Text)
+    media_type: Mapped[Optional[str]] = mapped_column(Text)
+    live: Mapped[Optional[int]] = mapped_column(Integer, server_default=text('0'))
+    transcode_decision: Mapped[Optional[str]] = mapped_column(Text)
+    plays: Mapped[int] = mapped_column(Integer, server_default=text('0'))
+    grouped_plays: Mapped[int] = mapped_column(Integer, server_default=text('0'))
+    duration: Mapped[int] = mapped_column(Integer, server_default=text('0'))
+    last_started: Mapped[Optional[int]] = mapped_column(Integer)
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from sqlalchemy import ForeignKey, Integer, Text, text
+from sqlalchemy import ForeignKey, Index, Integer, Text, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from plexpy.db.models import Base, auto_pk
@@ -87,6 +87,9 @@ class Notifier(Base):
 
 class NotifyLog(Base):
     __tablename__ = 'notify_log'
+    __table_args__ = (
+        Index('idx_notify_log_session_rating_user', 'session_key', 'rating_key', 'user_id', 'notify_action'),
+    )
 
     id: Mapped[int] = auto_pk()
     timestamp: Mapped[Optional[int]] = mapped_column(Integer)
@@ -109,3 +112,22 @@ class NotifyLog(Base):
     poster_url: Mapped[Optional[str]] = mapped_column(Text)
     success: Mapped[Optional[int]] = mapped_column(Integer, server_default=text('0'))
     tag: Mapped[Optional[str]] = mapped_column(Text)
+
+
+class NotifyQueue(Base):
+    __tablename__ = 'notify_queue'
+    __table_args__ = (
+        Index('idx_notify_queue_available_at', 'available_at', 'id'),
+    )
+
+    id: Mapped[int] = auto_pk()
+    created_at: Mapped[Optional[int]] = mapped_column(Integer)
+    available_at: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text('0'))
+    locked_until: Mapped[Optional[int]] = mapped_column(Integer)
+    locked_by: Mapped[Optional[str]] = mapped_column(Text)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text('0'))
+    notifier_id: Mapped[Optional[int]] = mapped_column(Integer)
+    agent_id: Mapped[Optional[int]] = mapped_column(Integer)
+    notify_action: Mapped[Optional[str]] = mapped_column(Text)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+    last_error: Mapped[Optional[str]] = mapped_column(Text)
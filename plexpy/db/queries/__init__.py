@@ -1,9 +1,26 @@
 from __future__ import annotations
 
-from typing import Any, Mapping, Optional, Sequence
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence
 
+from sqlalchemy import (
+    Index,
+    String,
+    Table,
+    Text,
+    UniqueConstraint,
+    cast,
+    column,
+    false,
+    func,
+    literal_column,
+    or_,
+    select,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from sqlalchemy.sql import Select
+from sqlalchemy.sql import Select, Update
 
 from plexpy.util import logger
 
@@ -42,5 +59,184 @@ def apply_pagination(
     return stmt
 
 
+def escape_like(value: str, escape: str = '\\') -> str:
+    """Escape the LIKE wildcards in ``value`` so it matches literally."""
+    return value.replace(escape, escape * 2).replace('%', escape + '%').replace('_', escape + '_')
+
+
+def fetch_datatable_rows(
+    session: Session,
+    stmt: Select,
+    json_data: Mapping[str, Any],
+    default_sort: str,
+    search_cols: Optional[Sequence[str]] = None,
+) -> dict[str, Any]:
+    """SQL counterpart of ``helpers.process_datatable_rows``.
+
+    Searching, sorting and paging of the DataTables request are applied to
+    ``stmt`` in the database so only the requested page is loaded.
+    """
+    data = stmt.subquery('data')
+    columns = data.c
+
+    def sort_expr(name):
+        column = columns[name]
+        if isinstance(column.type, String):
+            return func.lower(column)
+        return column
+
+    filtered = select(data, func.count().over().label('dt_filtered_count'))
+
+    search_value = json_data['search']['value'].lower()
+    if search_value:
+        searchable_columns = [d['data'] for d in json_data['columns'] if d['searchable']] + list(search_cols or [])
+        pattern = '%' + escape_like(search_value) + '%'
+        conditions = [cast(columns[name], Text).ilike(pattern, escape='\\')
+                      for name in searchable_columns if name in columns]
+        filtered = filtered.where(or_(*conditions) if conditions else false())
+
+    order_by = []
+    for order in json_data['order']:
+        sort_key = json_data['columns'][int(order['column'])]['data']
+        if sort_key in columns:
+            expr = sort_expr(sort_key)
+            order_by.append(expr.desc() if order['dir'] == 'desc' else expr.asc())
+    if default_sort in columns:
+        order_by.append(sort_expr(default_sort))
+    filtered = filtered.order_by(*order_by)
+
+    start = max(json_data.get('start') or 0, 0)
+    length = json_data.get('length')
+    filtered = apply_pagination(filtered,
+                                start=start or None,
+                                length=length if length is not None and length >= 0 else None)
+
+    results = fetch_mappings(session, filtered)
+    if results:
+        filtered_count = results[0]['dt_filtered_count']
+    elif start:
+        # Requested page is past the end of the results, count the filtered rows separately
+        count_stmt = select(func.count()).select_from(filtered.limit(None).offset(None).order_by(None).subquery())
+        filtered_count = fetch_scalar(session, count_stmt, default=0)
+    else:
+        filtered_count = 0
+
+    for row in results:
+        del row['dt_filtered_count']
+
+    return {
+        'results': results,
+        'filtered_count': filtered_count,
+    }
+
+
+def update_from_values(
+    table: Table,
+    rows: Sequence[Mapping[str, Any]],
+    keys: Sequence[str],
+    columns: Sequence[str] = (),
+    **extra_values: Any,
+) -> Update:
+    """Build ``UPDATE table SET ... FROM (VALUES ...) AS v WHERE table.key = v.key``.
+
+    Every row supplies the ``keys`` and ``columns`` values for one target row.
+    ``columns`` are copied from the VALUES list, ``extra_values`` are applied to
+    every matched row. VALUES columns are cast to the table column types so
+    all-NULL columns don't resolve to text.
+    """
+    names = list(keys) + [name for name in columns if name not in keys]
+    data = values(*[column(name) for name in names], name='v').data(
+        [tuple(row[name] for name in names) for row in rows]
+    )
+
+    def value_of(name):
+        return cast(data.c[name], table.c[name].type)
+
+    set_values = {name: value_of(name) for name in columns}
+    set_values.update(extra_values)
+
+    return (
+        update(table)
+        .where(*[table.c[name] == value_of(name) for name in keys])
+        .values(**set_values)
+    )
+
+
+# Stay well below the 65535 bind parameter limit of a PostgreSQL statement
+UPSERT_MAX_PARAMS = 30000
+
+
+def has_unique_key(table: Table, keys: Iterable[str]) -> bool:
+    """Return True if the primary key, a unique constraint or a unique index covers exactly ``keys``."""
+    keys = set(keys)
+    if keys and keys == {c.name for c in table.primary_key.columns}:
+        return True
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint) and keys == {c.name for c in constraint.columns}:
+            return True
+    for index in table.indexes:
+        if isinstance(index, Index) and index.unique and keys == {c.name for c in index.columns}:
+            return True
+    # Single column unique=True
+    return len(keys) == 1 and any(c.unique for c in table.columns if c.name in keys)
+
+
+def upsert_many(
+    session: Session,
+    table: Table,
+    rows: Iterable[Mapping[str, Any]],
+    keys: Sequence[str],
+    update_columns: Optional[Sequence[str]] = None,
+    set_values: Optional[Callable[[Any], Dict[str, Any]]] = None,
+    returning: Sequence[str] = (),
+) -> List[Dict[str, Any]]:
+    """Insert ``rows`` with ``INSERT ... ON CONFLICT (keys) DO UPDATE``.
+
+    ``keys`` must match a unique index of the table. Conflicting rows get the
+    ``update_columns`` (default: every non-key column of the row) from the new
+    row, and ``set_values(excluded)`` can override the SET expressions. Rows
+    with the same keys are collapsed to the last one, rows with different
+    columns go to separate statements and large batches are split to respect
+    the bind parameter limit.
+
+    Returns the ``returning`` columns of every row plus ``inserted``, which is
+    True for new rows and False for updated ones.
+    """
+    groups: Dict[tuple, Dict[tuple, Mapping[str, Any]]] = {}
+    for row in rows:
+        row_keys = tuple(row.get(key) for key in keys)
+        # NULL keys never conflict, don't collapse them
+        dedupe_key = row_keys if None not in row_keys else ('__row__', id(row))
+        groups.setdefault(tuple(sorted(row)), {})[dedupe_key] = row
+
+    results: List[Dict[str, Any]] = []
+    for columns, group in groups.items():
+        group_rows = list(group.values())
+        batch_size = max(1, UPSERT_MAX_PARAMS // max(1, len(columns)))
+
+        for start in range(0, len(group_rows), batch_size):
+            stmt = pg_insert(table).values(group_rows[start:start + batch_size])
+
+            names = update_columns if update_columns is not None else [c for c in columns if c not in keys]
+            set_ = {name: stmt.excluded[name] for name in names if name in columns}
+            if set_values:
+                set_.update(set_values(stmt.excluded))
+
+            if set_:
+                stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_=set_)
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=list(keys))
+
+            if returning:
+                # xmax is only zero for rows this statement inserted
+                stmt = stmt.returning(*[table.c[name] for name in returning],
+                                      literal_column('(xmax = 0)').label('inserted'))
+                results.extend(dict(row) for row in session.execute(stmt).mappings())
+            else:
+                session.execute(stmt)
+
+    return results
+
+
 def log_query_failure(message: str, exc: Exception) -> None:
     logger.warn("%s: %s.", message, exc)
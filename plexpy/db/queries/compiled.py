@@ -0,0 +1,75 @@
+"""
+Shared compilation of the legacy ``?`` placeholder SQL strings.
+
+The raw DataTables and stats queries are written with qmark placeholders.
+``bind`` rewrites them to named parameters once per query shape and caches
+the resulting ``TextClause``, so repeated queries skip the rewrite and reach
+the driver with identical SQL text. ``InList`` arguments are bound as a
+single expanding parameter, so ``IN ?`` keeps one cache entry whatever the
+number of values.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.sql.elements import TextClause
+
+
+# Number of distinct query shapes kept compiled
+QUERY_CACHE_SIZE = 512
+
+
+class InList(tuple):
+    """Values for an ``IN ?`` placeholder, bound as one expanding parameter."""
+    __slots__ = ()
+
+
+def param_name(index: int) -> str:
+    return 'param_%d' % index
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _split(query: str) -> Tuple[str, ...]:
+    return tuple(query.split('?'))
+
+
+def placeholder_count(query: str) -> int:
+    return len(_split(query)) - 1
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def compile_query(query: str, count: int = 0, expanding: Tuple[int, ...] = ()) -> TextClause:
+    """
+    Return the ``TextClause`` for the query with the first ``count`` placeholders
+    replaced by ``:param_1`` ... ``:param_<count>``. The 1-based positions in
+    ``expanding`` are declared as expanding parameters.
+    """
+    parts = _split(query)
+    count = min(count, len(parts) - 1)
+
+    sql = [parts[0]]
+    for index in range(1, count + 1):
+        sql.append(':' + param_name(index))
+        sql.append(parts[index])
+    if count + 1 < len(parts):
+        sql.append('?' + '?'.join(parts[count + 1:]))
+
+    clause = text(''.join(sql))
+    if expanding:
+        clause = clause.bindparams(*[bindparam(param_name(index), expanding=True) for index in expanding])
+    return clause
+
+
+def bind(query: str, args: Iterable[Any] = ()) -> Tuple[TextClause, Dict[str, Any]]:
+    """Return the cached ``TextClause`` for the query and the named parameters for the args."""
+    args = list(args or ())
+    params = {param_name(index): value for index, value in enumerate(args, start=1)}
+    expanding = tuple(index for index, value in enumerate(args, start=1) if isinstance(value, InList))
+    return compile_query(query, len(args), expanding), params
+
+
+def cache_info():
+    return compile_query.cache_info()
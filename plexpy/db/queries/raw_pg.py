@@ -1,27 +1,15 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+from typing import Optional, Sequence
 
 from sqlalchemy import text
 
 from plexpy.db import datatables
 from plexpy.db.engine import get_engine
+from plexpy.db.queries import compiled
 from plexpy.db.session import session_scope
 
 
-def _bind_params(query: str, args: Iterable[Any]) -> Tuple[str, Dict[str, Any]]:
-    if not args:
-        return query, {}
-
-    params: Dict[str, Any] = {}
-    for idx, value in enumerate(args, start=1):
-        param_name = f"param_{idx}"
-        query = query.replace('?', f":{param_name}", 1)
-        params[param_name] = value
-
-    return query, params
-
-
 def fetch_total_duration(custom_where: Optional[Sequence] = None) -> int:
     where, args = datatables.build_custom_where(custom_where=custom_where)
     query = (
@@ -32,10 +20,10 @@ def fetch_total_duration(custom_where: Optional[Sequence] = None) -> int:
         "JOIN session_history_media_info ON session_history_media_info.id = session_history.id "
         "%s " % where
     )
-    query, params = _bind_params(query, args)
+    query, params = compiled.bind(query, args)
 
     with session_scope() as db_session:
-        row = db_session.execute(text(query), params).mappings().first()
+        row = db_session.execute(query, params).mappings().first()
 
     return row['total_duration'] if row else 0
 
@@ -0,0 +1,235 @@
+"""
+Set-based regrouping of ``session_history.reference_id``.
+
+``ActivityProcessor.group_history`` links a new history row to the previous
+row of the same user and item when the previous play was not watched and the
+new one continues from it. Regrouping the whole history row by row costs two
+round trips per row, so this module computes the same chains with window
+functions: each row is compared to the previous row of its
+``(user_id, rating_key)`` partition with ``LAG``, rows that don't continue the
+previous play start a new group, and every row takes the ``reference_id`` of
+the first row of its group. The result is applied with one bulk UPDATE per
+chunk of users.
+
+Live TV rows follow ``group_history`` and are grouped with the last row the
+user played in the past day when the guid matches, using that row's stored
+``reference_id``.
+"""
+
+from typing import Callable, List, Optional, Sequence
+
+from sqlalchemy import Float, and_, case, cast, false, func, literal, or_, select, true, update
+
+import plexpy
+from plexpy.db.models import SessionHistory, SessionHistoryMetadata
+from plexpy.db.session import session_scope
+from plexpy.util import helpers
+
+
+# Number of users regrouped per transaction
+CHUNK_USERS = 50
+
+
+def _watched_expr(media_type, view_offset, duration, marker_first, marker_final):
+    """SQL counterpart of ``helpers.check_watched``."""
+    # Match the float arithmetic of check_watched exactly
+    percent = case(
+        (media_type == 'movie', literal(plexpy.CONFIG.MOVIE_WATCHED_PERCENT / 100, Float)),
+        (media_type == 'episode', literal(plexpy.CONFIG.TV_WATCHED_PERCENT / 100, Float)),
+        (media_type == 'track', literal(plexpy.CONFIG.MUSIC_WATCHED_PERCENT / 100, Float)),
+        (media_type == 'clip', literal(plexpy.CONFIG.TV_WATCHED_PERCENT / 100, Float)),
+        else_=literal(0.0, Float),
+    )
+    threshold = percent * cast(func.coalesce(duration, 0), Float)
+
+    whens = [(threshold == 0, false())]
+    if plexpy.CONFIG.WATCHED_MARKER == 1:
+        whens.append((func.coalesce(marker_final, 0) != 0, view_offset >= marker_final))
+    elif plexpy.CONFIG.WATCHED_MARKER == 2:
+        whens.append((func.coalesce(marker_first, 0) != 0, view_offset >= marker_first))
+    elif plexpy.CONFIG.WATCHED_MARKER == 3:
+        whens.append((func.coalesce(marker_first, 0) != 0, view_offset >= func.least(threshold, marker_first)))
+
+    return case(*whens, else_=view_offset >= threshold)
+
+
+def regroup_select(user_ids: Optional[Sequence[Optional[int]]] = None, min_started: Optional[int] = None):
+    """
+    Return a select of (id, reference_id) for the regrouped history rows of
+    the given users, or all users.
+    """
+    if min_started is None:
+        min_started = helpers.timestamp() - 24 * 60 * 60
+
+    history = SessionHistory.__table__
+    metadata = SessionHistoryMetadata.__table__
+
+    has_metadata = metadata.c.id.isnot(None)
+    is_live = func.coalesce(metadata.c.live, 0) != 0
+    view_offset = func.coalesce(history.c.view_offset, 0)
+
+    window = {
+        'partition_by': (history.c.user_id, history.c.rating_key),
+        'order_by': history.c.id,
+    }
+    prev_id = func.lag(history.c.id).over(**window)
+    prev_view_offset = func.lag(view_offset).over(**window)
+
+    # Last row of the user in the past day, for live TV rows
+    prev_history = SessionHistory.__table__.alias('prev_history')
+    prev_metadata = SessionHistoryMetadata.__table__.alias('prev_metadata')
+    prev_live = (
+        select(literal(1).label('found'), prev_history.c.reference_id, prev_metadata.c.guid)
+        .join(prev_metadata, prev_metadata.c.id == prev_history.c.id)
+        .where(
+            is_live,
+            prev_history.c.id <= history.c.id,
+            prev_history.c.user_id.is_not_distinct_from(history.c.user_id),
+            prev_history.c.started >= min_started,
+        )
+        .order_by(prev_history.c.id.desc())
+        .limit(1)
+        .lateral('prev_live')
+    )
+
+    stmt = (
+        select(
+            history.c.id,
+            history.c.user_id,
+            history.c.rating_key,
+            has_metadata.label('has_metadata'),
+            is_live.label('is_live'),
+            history.c.reference_id.label('old_reference_id'),
+            view_offset.label('view_offset'),
+            prev_id.label('prev_id'),
+            prev_view_offset.label('prev_view_offset'),
+            history.c.media_type,
+            metadata.c.duration,
+            metadata.c.marker_credits_first,
+            metadata.c.marker_credits_final,
+            metadata.c.guid,
+            prev_live.c.guid.label('prev_live_guid'),
+            prev_live.c.reference_id.label('prev_live_reference_id'),
+            prev_live.c.found.isnot(None).label('has_prev_live'),
+        )
+        .select_from(history)
+        .outerjoin(metadata, metadata.c.id == history.c.id)
+        .outerjoin(prev_live, true())
+    )
+
+    if user_ids is not None:
+        conditions = []
+        known_ids = [user_id for user_id in user_ids if user_id is not None]
+        if known_ids:
+            conditions.append(history.c.user_id.in_(known_ids))
+        if len(known_ids) < len(user_ids):
+            conditions.append(history.c.user_id.is_(None))
+        stmt = stmt.where(or_(*conditions) if conditions else false())
+
+    rows = stmt.subquery('history_rows')
+
+    # A row continues the group of the previous row if the previous play was not watched
+    # and the new play starts at or after where the previous one stopped
+    grouped = and_(
+        rows.c.has_metadata,
+        ~rows.c.is_live,
+        rows.c.user_id.isnot(None),
+        rows.c.rating_key.isnot(None),
+        rows.c.prev_id.isnot(None),
+        ~_watched_expr(rows.c.media_type, rows.c.prev_view_offset, rows.c.duration,
+                       rows.c.marker_credits_first, rows.c.marker_credits_final),
+        rows.c.prev_view_offset <= rows.c.view_offset,
+    )
+    head_reference = case(
+        # Rows without metadata are not regrouped and keep their reference
+        (~rows.c.has_metadata, rows.c.old_reference_id),
+        (and_(rows.c.is_live,
+              rows.c.has_prev_live,
+              rows.c.prev_live_guid.is_not_distinct_from(rows.c.guid)), rows.c.prev_live_reference_id),
+        else_=rows.c.id,
+    )
+
+    heads = (
+        select(
+            rows.c.id,
+            rows.c.user_id,
+            rows.c.rating_key,
+            rows.c.has_metadata,
+            grouped.label('grouped'),
+            head_reference.label('head_reference_id'),
+        )
+        .subquery('heads')
+    )
+
+    # Number the groups by counting the group heads up to each row
+    runs = (
+        select(
+            heads.c.id,
+            heads.c.user_id,
+            heads.c.rating_key,
+            heads.c.has_metadata,
+            heads.c.head_reference_id,
+            func.sum(case((heads.c.grouped, 0), else_=1)).over(
+                partition_by=(heads.c.user_id, heads.c.rating_key),
+                order_by=heads.c.id,
+                rows=(None, 0),
+            ).label('group_number'),
+        )
+        .subquery('runs')
+    )
+
+    groups = (
+        select(
+            runs.c.id,
+            runs.c.has_metadata,
+            func.first_value(runs.c.head_reference_id).over(
+                partition_by=(runs.c.user_id, runs.c.rating_key, runs.c.group_number),
+                order_by=runs.c.id,
+            ).label('reference_id'),
+        )
+        .subquery('groups')
+    )
+
+    return select(groups.c.id, groups.c.reference_id).where(groups.c.has_metadata)
+
+
+def get_user_ids() -> List[Optional[int]]:
+    with session_scope() as db_session:
+        stmt = select(SessionHistory.user_id).distinct()
+        return sorted((row[0] for row in db_session.execute(stmt)), key=lambda user_id: (user_id is None, user_id))
+
+
+def regroup_users(user_ids: Optional[Sequence[Optional[int]]] = None, min_started: Optional[int] = None) -> int:
+    """Regroup the history of the given users, or all users. Returns the number of rows changed."""
+    regrouped = regroup_select(user_ids, min_started=min_started).subquery('regrouped')
+    stmt = (
+        update(SessionHistory)
+        .where(
+            SessionHistory.id == regrouped.c.id,
+            SessionHistory.reference_id.is_distinct_from(regrouped.c.reference_id),
+        )
+        .values(reference_id=regrouped.c.reference_id)
+    )
+    with session_scope() as db_session:
+        result = db_session.execute(stmt)
+        return result.rowcount or 0
+
+
+def regroup_history(chunk_users: int = CHUNK_USERS,
+                    progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Regroup all history in chunks of users. ``progress`` is called with the
+    number of users done and the total after each chunk.
+    """
+    min_started = helpers.timestamp() - 24 * 60 * 60
+    user_ids = get_user_ids()
+    total = len(user_ids)
+    changed = 0
+
+    for start in range(0, total, chunk_users):
+        chunk = user_ids[start:start + chunk_users]
+        changed += regroup_users(chunk, min_started=min_started)
+        if progress:
+            progress(start + len(chunk), total)
+
+    return changed
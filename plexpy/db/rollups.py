@@ -0,0 +1,210 @@
+"""
+Daily rollup of ``session_history`` for graphs and home stats.
+
+``session_history_daily`` holds one row per local day, hour, user, library,
+platform, media type and stream decision. Buckets are recomputed from the raw
+history whenever a history row is written or deleted, and the whole table is
+rebuilt when the server timezone used to assign local days changes. Local days
+come from the precomputed ``session_history`` columns, see ``localtime``.
+"""
+
+import threading
+from typing import Iterable, Optional, Set, Tuple
+
+from sqlalchemy import case, delete, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from plexpy.db import localtime
+from plexpy.db.models import (
+    SessionHistory,
+    SessionHistoryDaily,
+    SessionHistoryMediaInfo,
+    SessionHistoryMetadata,
+    VersionInfo,
+)
+from plexpy.db.session import session_scope
+from plexpy.util import logger
+
+
+ROLLUP_TIMEZONE_KEY = 'history_rollup_timezone'
+
+# Rebuild the whole rollup instead of refreshing more buckets than this
+REBUILD_BUCKET_THRESHOLD = 500
+
+_ROLLUP_COLUMNS = (
+    'date_played',
+    'hour',
+    'day_of_week',
+    'user_id',
+    'section_id',
+    'platform',
+    'media_type',
+    'live',
+    'transcode_decision',
+    'plays',
+    'grouped_plays',
+    'duration',
+    'last_started',
+)
+
+_ROLLUP_LOCK = threading.RLock()
+
+
+def _rollup_select():
+    live = func.coalesce(SessionHistoryMetadata.live, 0)
+    duration = case(
+        (
+            SessionHistory.stopped > 0,
+            (SessionHistory.stopped - SessionHistory.started)
+            - func.coalesce(SessionHistory.paused_counter, 0),
+        ),
+        else_=0,
+    )
+    # Each group of history rows is counted once, on its first row
+    group_head = case(
+        (func.coalesce(SessionHistory.reference_id, SessionHistory.id) == SessionHistory.id, 1),
+        else_=0,
+    )
+
+    stmt = (
+        select(
+            SessionHistory.local_date.label('date_played'),
+            SessionHistory.local_hour.label('hour'),
+            SessionHistory.local_dow.label('day_of_week'),
+            SessionHistory.user_id,
+            SessionHistory.section_id,
+            SessionHistory.platform,
+            SessionHistory.media_type,
+            live.label('live'),
+            SessionHistoryMediaInfo.transcode_decision,
+            func.count().label('plays'),
+            func.sum(group_head).label('grouped_plays'),
+            func.sum(duration).label('duration'),
+            func.max(SessionHistory.started).label('last_started'),
+        )
+        .select_from(SessionHistory)
+        .join(SessionHistoryMetadata, SessionHistoryMetadata.id == SessionHistory.id)
+        .outerjoin(SessionHistoryMediaInfo, SessionHistoryMediaInfo.id == SessionHistory.id)
+        .where(SessionHistory.local_date.isnot(None))
+        .group_by(
+            SessionHistory.local_date,
+            SessionHistory.local_hour,
+            SessionHistory.local_dow,
+            SessionHistory.user_id,
+            SessionHistory.section_id,
+            SessionHistory.platform,
+            SessionHistory.media_type,
+            live,
+            SessionHistoryMediaInfo.transcode_decision,
+        )
+    )
+    return stmt
+
+
+def _insert_rollup(stmt):
+    return insert(SessionHistoryDaily).from_select(list(_ROLLUP_COLUMNS), stmt)
+
+
+def _set_rollup_timezone(db_session, tz_name: str) -> None:
+    stmt = pg_insert(VersionInfo).values(key=ROLLUP_TIMEZONE_KEY, value=tz_name)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[VersionInfo.key],
+        set_={'value': stmt.excluded.value},
+    )
+    db_session.execute(stmt)
+
+
+def get_rollup_buckets(row_ids: Iterable[int]) -> Set[Tuple[str, Optional[int]]]:
+    """Return the (local date, user_id) rollup buckets covering the history rows."""
+    row_ids = [row_id for row_id in row_ids if row_id is not None]
+    if not row_ids:
+        return set()
+
+    stmt = (
+        select(SessionHistory.local_date, SessionHistory.user_id)
+        .where(SessionHistory.id.in_(row_ids), SessionHistory.local_date.isnot(None))
+        .distinct()
+    )
+    with session_scope() as db_session:
+        return {(row.local_date, row.user_id) for row in db_session.execute(stmt)}
+
+
+def refresh_rollup_buckets(buckets: Iterable[Tuple[str, Optional[int]]]) -> bool:
+    """Recompute the rollup rows for the given (local date, user_id) buckets."""
+    buckets = set(buckets)
+    if not buckets:
+        return True
+
+    if len(buckets) > REBUILD_BUCKET_THRESHOLD:
+        return rebuild_history_rollup()
+
+    try:
+        with _ROLLUP_LOCK, session_scope() as db_session:
+            for date_played, user_id in sorted(buckets, key=lambda b: (b[0], b[1] or 0)):
+                if user_id is None:
+                    user_cond = SessionHistoryDaily.user_id.is_(None)
+                    history_user_cond = SessionHistory.user_id.is_(None)
+                else:
+                    user_cond = SessionHistoryDaily.user_id == user_id
+                    history_user_cond = SessionHistory.user_id == user_id
+
+                db_session.execute(
+                    delete(SessionHistoryDaily)
+                    .where(SessionHistoryDaily.date_played == date_played, user_cond)
+                )
+
+                stmt = _rollup_select().where(history_user_cond, SessionHistory.local_date == date_played)
+                db_session.execute(_insert_rollup(stmt))
+    except Exception as e:
+        logger.warn("Tautulli Rollups :: Unable to refresh history rollup: %s." % e)
+        return False
+
+    return True
+
+
+def refresh_history_rollup(row_ids: Iterable[int]) -> bool:
+    """Recompute the rollup rows for the days touched by the history rows."""
+    try:
+        buckets = get_rollup_buckets(row_ids)
+    except Exception as e:
+        logger.warn("Tautulli Rollups :: Unable to read history rollup buckets: %s." % e)
+        return False
+    return refresh_rollup_buckets(buckets)
+
+
+def rebuild_history_rollup() -> bool:
+    """Rebuild the whole rollup from session_history."""
+    tz_name = localtime.timezone_name()
+    logger.info("Tautulli Rollups :: Rebuilding history rollup for timezone %s...", tz_name)
+
+    try:
+        with _ROLLUP_LOCK, session_scope() as db_session:
+            db_session.execute(delete(SessionHistoryDaily))
+            db_session.execute(_insert_rollup(_rollup_select()))
+            _set_rollup_timezone(db_session, tz_name)
+    except Exception as e:
+        logger.warn("Tautulli Rollups :: Unable to rebuild history rollup: %s." % e)
+        return False
+
+    logger.info("Tautulli Rollups :: History rollup rebuild complete.")
+    return True
+
+
+def check_history_rollup() -> bool:
+    """Rebuild the rollup if it was built for a different timezone or never built."""
+    with _ROLLUP_LOCK:
+        # The rollup is built from the local time columns, which must be current first
+        recomputed = localtime.check_local_columns()
+
+        try:
+            with session_scope() as db_session:
+                stmt = select(VersionInfo.value).where(VersionInfo.key == ROLLUP_TIMEZONE_KEY)
+                rollup_timezone = db_session.execute(stmt).scalar_one_or_none()
+        except Exception as e:
+            logger.warn("Tautulli Rollups :: Unable to read history rollup timezone: %s." % e)
+            return False
+
+        if not recomputed and rollup_timezone == localtime.timezone_name():
+            return True
+
+        return rebuild_history_rollup()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Disk cache of PMS images in ``CACHE_DIR/images`` for ``pms_image_proxy``.
+
+Concurrent misses for the same cache file are coalesced: the first request
+fetches the image from PMS and the others wait for its result instead of
+making their own request. Images are written to a temporary file and renamed
+into place, so a reader never sees a partial file.
+
+The cache is bounded by ``IMAGE_CACHE_MAX_MB``. The janitor removes the least
+recently used files (by access time, which is bumped on hits at most every
+``TOUCH_INTERVAL`` seconds) until the cache is below ``LOW_WATERMARK`` of the
+limit. It runs in a background thread at startup, which also measures the
+size of the cache, as a scheduled task and when writes push the cache over
+the limit.
+
+Cached images are served with a strong ETag made of the image hash and
+format and the modification time and size of the cache file. The hash
+doesn't include the PMS image timestamp, so a refreshed or re-fetched image
+must get a new ETag. The modification time only changes when the file is
+written, hits only bump the access time.
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+import plexpy
+from plexpy.util import logger
+
+
+# Seconds between access time updates of a cached file on hits
+TOUCH_INTERVAL = 3600
+# Fraction of the size limit the janitor prunes the cache down to
+LOW_WATERMARK = 0.9
+# Seconds a coalesced request waits for the fetching request
+FLIGHT_TIMEOUT = 60
+# Temporary files older than this are left over from a crash
+STALE_TEMP_SECONDS = 3600
+TEMP_SUFFIX = '.tmp'
+
+CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg'}
+
+_LOCK = threading.Lock()
+_JANITOR_LOCK = threading.Lock()
+_FLIGHTS = {}
+_STATS = {'hits': 0, 'misses': 0, 'coalesced': 0, 'fetches': 0, 'fetch_errors': 0, 'writes': 0,
+          'evictions': 0, 'evicted_bytes': 0}
+# Size of the cache at the last janitor run plus the bytes written since
+_SIZE = {'bytes': 0, 'files': 0, 'scanned': 0}
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def cache_dir():
+    c_dir = os.path.abspath(os.path.join(plexpy.CONFIG.CACHE_DIR, 'images'))
+    if not os.path.exists(c_dir):
+        os.makedirs(c_dir, exist_ok=True)
+    return c_dir
+
+
+def cache_path(img_hash, img_format):
+    return os.path.join(cache_dir(), '{}.{}'.format(img_hash, img_format))
+
+
+def normalize_image(img=None, rating_key=None, fallback=None):
+    """Return the PMS image path and rating key ``pms_image_proxy`` hashes and requests for an image."""
+    if rating_key and not img:
+        if fallback and fallback.startswith('art'):
+            img = '/library/metadata/{}/art'.format(rating_key)
+        else:
+            img = '/library/metadata/{}/thumb'.format(rating_key)
+
+    if img and not img.startswith('http'):
+        parts = 5
+        if img.startswith('/playlists'):
+            parts -= 1
+        rating_key_idx = parts - 2
+        parts += int('composite' in img)
+        img_split = img.split('/')
+        img = '/'.join(img_split[:parts])
+        img_rating_key = img_split[rating_key_idx]
+        if rating_key != img_rating_key:
+            rating_key = img_rating_key
+
+    return img, rating_key
+
+
+def content_type(img_format):
+    return CONTENT_TYPES.get(img_format, 'image/png')
+
+
+def etag(img_hash, img_format, stat):
+    """Return the strong ETag of a cached image from its hash and format and the os.stat result of the file."""
+    return '"{}.{}-{:x}-{:x}"'.format(img_hash, img_format, int(stat.st_mtime), stat.st_size)
+
+
+def etag_matches(tag, if_none_match):
+    """Return True if the If-None-Match header value matches the ETag."""
+    if not if_none_match:
+        return False
+    for value in if_none_match.split(','):
+        value = value.strip()
+        if value == '*' or value.replace('W/', '', 1) == tag:
+            return True
+    return False
+
+
+def _max_bytes():
+    return max(0, plexpy.CONFIG.IMAGE_CACHE_MAX_MB) * 1024 * 1024
+
+
+def _count(stat, value=1):
+    with _LOCK:
+        _STATS[stat] += value
+
+
+def lookup(path):
+    """Return the os.stat result of the cached image, or None, and mark it as recently used."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        _count('misses')
+        return None
+
+    now = time.time()
+    if now - stat.st_atime > TOUCH_INTERVAL:
+        try:
+            # Keep the modification time, it is part of the ETag
+            os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            pass
+
+    _count('hits')
+    return stat
+
+
+def write(path, data):
+    """Atomically write the image to the cache file."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=TEMP_SUFFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.error("Tautulli ImageCache :: Unable to write image cache file %s: %s" % (path, e))
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return
+
+    with _LOCK:
+        _STATS['writes'] += 1
+        _SIZE['bytes'] += len(data)
+        over_limit = _max_bytes() and _SIZE['bytes'] > _max_bytes()
+
+    if over_limit:
+        start_janitor()
+
+
+def fetch(path, fetch_func, store=True):
+    """
+    Return the (data, content_type) result of fetch_func for the cache file,
+    writing it to the cache if store. Concurrent calls for the same file wait
+    for the first call and share its result.
+    """
+    with _LOCK:
+        flight = _FLIGHTS.get(path)
+        leader = flight is None
+        if leader:
+            flight = _FLIGHTS[path] = _Flight()
+
+    if not leader:
+        _count('coalesced')
+        if flight.done.wait(FLIGHT_TIMEOUT):
+            return flight.result
+        # The fetching request is stuck, don't hold up this one as well
+        return fetch_func()
+
+    try:
+        _count('fetches')
+        result = fetch_func()
+        if result and result[0]:
+            if store:
+                write(path, result[0])
+        else:
+            _count('fetch_errors')
+        flight.result = result
+        return result
+    except Exception:
+        _count('fetch_errors')
+        raise
+    finally:
+        with _LOCK:
+            _FLIGHTS.pop(path, None)
+        flight.done.set()
+
+
+def prune(max_bytes=None):
+    """Remove the least recently used images until the cache is below the low watermark of the limit."""
+    if max_bytes is None:
+        max_bytes = _max_bytes()
+
+    if not _JANITOR_LOCK.acquire(blocking=False):
+        return
+
+    try:
+        c_dir = cache_dir()
+        now = time.time()
+        files = []
+        total = 0
+
+        with os.scandir(c_dir) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+                if entry.name.endswith(TEMP_SUFFIX):
+                    if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                        _remove(entry.path)
+                    continue
+
+                files.append((stat.st_atime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        evicted = evicted_bytes = 0
+        if max_bytes and total > max_bytes:
+            target = max_bytes * LOW_WATERMARK
+            files.sort()
+            for atime, size, path in files:
+                if total <= target:
+                    break
+                if _remove(path):
+                    total -= size
+                    evicted += 1
+                    evicted_bytes += size
+
+            logger.info("Tautulli ImageCache :: Pruned %s images (%.1f MB) from the image cache."
+                        % (evicted, evicted_bytes / 1024.0 / 1024.0))
+
+        with _LOCK:
+            _STATS['evictions'] += evicted
+            _STATS['evicted_bytes'] += evicted_bytes
+            _SIZE['bytes'] = total
+            _SIZE['files'] = len(files) - evicted
+            _SIZE['scanned'] = int(now)
+
+    except OSError as e:
+        logger.error("Tautulli ImageCache :: Unable to prune the image cache: %s" % e)
+
+    finally:
+        _JANITOR_LOCK.release()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+def start_janitor():
+    if _JANITOR_LOCK.locked():
+        return
+    thread = threading.Thread(target=prune, name='image-cache-janitor')
+    thread.daemon = True
+    thread.start()
+
+
+def get_stats():
+    with _LOCK:
+        stats = dict(_STATS)
+        stats.update(_SIZE)
+        stats['in_flight'] = len(_FLIGHTS)
+    stats['max_bytes'] = _max_bytes()
+    return stats
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Process-wide cache of session metadata from ``PmsConnect.get_metadata_details``.
+
+Entries are keyed by session key and only returned for the rating key they
+were fetched for. The cache is an LRU bounded by ``METADATA_CACHE_MAX_ITEMS``
+and entries that have not been touched for ``IDLE_EXPIRY`` seconds are
+dropped. Metadata is stored as JSON so every lookup returns a fresh copy.
+
+With ``METADATA_CACHE_DISK`` enabled, entries are also written to
+``CACHE_DIR/session_metadata`` when they are stored and read back from there
+on a memory miss, so the metadata of active sessions survives a restart.
+"""
+
+from collections import OrderedDict
+import json
+import os
+import threading
+
+import plexpy
+from plexpy.util import helpers
+from plexpy.util import logger
+
+
+# Drop entries that have not been read or written for a day
+IDLE_EXPIRY = 86400
+
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _cache_folder():
+    return os.path.join(plexpy.CONFIG.CACHE_DIR, 'session_metadata')
+
+
+def _cache_file(session_key):
+    return os.path.join(_cache_folder(), 'metadata-sessionKey-%s.json' % session_key)
+
+
+def _max_items():
+    return max(1, plexpy.CONFIG.METADATA_CACHE_MAX_ITEMS)
+
+
+def _read_disk(session_key):
+    try:
+        with open(_cache_file(session_key), 'r') as inFile:
+            entry = json.load(inFile)
+    except (IOError, ValueError):
+        return None
+
+    if not isinstance(entry, dict):
+        return None
+
+    cache_time = entry.pop('_cache_time', 0)
+    rating_key = entry.pop('_rating_key', entry.get('rating_key'))
+    return {'rating_key': str(rating_key), 'cache_time': cache_time, 'accessed': helpers.timestamp(),
+            'data': json.dumps(entry)}
+
+
+def _write_disk(session_key, entry):
+    metadata = json.loads(entry['data'])
+    metadata['_cache_time'] = entry['cache_time']
+    metadata['_rating_key'] = entry['rating_key']
+
+    try:
+        if not os.path.exists(_cache_folder()):
+            os.mkdir(_cache_folder())
+        with open(_cache_file(session_key), 'w') as outFile:
+            json.dump(metadata, outFile)
+    except (IOError, ValueError) as e:
+        logger.error("Tautulli MetadataCache :: Unable to create cache file for metadata (sessionKey %s): %s"
+                     % (session_key, e))
+
+
+def _evict(now):
+    # Called with the lock held
+    while len(_CACHE) > _max_items():
+        _CACHE.popitem(last=False)
+        _STATS['evictions'] += 1
+
+    for session_key, entry in list(_CACHE.items()):
+        if now - entry['accessed'] <= IDLE_EXPIRY:
+            break
+        del _CACHE[session_key]
+        _STATS['evictions'] += 1
+
+
+def get(session_key, rating_key, max_age=None):
+    """
+    Return a copy of the cached metadata for the session, or None if there is
+    no entry for the rating key or it is older than max_age seconds.
+    """
+    session_key = str(session_key)
+    rating_key = str(rating_key)
+    now = helpers.timestamp()
+
+    with _CACHE_LOCK:
+        entry = _CACHE.get(session_key)
+        if entry is not None:
+            _CACHE.move_to_end(session_key)
+
+    if entry is None and plexpy.CONFIG.METADATA_CACHE_DISK:
+        entry = _read_disk(session_key)
+        if entry is not None:
+            with _CACHE_LOCK:
+                _CACHE.setdefault(session_key, entry)
+                _evict(now)
+
+    if entry is None or entry['rating_key'] != rating_key or \
+            (max_age is not None and now - entry['cache_time'] > max_age):
+        with _CACHE_LOCK:
+            _STATS['misses'] += 1
+        return None
+
+    with _CACHE_LOCK:
+        entry['accessed'] = now
+        _STATS['hits'] += 1
+
+    return json.loads(entry['data'])
+
+
+def put(session_key, rating_key, metadata):
+    """Store the metadata for the session and rating key."""
+    session_key = str(session_key)
+    now = helpers.timestamp()
+
+    try:
+        data = json.dumps(metadata)
+    except (TypeError, ValueError) as e:
+        logger.error("Tautulli MetadataCache :: Unable to cache metadata (sessionKey %s): %s" % (session_key, e))
+        return
+
+    entry = {'rating_key': str(rating_key), 'cache_time': now, 'accessed': now, 'data': data}
+
+    with _CACHE_LOCK:
+        _CACHE[session_key] = entry
+        _CACHE.move_to_end(session_key)
+        _evict(now)
+
+    if plexpy.CONFIG.METADATA_CACHE_DISK:
+        _write_disk(session_key, entry)
+
+
+def delete(session_key):
+    """Remove the cached metadata for the session."""
+    session_key = str(session_key)
+
+    with _CACHE_LOCK:
+        _CACHE.pop(session_key, None)
+
+    if plexpy.CONFIG.METADATA_CACHE_DISK:
+        try:
+            os.remove(_cache_file(session_key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error("Tautulli MetadataCache :: Failed to remove metadata cache file (sessionKey %s): %s"
+                         % (session_key, e))
+
+
+def clear():
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
+
+def get_stats():
+    with _CACHE_LOCK:
+        stats = dict(_STATS)
+        stats['items'] = len(_CACHE)
+    stats['max_items'] = _max_items()
+    return stats
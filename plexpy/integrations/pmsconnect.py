@@ -15,15 +15,14 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
-import os
+import threading
 import time
 from urllib.parse import quote, quote_plus, urlencode
-from xml.dom.minidom import Node
 
 import plexpy
 from plexpy.app import common
 from plexpy.integrations import http_handler
+from plexpy.integrations import metadata_cache
 from plexpy.services import libraries
 from plexpy.services import users
 from plexpy.web import session
@@ -31,6 +30,13 @@ from plexpy.integrations import plextv
 from plexpy.services import activity_processor
 from plexpy.util import helpers
 from plexpy.util import logger
+from plexpy.util import xmltree
+
+
+# Shared /status/sessions snapshot for websocket activity handlers
+ACTIVITY_SNAPSHOT_TTL = 1.0
+_ACTIVITY_SNAPSHOT = {'fetched': 0, 'source': None, 'sessions': {}}
+_ACTIVITY_SNAPSHOT_LOCK = threading.Lock()
 
 
 def get_server_friendly_name():
@@ -681,25 +687,14 @@ class PmsConnect(object):
         Output: array
         """
         metadata = {}
+        cache_rating_key = rating_key
 
         if not skip_cache and cache_key:
-            in_file_folder = os.path.join(plexpy.CONFIG.CACHE_DIR, 'session_metadata')
-            in_file_path = os.path.join(in_file_folder, 'metadata-sessionKey-%s.json' % cache_key)
-
-            if not os.path.exists(in_file_folder):
-                os.mkdir(in_file_folder)
-
-            try:
-                with open(in_file_path, 'r') as inFile:
-                    metadata = json.load(inFile)
-            except (IOError, ValueError) as e:
-                pass
-
-            if metadata:
-                _cache_time = metadata.pop('_cache_time', 0)
-                # Return cached metadata if less than cache_seconds ago
-                if return_cache or helpers.timestamp() - _cache_time <= plexpy.CONFIG.METADATA_CACHE_SECONDS:
-                    return metadata
+            # Return cached metadata if less than cache_seconds ago
+            max_age = None if return_cache else plexpy.CONFIG.METADATA_CACHE_SECONDS
+            cached_metadata = metadata_cache.get(cache_key, cache_rating_key, max_age=max_age)
+            if cached_metadata:
+                return cached_metadata
 
         if rating_key:
             metadata_xml = self.get_metadata(str(rating_key), output_format='xml')
@@ -1696,20 +1691,7 @@ class PmsConnect(object):
 
         if metadata:
             if cache_key:
-                metadata['_cache_time'] = helpers.timestamp()
-
-                out_file_folder = os.path.join(plexpy.CONFIG.CACHE_DIR, 'session_metadata')
-                out_file_path = os.path.join(out_file_folder, 'metadata-sessionKey-%s.json' % cache_key)
-
-                if not os.path.exists(out_file_folder):
-                    os.mkdir(out_file_folder)
-
-                try:
-                    with open(out_file_path, 'w') as outFile:
-                        json.dump(metadata, outFile)
-                except (IOError, ValueError) as e:
-                    logger.error("Tautulli Pmsconnect :: Unable to create cache file for metadata (sessionKey %s): %s"
-                                 % (cache_key, e))
+                metadata_cache.put(cache_key, cache_rating_key, metadata)
 
             return metadata
         else:
@@ -1871,6 +1853,67 @@ class PmsConnect(object):
 
         return output
 
+    def _get_session_elements(self, refresh=False):
+        """
+        Return the current session XML elements keyed by sessionKey.
+
+        The /status/sessions response is shared between callers for
+        ACTIVITY_SNAPSHOT_TTL seconds. Callers waiting on an in-flight
+        request reuse its result instead of requesting again.
+        """
+        source = (self.url, self.token)
+        requested = time.time()
+
+        with _ACTIVITY_SNAPSHOT_LOCK:
+            snapshot = _ACTIVITY_SNAPSHOT
+            if snapshot['source'] == source and (
+                snapshot['fetched'] >= requested or
+                not refresh and requested - snapshot['fetched'] < ACTIVITY_SNAPSHOT_TTL
+            ):
+                return snapshot['sessions']
+
+            session_data = self.get_sessions(output_format='xml')
+
+            try:
+                xml_head = session_data.getElementsByTagName('MediaContainer')
+            except Exception as e:
+                logger.warn("Tautulli Pmsconnect :: Unable to parse XML for get_current_session: %s." % e)
+                return {}
+
+            sessions = {}
+            for a in xml_head:
+                for tag in ('Track', 'Video', 'Photo'):
+                    for session_ in a.getElementsByTagName(tag):
+                        # Filter out background theme music sessions
+                        if tag == 'Track' and helpers.get_xml_attr(session_, 'guid').startswith('library://'):
+                            continue
+                        sessions[helpers.get_xml_attr(session_, 'sessionKey')] = session_
+
+            snapshot.update({'fetched': time.time(), 'source': source, 'sessions': sessions})
+            return sessions
+
+    def get_current_session(self, session_key=None, skip_cache=False):
+        """
+        Return processed and validated data for a single session.
+
+        Only the requested session is processed, using the shared
+        /status/sessions snapshot. The snapshot is refreshed once if
+        the session is not in it yet.
+
+        Parameters required:    session_key { the sessionKey }
+        Output: dict or None
+        """
+        session_key = str(session_key)
+
+        session_element = self._get_session_elements().get(session_key)
+        if session_element is None:
+            session_element = self._get_session_elements(refresh=True).get(session_key)
+        if session_element is None:
+            return None
+
+        session_output = self.get_session_each(session_element, skip_cache=skip_cache)
+        return session.mask_session_info([session_output])[0]
+
     def get_session_each(self, session=None, skip_cache=False):
         """
         Return selected data from current sessions.
@@ -2519,7 +2562,7 @@ class PmsConnect(object):
             result_data = []
 
             for x in a.childNodes:
-                if x.nodeType == Node.ELEMENT_NODE and x.tagName in ('Directory', 'Video', 'Track', 'Photo'):
+                if x.nodeType == xmltree.ELEMENT_NODE and x.tagName in ('Directory', 'Video', 'Track', 'Photo'):
                     result_data.append(x)
 
             if result_data:
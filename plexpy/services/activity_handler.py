@@ -14,7 +14,6 @@
 #  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
-import os
 import time
 
 from apscheduler.triggers.date import DateTrigger
@@ -23,6 +22,7 @@ import pytz
 import plexpy
 from plexpy.app import common
 from plexpy.db import datafactory
+from plexpy.integrations import metadata_cache
 from plexpy.integrations import pmsconnect
 from plexpy.services import activity_processor
 from plexpy.services import notification_handler
@@ -73,18 +73,16 @@ class ActivityHandler(object):
 
     def get_live_session(self, skip_cache=False):
         pms_connect = pmsconnect.PmsConnect()
-        session_list = pms_connect.get_current_activity(skip_cache=skip_cache)
-
-        if session_list:
-            for session in session_list['sessions']:
-                if int(session['session_key']) == self.session_key:
-                    # Live sessions don't have rating keys in sessions
-                    # Get it from the websocket data
-                    if not session['rating_key']:
-                        session['rating_key'] = self.rating_key
-                    session['rating_key_websocket'] = self.rating_key
-                    self.session = session
-                    return session
+        session = pms_connect.get_current_session(session_key=self.session_key, skip_cache=skip_cache)
+
+        if session:
+            # Live sessions don't have rating keys in sessions
+            # Get it from the websocket data
+            if not session['rating_key']:
+                session['rating_key'] = self.rating_key
+            session['rating_key_websocket'] = self.rating_key
+            self.session = session
+            return session
 
     def update_db_session(self, notify=False):
         if self.session is None:
@@ -169,6 +167,7 @@ class ActivityHandler(object):
                             % (str(self.session_key), str(self.rating_key)))
             self.ap.delete_session(row_id=row_id)
             delete_metadata_cache(self.session_key)
+            notification_handler.clear_notify_state(self.session_key)
         else:
             schedule_callback('session_key-{}'.format(self.session_key),
                                 func=force_stop_stream,
@@ -636,6 +635,7 @@ def force_stop_stream(session_key, title, user):
                     % (session['session_key'], session['rating_key']))
         ap.delete_session(row_id=row_id)
         delete_metadata_cache(session_key)
+        notification_handler.clear_notify_state(session_key)
 
     else:
         session['write_attempts'] += 1
@@ -658,6 +658,7 @@ def force_stop_stream(session_key, title, user):
                         % (session['session_key'], session['rating_key']))
             ap.delete_session(session_key=session_key)
             delete_metadata_cache(session_key)
+            notification_handler.clear_notify_state(session_key)
 
 
 def clear_recently_added_queue(rating_key, title):
@@ -732,8 +733,4 @@ def on_created(rating_key, **kwargs):
 
 
 def delete_metadata_cache(session_key):
-    try:
-        os.remove(os.path.join(plexpy.CONFIG.CACHE_DIR, 'session_metadata', 'metadata-sessionKey-%s.json' % session_key))
-    except OSError as e:
-        logger.error("Tautulli ActivityHandler :: Failed to remove metadata cache file (sessionKey %s): %s"
-                     % (session_key, e))
+    metadata_cache.delete(session_key)
@@ -16,7 +16,7 @@
 import threading
 
 import plexpy
-from sqlalchemy import func, select, update
+from sqlalchemy import func
 
 from plexpy.integrations import pmsconnect
 from plexpy.db import queries
@@ -38,6 +38,13 @@ ext_ping_error = None
 int_ping_count = 0
 
 
+def _is_watched(session):
+    progress_percent = helpers.get_percent(session['view_offset'], session['duration'])
+    return (session['media_type'] == 'movie' and progress_percent >= plexpy.CONFIG.MOVIE_WATCHED_PERCENT or
+            session['media_type'] == 'episode' and progress_percent >= plexpy.CONFIG.TV_WATCHED_PERCENT or
+            session['media_type'] == 'track' and progress_percent >= plexpy.CONFIG.MUSIC_WATCHED_PERCENT)
+
+
 def check_active_sessions(ws_request=False):
 
     with monitor_lock:
@@ -55,191 +62,188 @@ def check_active_sessions(ws_request=False):
 
         if session_list:
             media_container = session_list['sessions']
+            active_sessions = {(session['session_key'], session['rating_key']): session for session in media_container}
+
+            # Work out what we must do with the streams in our temp table, then write all
+            # of the session changes in one transaction below.
+            paused_rows = []
+            buffer_rows = []
+            stopped_rows = []
+            active_streams = []
+            stopped_streams = []
+            notify_before = []
 
-            # Check our temp table for what we must do with the new streams
             for stream in db_streams:
-                if any(d['session_key'] == str(stream['session_key']) and d['rating_key'] == str(stream['rating_key'])
-                       for d in media_container):
-                    # The user's session is still active
-                    for session in media_container:
-                        if session['session_key'] == str(stream['session_key']) and \
-                                session['rating_key'] == str(stream['rating_key']):
-                            # The user is still playing the same media item
-                            # Here we can check the play states
-                            if session['state'] != stream['state']:
-                                if session['state'] == 'paused':
-                                    logger.debug("Tautulli Monitor :: Session %s paused." % stream['session_key'])
-
-                                    plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_pause'})
-
-                                if session['state'] == 'playing' and stream['state'] == 'paused':
-                                    logger.debug("Tautulli Monitor :: Session %s resumed." % stream['session_key'])
-
-                                    plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_resume'})
-
-                                if session['state'] == 'error':
-                                    logger.debug("Tautulli Monitor :: Session %s encountered an error." % stream['session_key'])
-
-                                    plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_error'})
-
-                            if stream['state'] == 'paused' and not ws_request:
-                                # The stream is still paused so we need to increment the paused_counter
-                                # Using the set config parameter as the interval, probably not the most accurate but
-                                # it will have to do for now. If it's a websocket request don't use this method.
-                                paused_counter = int(stream['paused_counter']) + plexpy.CONFIG.MONITORING_INTERVAL
-                                with session_scope() as db_session:
-                                    stmt = (
-                                        update(SessionModel)
-                                        .where(
-                                            SessionModel.session_key == stream['session_key'],
-                                            SessionModel.rating_key == stream['rating_key'],
-                                        )
-                                        .values(paused_counter=paused_counter)
-                                    )
-                                    db_session.execute(stmt)
-
-                            if session['state'] == 'buffering' and plexpy.CONFIG.BUFFER_THRESHOLD > 0:
-                                # The stream is buffering so we need to increment the buffer_count
-                                # We're going just increment on every monitor ping,
-                                # would be difficult to keep track otherwise
-                                with session_scope() as db_session:
-                                    stmt = (
-                                        update(SessionModel)
-                                        .where(
-                                            SessionModel.session_key == stream['session_key'],
-                                            SessionModel.rating_key == stream['rating_key'],
-                                        )
-                                        .values(buffer_count=SessionModel.buffer_count + 1)
-                                    )
-                                    db_session.execute(stmt)
-
-                                # Check the current buffer count and last buffer to determine if we should notify
-                                with session_scope() as db_session:
-                                    stmt = (
-                                        select(SessionModel.buffer_count, SessionModel.buffer_last_triggered)
-                                        .where(
-                                            SessionModel.session_key == stream['session_key'],
-                                            SessionModel.rating_key == stream['rating_key'],
-                                        )
-                                    )
-                                    buffer_values = queries.fetch_mappings(db_session, stmt)
-
-                                if not buffer_values:
-                                    continue
-
-                                if buffer_values[0]['buffer_count'] >= plexpy.CONFIG.BUFFER_THRESHOLD:
-                                    # Push any notifications -
-                                    # Push it on it's own thread so we don't hold up our db actions
-                                    # Our first buffer notification
-                                    if buffer_values[0]['buffer_count'] == plexpy.CONFIG.BUFFER_THRESHOLD:
-                                        logger.info("Tautulli Monitor :: User '%s' has triggered a buffer warning."
-                                                    % stream['user'])
-                                        # Set the buffer trigger time
-                                        with session_scope() as db_session:
-                                            stmt = (
-                                                update(SessionModel)
-                                                .where(
-                                                    SessionModel.session_key == stream['session_key'],
-                                                    SessionModel.rating_key == stream['rating_key'],
-                                                )
-                                                .values(buffer_last_triggered=time_queries.epoch(func.now()))
-                                            )
-                                            db_session.execute(stmt)
-
-                                        plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_buffer'})
-
-                                    else:
-                                        # Subsequent buffer notifications after wait time
-                                        if helpers.timestamp() > buffer_values[0]['buffer_last_triggered'] + \
-                                                plexpy.CONFIG.BUFFER_WAIT:
-                                            logger.info("Tautulli Monitor :: User '%s' has triggered multiple buffer warnings."
-                                                    % stream['user'])
-                                            # Set the buffer trigger time
-                                            with session_scope() as db_session:
-                                                stmt = (
-                                                    update(SessionModel)
-                                                    .where(
-                                                        SessionModel.session_key == stream['session_key'],
-                                                        SessionModel.rating_key == stream['rating_key'],
-                                                    )
-                                                    .values(buffer_last_triggered=time_queries.epoch(func.now()))
-                                                )
-                                                db_session.execute(stmt)
-
-                                            plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_buffer'})
-
-                                logger.debug("Tautulli Monitor :: Session %s is buffering. Count is now %s. Last triggered %s."
-                                             % (stream['session_key'],
-                                                buffer_values[0]['buffer_count'],
-                                                buffer_values[0]['buffer_last_triggered']))
-
-                            # Check if the user has reached the offset in the media we defined as the "watched" percent
-                            # Don't trigger if state is buffer as some clients push the progress to the end when
-                            # buffering on start.
-                            if session['state'] != 'buffering':
-                                progress_percent = helpers.get_percent(session['view_offset'], session['duration'])
-                                notify_states = notification_handler.get_notify_state(session=session)
-                                if (session['media_type'] == 'movie' and progress_percent >= plexpy.CONFIG.MOVIE_WATCHED_PERCENT or
-                                    session['media_type'] == 'episode' and progress_percent >= plexpy.CONFIG.TV_WATCHED_PERCENT or
-                                    session['media_type'] == 'track' and progress_percent >= plexpy.CONFIG.MUSIC_WATCHED_PERCENT) \
-                                    and not any(d['notify_action'] == 'on_watched' for d in notify_states):
-                                    plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_watched'})
+                stream_key = {'session_key': stream['session_key'], 'rating_key': stream['rating_key']}
+                session = active_sessions.get((str(stream['session_key']), str(stream['rating_key'])))
+
+                if session is not None:
+                    # The user is still playing the same media item
+                    # Here we can check the play states
+                    active_streams.append((stream, session))
+
+                    if session['state'] != stream['state']:
+                        if session['state'] == 'paused':
+                            logger.debug("Tautulli Monitor :: Session %s paused." % stream['session_key'])
+
+                            notify_before.append({'stream_data': stream.copy(), 'notify_action': 'on_pause'})
+
+                        if session['state'] == 'playing' and stream['state'] == 'paused':
+                            logger.debug("Tautulli Monitor :: Session %s resumed." % stream['session_key'])
+
+                            notify_before.append({'stream_data': stream.copy(), 'notify_action': 'on_resume'})
+
+                        if session['state'] == 'error':
+                            logger.debug("Tautulli Monitor :: Session %s encountered an error." % stream['session_key'])
+
+                            notify_before.append({'stream_data': stream.copy(), 'notify_action': 'on_error'})
+
+                    if stream['state'] == 'paused' and not ws_request:
+                        # The stream is still paused so we need to increment the paused_counter
+                        # Using the set config parameter as the interval, probably not the most accurate but
+                        # it will have to do for now. If it's a websocket request don't use this method.
+                        paused_counter = int(stream['paused_counter']) + plexpy.CONFIG.MONITORING_INTERVAL
+                        paused_rows.append(dict(stream_key, paused_counter=paused_counter))
+
+                    if session['state'] == 'buffering' and plexpy.CONFIG.BUFFER_THRESHOLD > 0:
+                        # The stream is buffering so we need to increment the buffer_count
+                        # We're going just increment on every monitor ping,
+                        # would be difficult to keep track otherwise
+                        buffer_rows.append(stream_key)
 
                 else:
                     # The user has stopped playing a stream
-                    if stream['state'] != 'stopped':
-                        logger.debug("Tautulli Monitor :: Session %s stopped." % stream['session_key'])
-
-                        if not stream['stopped']:
-                            # Set the stream stop time
-                            stream['stopped'] = helpers.timestamp()
-                            with session_scope() as db_session:
-                                stmt = (
-                                    update(SessionModel)
-                                    .where(
-                                        SessionModel.session_key == stream['session_key'],
-                                        SessionModel.rating_key == stream['rating_key'],
-                                    )
-                                    .values(stopped=stream['stopped'], state='stopped')
-                                )
-                                db_session.execute(stmt)
-
-                        progress_percent = helpers.get_percent(stream['view_offset'], stream['duration'])
+                    stopped_streams.append(stream)
+
+                    if stream['state'] != 'stopped' and not stream['stopped']:
+                        # Set the stream stop time
+                        stream['stopped'] = helpers.timestamp()
+                        stopped_rows.append(dict(stream_key, stopped=stream['stopped']))
+
+            # Sessions that are already in the temp table are refreshed in bulk, new ones are written below
+            refreshed_keys = {(str(stream['session_key']), str(stream['rating_key'])) for stream, _ in active_streams}
+            new_sessions = [session for session in media_container
+                            if (session['session_key'], session['rating_key']) not in refreshed_keys]
+
+            session_table = SessionModel.__table__
+            buffer_values = {}
+
+            with session_scope() as db_session:
+                if paused_rows:
+                    db_session.execute(queries.update_from_values(
+                        session_table, paused_rows, ['session_key', 'rating_key'], ['paused_counter']))
+
+                if buffer_rows:
+                    stmt = queries.update_from_values(
+                        session_table, buffer_rows, ['session_key', 'rating_key'],
+                        buffer_count=session_table.c.buffer_count + 1,
+                    ).returning(
+                        session_table.c.session_key,
+                        session_table.c.rating_key,
+                        session_table.c.buffer_count,
+                        session_table.c.buffer_last_triggered,
+                    )
+                    for row in db_session.execute(stmt).mappings():
+                        buffer_values[(row['session_key'], row['rating_key'])] = dict(row)
+
+                    # Check the current buffer count and last buffer to determine if we should notify
+                    triggered_rows = []
+                    for values in buffer_values.values():
+                        if values['buffer_count'] == plexpy.CONFIG.BUFFER_THRESHOLD:
+                            # Our first buffer notification
+                            values['notify'] = 'first'
+                        elif values['buffer_count'] > plexpy.CONFIG.BUFFER_THRESHOLD and \
+                                helpers.timestamp() > (values['buffer_last_triggered'] or 0) + plexpy.CONFIG.BUFFER_WAIT:
+                            # Subsequent buffer notifications after wait time
+                            values['notify'] = 'again'
+                        else:
+                            continue
+                        triggered_rows.append({'session_key': values['session_key'],
+                                               'rating_key': values['rating_key']})
+
+                    if triggered_rows:
+                        # Set the buffer trigger time
+                        db_session.execute(queries.update_from_values(
+                            session_table, triggered_rows, ['session_key', 'rating_key'],
+                            buffer_last_triggered=time_queries.epoch(func.now()),
+                        ))
+
+                if stopped_rows:
+                    db_session.execute(queries.update_from_values(
+                        session_table, stopped_rows, ['session_key', 'rating_key'], ['stopped'], state='stopped'))
+
+                monitor_process.refresh_sessions([session for _, session in active_streams], db_session)
+
+            for notification in notify_before:
+                plexpy.NOTIFY_QUEUE.put(notification)
+
+            for stream, session in active_streams:
+                values = buffer_values.get((stream['session_key'], stream['rating_key']))
+                if values is not None:
+                    if values.get('notify') == 'first':
+                        logger.info("Tautulli Monitor :: User '%s' has triggered a buffer warning."
+                                    % stream['user'])
+                    elif values.get('notify') == 'again':
+                        logger.info("Tautulli Monitor :: User '%s' has triggered multiple buffer warnings."
+                                    % stream['user'])
+
+                    if values.get('notify'):
+                        # Push any notifications -
+                        # Push it on it's own thread so we don't hold up our db actions
+                        plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_buffer'})
+
+                    logger.debug("Tautulli Monitor :: Session %s is buffering. Count is now %s. Last triggered %s."
+                                 % (stream['session_key'],
+                                    values['buffer_count'],
+                                    values['buffer_last_triggered']))
+
+                # Check if the user has reached the offset in the media we defined as the "watched" percent
+                # Don't trigger if state is buffer as some clients push the progress to the end when
+                # buffering on start.
+                if session['state'] != 'buffering' and _is_watched(session):
+                    notify_states = notification_handler.get_notify_state(session=session)
+                    if not any(d['notify_action'] == 'on_watched' for d in notify_states):
+                        plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_watched'})
+
+            for stream in stopped_streams:
+                if stream['state'] != 'stopped':
+                    logger.debug("Tautulli Monitor :: Session %s stopped." % stream['session_key'])
+
+                    if _is_watched(stream):
                         notify_states = notification_handler.get_notify_state(session=stream)
-                        if (stream['media_type'] == 'movie' and progress_percent >= plexpy.CONFIG.MOVIE_WATCHED_PERCENT or
-                            stream['media_type'] == 'episode' and progress_percent >= plexpy.CONFIG.TV_WATCHED_PERCENT or
-                            stream['media_type'] == 'track' and progress_percent >= plexpy.CONFIG.MUSIC_WATCHED_PERCENT) \
-                            and not any(d['notify_action'] == 'on_watched' for d in notify_states):
+                        if not any(d['notify_action'] == 'on_watched' for d in notify_states):
                             plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_watched'})
 
-                        plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_stop'})
+                    plexpy.NOTIFY_QUEUE.put({'stream_data': stream.copy(), 'notify_action': 'on_stop'})
 
-                    # Write the item history on playback stop
-                    row_id = monitor_process.write_session_history(session=stream)
+                # Write the item history on playback stop
+                row_id = monitor_process.write_session_history(session=stream)
+
+                if row_id:
+                    # If session is written to the database successfully, remove the session from the session table
+                    logger.debug("Tautulli Monitor :: Removing sessionKey %s ratingKey %s from session queue"
+                                 % (stream['session_key'], stream['rating_key']))
+                    monitor_process.delete_session(row_id=row_id)
+                    notification_handler.clear_notify_state(stream['session_key'])
+                else:
+                    stream['write_attempts'] += 1
 
-                    if row_id:
-                        # If session is written to the database successfully, remove the session from the session table
+                    if stream['write_attempts'] < plexpy.CONFIG.SESSION_DB_WRITE_ATTEMPTS:
+                        logger.warn("Tautulli Monitor :: Failed to write sessionKey %s ratingKey %s to the database. " \
+                                    "Will try again on the next pass. Write attempt %s."
+                                    % (stream['session_key'], stream['rating_key'], str(stream['write_attempts'])))
+                        monitor_process.increment_write_attempts(session_key=stream['session_key'])
+                    else:
+                        logger.warn("Tautulli Monitor :: Failed to write sessionKey %s ratingKey %s to the database. " \
+                                    "Removing session from the database. Write attempt %s."
+                                    % (stream['session_key'], stream['rating_key'], str(stream['write_attempts'])))
                         logger.debug("Tautulli Monitor :: Removing sessionKey %s ratingKey %s from session queue"
                                      % (stream['session_key'], stream['rating_key']))
-                        monitor_process.delete_session(row_id=row_id)
-                    else:
-                        stream['write_attempts'] += 1
-
-                        if stream['write_attempts'] < plexpy.CONFIG.SESSION_DB_WRITE_ATTEMPTS:
-                            logger.warn("Tautulli Monitor :: Failed to write sessionKey %s ratingKey %s to the database. " \
-                                        "Will try again on the next pass. Write attempt %s."
-                                        % (stream['session_key'], stream['rating_key'], str(stream['write_attempts'])))
-                            monitor_process.increment_write_attempts(session_key=stream['session_key'])
-                        else:
-                            logger.warn("Tautulli Monitor :: Failed to write sessionKey %s ratingKey %s to the database. " \
-                                        "Removing session from the database. Write attempt %s."
-                                        % (stream['session_key'], stream['rating_key'], str(stream['write_attempts'])))
-                            logger.debug("Tautulli Monitor :: Removing sessionKey %s ratingKey %s from session queue"
-                                         % (stream['session_key'], stream['rating_key']))
-                            monitor_process.delete_session(session_key=stream['session_key'])
+                        monitor_process.delete_session(session_key=stream['session_key'])
+                        notification_handler.clear_notify_state(stream['session_key'])
 
             # Process the newly received session data
-            for session in media_container:
+            for session in new_sessions:
                 new_session = monitor_process.write_session(session)
 
                 if new_session:
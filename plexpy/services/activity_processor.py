@@ -17,14 +17,18 @@ from collections import defaultdict
 import json
 
 import plexpy
-from sqlalchemy import Integer, delete, func, insert, select, update
+from sqlalchemy import Integer, bindparam, delete, func, insert, select, update
 from sqlalchemy.exc import IntegrityError
 
 from plexpy.integrations import pmsconnect
 from plexpy.services import libraries
 from plexpy.services import users
+from plexpy.db import counts
+from plexpy.db import localtime
 from plexpy.db import maintenance
 from plexpy.db import queries
+from plexpy.db import regroup
+from plexpy.db import rollups
 from plexpy.db.models import Session as SessionModel
 from plexpy.db.models import SessionContinued, SessionHistory, SessionHistoryMediaInfo, SessionHistoryMetadata
 from plexpy.db.queries import time as time_queries
@@ -35,138 +39,161 @@ from plexpy.util import logger
 
 class ActivityProcessor(object):
 
+    def _session_values(self, session):
+        def _optional_int(value):
+            if value is None or value == '':
+                return None
+            return helpers.cast_to_int(value)
+
+        values = {'session_key': session.get('session_key', ''),
+                  'session_id': session.get('session_id', ''),
+                  'transcode_key': session.get('transcode_key', ''),
+                  'section_id': session.get('section_id', ''),
+                  'rating_key': session.get('rating_key', ''),
+                  'media_type': session.get('media_type', ''),
+                  'state': session.get('state', ''),
+                  'user_id': session.get('user_id', ''),
+                  'user': session.get('user', ''),
+                  'machine_id': session.get('machine_id', ''),
+                  'title': session.get('title', ''),
+                  'parent_title': session.get('parent_title', ''),
+                  'grandparent_title': session.get('grandparent_title', ''),
+                  'original_title': session.get('original_title', ''),
+                  'full_title': session.get('full_title', ''),
+                  'media_index': session.get('media_index', ''),
+                  'parent_media_index': session.get('parent_media_index', ''),
+                  'thumb': session.get('thumb', ''),
+                  'parent_thumb': session.get('parent_thumb', ''),
+                  'grandparent_thumb': session.get('grandparent_thumb', ''),
+                  'year': session.get('year', ''),
+                  'friendly_name': session.get('friendly_name', ''),
+                  'ip_address': session.get('ip_address', ''),
+                  'bandwidth': session.get('bandwidth', 0),
+                  'location': session.get('location', ''),
+                  'player': session.get('player', ''),
+                  'product': session.get('product', ''),
+                  'platform': session.get('platform', ''),
+                  'parent_rating_key': session.get('parent_rating_key', ''),
+                  'grandparent_rating_key': session.get('grandparent_rating_key', ''),
+                  'originally_available_at': session.get('originally_available_at', ''),
+                  'added_at': session.get('added_at', ''),
+                  'guid': session.get('guid', ''),
+                  'view_offset': session.get('view_offset', ''),
+                  'duration': session.get('duration', '') or 0,
+                  'video_decision': session.get('video_decision', ''),
+                  'audio_decision': session.get('audio_decision', ''),
+                  'transcode_decision': session.get('transcode_decision', ''),
+                  'width': session.get('width', ''),
+                  'height': session.get('height', ''),
+                  'container': session.get('container', ''),
+                  'bitrate': session.get('bitrate', ''),
+                  'video_codec': session.get('video_codec', ''),
+                  'video_bitrate': session.get('video_bitrate', ''),
+                  'video_width': session.get('video_width', ''),
+                  'video_height': session.get('video_height', ''),
+                  'video_resolution': session.get('video_resolution', ''),
+                  'video_framerate': session.get('video_framerate', ''),
+                  'video_scan_type': session.get('video_scan_type', ''),
+                  'video_full_resolution': session.get('video_full_resolution', ''),
+                  'video_dynamic_range': session.get('video_dynamic_range', ''),
+                  'aspect_ratio': session.get('aspect_ratio', ''),
+                  'audio_codec': session.get('audio_codec', ''),
+                  'audio_bitrate': session.get('audio_bitrate', ''),
+                  'audio_channels': session.get('audio_channels', ''),
+                  'audio_language': session.get('audio_language', ''),
+                  'audio_language_code': session.get('audio_language_code', ''),
+                  'subtitle_codec': session.get('subtitle_codec', ''),
+                  'subtitle_forced': session.get('subtitle_forced', ''),
+                  'subtitle_language': session.get('subtitle_language', ''),
+                  'transcode_protocol': session.get('transcode_protocol', ''),
+                  'transcode_container': session.get('transcode_container', ''),
+                  'transcode_video_codec': session.get('transcode_video_codec', ''),
+                  'transcode_audio_codec': session.get('transcode_audio_codec', ''),
+                  'transcode_audio_channels': session.get('transcode_audio_channels', ''),
+                  'transcode_width': session.get('stream_video_width', ''),
+                  'transcode_height': session.get('stream_video_height', ''),
+                  'transcode_hw_decoding': session.get('transcode_hw_decoding', ''),
+                  'transcode_hw_encoding': session.get('transcode_hw_encoding', ''),
+                  'synced_version': session.get('synced_version', ''),
+                  'synced_version_profile': session.get('synced_version_profile', ''),
+                  'optimized_version': session.get('optimized_version', ''),
+                  'optimized_version_profile': session.get('optimized_version_profile', ''),
+                  'optimized_version_title': session.get('optimized_version_title', ''),
+                  'stream_bitrate': session.get('stream_bitrate', ''),
+                  'stream_video_resolution': session.get('stream_video_resolution', ''),
+                  'quality_profile': session.get('quality_profile', ''),
+                  'stream_container_decision': session.get('stream_container_decision', ''),
+                  'stream_container': session.get('stream_container', ''),
+                  'stream_video_decision': session.get('stream_video_decision', ''),
+                  'stream_video_codec': session.get('stream_video_codec', ''),
+                  'stream_video_bitrate': session.get('stream_video_bitrate', ''),
+                  'stream_video_width': session.get('stream_video_width', ''),
+                  'stream_video_height': session.get('stream_video_height', ''),
+                  'stream_video_framerate': session.get('stream_video_framerate', ''),
+                  'stream_video_scan_type': session.get('stream_video_scan_type', ''),
+                  'stream_video_full_resolution': session.get('stream_video_full_resolution', ''),
+                  'stream_video_dynamic_range': session.get('stream_video_dynamic_range', ''),
+                  'stream_audio_decision': session.get('stream_audio_decision', ''),
+                  'stream_audio_codec': session.get('stream_audio_codec', ''),
+                  'stream_audio_bitrate': session.get('stream_audio_bitrate', ''),
+                  'stream_audio_channels': session.get('stream_audio_channels', ''),
+                  'stream_audio_language': session.get('stream_audio_language', ''),
+                  'stream_audio_language_code': session.get('stream_audio_language_code', ''),
+                  'stream_subtitle_decision': session.get('stream_subtitle_decision', ''),
+                  'stream_subtitle_codec': session.get('stream_subtitle_codec', ''),
+                  'stream_subtitle_forced': session.get('stream_subtitle_forced', ''),
+                  'stream_subtitle_language': session.get('stream_subtitle_language', ''),
+                  'subtitles': session.get('subtitles', 0),
+                  'live': session.get('live', 0),
+                  'live_uuid': session.get('live_uuid', ''),
+                  'secure': session.get('secure', None),
+                  'relayed': session.get('relayed', 0),
+                  'rating_key_websocket': session.get('rating_key_websocket', ''),
+                  'raw_stream_info': json.dumps(session),
+                  'channel_call_sign': session.get('channel_call_sign', ''),
+                  'channel_id': session.get('channel_id', ''),
+                  'channel_identifier': session.get('channel_identifier', ''),
+                  'channel_title': session.get('channel_title', ''),
+                  'channel_thumb': session.get('channel_thumb', ''),
+                  'channel_vcn': session.get('channel_vcn', ''),
+                  'stopped': helpers.timestamp()
+                  }
+
+        values['session_key'] = _optional_int(session.get('session_key'))
+        values['rating_key'] = _optional_int(session.get('rating_key'))
+
+        for column in SessionModel.__table__.columns:
+            if column.name not in values:
+                continue
+            if isinstance(column.type, Integer):
+                values[column.name] = _optional_int(values[column.name])
+
+        return values
+
+    def refresh_sessions(self, sessions, db_session):
+        """Update the rows of sessions that are already in the sessions table in one batch."""
+        rows = []
+        for session in sessions:
+            values = self._session_values(session)
+            if values['session_key'] is not None:
+                rows.append(values)
+
+        if not rows:
+            return
+
+        # Bind names can't match the column names of an UPDATE
+        table = SessionModel.__table__
+        stmt = (
+            update(table)
+            .where(table.c.session_key == bindparam('b_session_key'))
+            .values({name: bindparam('b_' + name) for name in rows[0]})
+        )
+        db_session.execute(stmt, [{'b_' + name: value for name, value in row.items()} for row in rows])
+
     def write_session(self, session=None, notify=True):
         if session:
-            def _optional_int(value):
-                if value is None or value == '':
-                    return None
-                return helpers.cast_to_int(value)
-
-            session_key = _optional_int(session.get('session_key'))
-            rating_key = _optional_int(session.get('rating_key'))
-
-            values = {'session_key': session.get('session_key', ''),
-                      'session_id': session.get('session_id', ''),
-                      'transcode_key': session.get('transcode_key', ''),
-                      'section_id': session.get('section_id', ''),
-                      'rating_key': session.get('rating_key', ''),
-                      'media_type': session.get('media_type', ''),
-                      'state': session.get('state', ''),
-                      'user_id': session.get('user_id', ''),
-                      'user': session.get('user', ''),
-                      'machine_id': session.get('machine_id', ''),
-                      'title': session.get('title', ''),
-                      'parent_title': session.get('parent_title', ''),
-                      'grandparent_title': session.get('grandparent_title', ''),
-                      'original_title': session.get('original_title', ''),
-                      'full_title': session.get('full_title', ''),
-                      'media_index': session.get('media_index', ''),
-                      'parent_media_index': session.get('parent_media_index', ''),
-                      'thumb': session.get('thumb', ''),
-                      'parent_thumb': session.get('parent_thumb', ''),
-                      'grandparent_thumb': session.get('grandparent_thumb', ''),
-                      'year': session.get('year', ''),
-                      'friendly_name': session.get('friendly_name', ''),
-                      'ip_address': session.get('ip_address', ''),
-                      'bandwidth': session.get('bandwidth', 0),
-                      'location': session.get('location', ''),
-                      'player': session.get('player', ''),
-                      'product': session.get('product', ''),
-                      'platform': session.get('platform', ''),
-                      'parent_rating_key': session.get('parent_rating_key', ''),
-                      'grandparent_rating_key': session.get('grandparent_rating_key', ''),
-                      'originally_available_at': session.get('originally_available_at', ''),
-                      'added_at': session.get('added_at', ''),
-                      'guid': session.get('guid', ''),
-                      'view_offset': session.get('view_offset', ''),
-                      'duration': session.get('duration', '') or 0,
-                      'video_decision': session.get('video_decision', ''),
-                      'audio_decision': session.get('audio_decision', ''),
-                      'transcode_decision': session.get('transcode_decision', ''),
-                      'width': session.get('width', ''),
-                      'height': session.get('height', ''),
-                      'container': session.get('container', ''),
-                      'bitrate': session.get('bitrate', ''),
-                      'video_codec': session.get('video_codec', ''),
-                      'video_bitrate': session.get('video_bitrate', ''),
-                      'video_width': session.get('video_width', ''),
-                      'video_height': session.get('video_height', ''),
-                      'video_resolution': session.get('video_resolution', ''),
-                      'video_framerate': session.get('video_framerate', ''),
-                      'video_scan_type': session.get('video_scan_type', ''),
-                      'video_full_resolution': session.get('video_full_resolution', ''),
-                      'video_dynamic_range': session.get('video_dynamic_range', ''),
-                      'aspect_ratio': session.get('aspect_ratio', ''),
-                      'audio_codec': session.get('audio_codec', ''),
-                      'audio_bitrate': session.get('audio_bitrate', ''),
-                      'audio_channels': session.get('audio_channels', ''),
-                      'audio_language': session.get('audio_language', ''),
-                      'audio_language_code': session.get('audio_language_code', ''),
-                      'subtitle_codec': session.get('subtitle_codec', ''),
-                      'subtitle_forced': session.get('subtitle_forced', ''),
-                      'subtitle_language': session.get('subtitle_language', ''),
-                      'transcode_protocol': session.get('transcode_protocol', ''),
-                      'transcode_container': session.get('transcode_container', ''),
-                      'transcode_video_codec': session.get('transcode_video_codec', ''),
-                      'transcode_audio_codec': session.get('transcode_audio_codec', ''),
-                      'transcode_audio_channels': session.get('transcode_audio_channels', ''),
-                      'transcode_width': session.get('stream_video_width', ''),
-                      'transcode_height': session.get('stream_video_height', ''),
-                      'transcode_hw_decoding': session.get('transcode_hw_decoding', ''),
-                      'transcode_hw_encoding': session.get('transcode_hw_encoding', ''),
-                      'synced_version': session.get('synced_version', ''),
-                      'synced_version_profile': session.get('synced_version_profile', ''),
-                      'optimized_version': session.get('optimized_version', ''),
-                      'optimized_version_profile': session.get('optimized_version_profile', ''),
-                      'optimized_version_title': session.get('optimized_version_title', ''),
-                      'stream_bitrate': session.get('stream_bitrate', ''),
-                      'stream_video_resolution': session.get('stream_video_resolution', ''),
-                      'quality_profile': session.get('quality_profile', ''),
-                      'stream_container_decision': session.get('stream_container_decision', ''),
-                      'stream_container': session.get('stream_container', ''),
-                      'stream_video_decision': session.get('stream_video_decision', ''),
-                      'stream_video_codec': session.get('stream_video_codec', ''),
-                      'stream_video_bitrate': session.get('stream_video_bitrate', ''),
-                      'stream_video_width': session.get('stream_video_width', ''),
-                      'stream_video_height': session.get('stream_video_height', ''),
-                      'stream_video_framerate': session.get('stream_video_framerate', ''),
-                      'stream_video_scan_type': session.get('stream_video_scan_type', ''),
-                      'stream_video_full_resolution': session.get('stream_video_full_resolution', ''),
-                      'stream_video_dynamic_range': session.get('stream_video_dynamic_range', ''),
-                      'stream_audio_decision': session.get('stream_audio_decision', ''),
-                      'stream_audio_codec': session.get('stream_audio_codec', ''),
-                      'stream_audio_bitrate': session.get('stream_audio_bitrate', ''),
-                      'stream_audio_channels': session.get('stream_audio_channels', ''),
-                      'stream_audio_language': session.get('stream_audio_language', ''),
-                      'stream_audio_language_code': session.get('stream_audio_language_code', ''),
-                      'stream_subtitle_decision': session.get('stream_subtitle_decision', ''),
-                      'stream_subtitle_codec': session.get('stream_subtitle_codec', ''),
-                      'stream_subtitle_forced': session.get('stream_subtitle_forced', ''),
-                      'stream_subtitle_language': session.get('stream_subtitle_language', ''),
-                      'subtitles': session.get('subtitles', 0),
-                      'live': session.get('live', 0),
-                      'live_uuid': session.get('live_uuid', ''),
-                      'secure': session.get('secure', None),
-                      'relayed': session.get('relayed', 0),
-                      'rating_key_websocket': session.get('rating_key_websocket', ''),
-                      'raw_stream_info': json.dumps(session),
-                      'channel_call_sign': session.get('channel_call_sign', ''),
-                      'channel_id': session.get('channel_id', ''),
-                      'channel_identifier': session.get('channel_identifier', ''),
-                      'channel_title': session.get('channel_title', ''),
-                      'channel_thumb': session.get('channel_thumb', ''),
-                      'channel_vcn': session.get('channel_vcn', ''),
-                      'stopped': helpers.timestamp()
-                      }
-
-            values['session_key'] = session_key
-            values['rating_key'] = rating_key
-
-            for column in SessionModel.__table__.columns:
-                if column.name not in values:
-                    continue
-                if isinstance(column.type, Integer):
-                    values[column.name] = _optional_int(values[column.name])
+            values = self._session_values(session)
+            session_key = values['session_key']
 
             keys = {'session_key': session_key}
 
@@ -390,6 +417,8 @@ class ActivityProcessor(object):
                     if column.name in values and isinstance(column.type, Integer):
                         values[column.name] = _optional_int(values[column.name])
 
+                values.update(localtime.local_values(values['started']))
+
                 dedupe_user_id = _optional_int(session.get('user_id'))
                 dedupe_rating_key = _optional_int(session.get('rating_key'))
                 dedupe_started = _optional_int(session.get('started'))
@@ -429,6 +458,7 @@ class ActivityProcessor(object):
                         inserted = True
 
                 if inserted and last_id:
+                    counts.invalidate_total_count('session_history')
                     self.group_history(last_id, session, metadata)
 
                 if not last_id:
@@ -620,6 +650,8 @@ class ActivityProcessor(object):
                         insert_values = {**values, **keys}
                         db_session.execute(insert(SessionHistoryMetadata).values(**insert_values))
 
+                rollups.refresh_history_rollup([last_id])
+
             # Return the session row id when the session is successfully written to the database
             return session['id']
 
@@ -1020,36 +1052,23 @@ class ActivityProcessor(object):
 
         logger.info("Tautulli ActivityProcessor :: Regrouping session history...")
 
-        with session_scope() as db_session:
-            stmt = (
-                select(
-                    SessionHistory.id,
-                    SessionHistory.user_id,
-                    SessionHistory.rating_key,
-                    SessionHistory.view_offset,
-                    SessionHistory.media_type,
-                    SessionHistoryMetadata.duration,
-                    SessionHistoryMetadata.marker_credits_first,
-                    SessionHistoryMetadata.marker_credits_final,
-                    SessionHistoryMetadata.live,
-                    SessionHistoryMetadata.guid,
-                )
-                .join(SessionHistoryMetadata, SessionHistory.id == SessionHistoryMetadata.id)
-            )
-            results = queries.fetch_mappings(db_session, stmt)
-        count = len(results)
-        progress = 0
-
-        for i, session in enumerate(results, start=1):
-            if int(i / count * 10) > progress:
-                progress = int(i / count * 10)
-                logger.info("Tautulli ActivityProcessor :: Regrouping session history: %d%%", progress * 10)
-
-            try:
-                self.group_history(session['id'], session)
-            except Exception as e:
-                logger.error("Tautulli ActivityProcessor :: Error regrouping session history: %s", e)
-                return False
+        progress = {'percent': 0}
+
+        def log_progress(done, total):
+            percent = int(done / total * 10) * 10
+            if percent > progress['percent']:
+                progress['percent'] = percent
+                logger.info("Tautulli ActivityProcessor :: Regrouping session history: %d%%", percent)
+
+        try:
+            changed = regroup.regroup_history(progress=log_progress)
+        except Exception as e:
+            logger.error("Tautulli ActivityProcessor :: Error regrouping session history: %s", e)
+            return False
+
+        logger.debug("Tautulli ActivityProcessor :: Regrouped %d session history rows.", changed)
+
+        rollups.rebuild_history_rollup()
 
         logger.info("Tautulli ActivityProcessor :: Regrouping session history complete.")
         return True
@@ -18,16 +18,19 @@
 import csv
 import json
 import os
+import pickle
 import requests
 import shutil
+import tempfile
 import threading
 
+from datetime import datetime
 from functools import partial, reduce
 from io import open
 from multiprocessing.dummy import Pool as ThreadPool
 
 import plexpy
-from sqlalchemy import delete, select, update
+from sqlalchemy import delete, func, select, update
 
 from plexpy.db import datatables
 from plexpy.db.models import Export as ExportModel
@@ -91,6 +94,16 @@ class Export(object):
         ('item', 'collection'),
         ('item', 'playlist')
     ]
+    # Attributes changed without bumping updatedAt, compared with the base export by incremental exports
+    INCREMENTAL_COMPARE_ATTRS = (
+        'childCount', 'leafCount', 'viewedLeafCount', 'viewCount', 'lastViewedAt', 'userRating', 'lastRatedAt'
+    )
+    # Descendants searched for changes when an incremental export includes child items
+    INCREMENTAL_CHILD_MEDIA_TYPES = {
+        'show': ('season', 'episode'),
+        'artist': ('album', 'track')
+    }
+    INCREMENTAL_CHILD_SEARCH_FIELDS = ('addedAt', 'updatedAt', 'lastViewedAt', 'lastRatedAt')
     METADATA_LEVELS = (0, 1, 2, 3, 9)
     MEDIA_INFO_LEVELS = (0, 1, 2, 3, 9)
     IMAGE_LEVELS = (0, 1, 2, 9)
@@ -100,7 +113,8 @@ class Export(object):
     def __init__(self, section_id=None, user_id=None, rating_key=None, file_format='csv',
                  metadata_level=1, media_info_level=1,
                  thumb_level=0, art_level=0, logo_level=0,
-                 custom_fields='', export_type='all', individual_files=False):
+                 custom_fields='', export_type='all', individual_files=False,
+                 incremental=False, base_export_id=None):
         self.section_id = helpers.cast_to_int(section_id) or None
         self.user_id = helpers.cast_to_int(user_id) or None
         self.rating_key = helpers.cast_to_int(rating_key) or None
@@ -114,6 +128,10 @@ class Export(object):
         self._custom_fields = {}
         self.export_type = str(export_type).lower() or 'all'
         self.individual_files = individual_files
+        self.base_export_id = helpers.cast_to_int(base_export_id) or None
+        self.incremental = bool(incremental or self.base_export_id)
+        self.incremental_children = False
+        self.base_export = None
 
         self.timestamp = helpers.timestamp()
 
@@ -133,6 +151,7 @@ class Export(object):
 
         self.total_items = 0
         self.exported_items = 0
+        self.reused_items = 0
         self.success = False
 
         # Reset export options for m3u
@@ -1816,6 +1835,12 @@ class Export(object):
                   "Only export_type 'playlist' is allowed for user export."
         elif self.individual_files and self.rating_key:
             msg = "Individual file export is only allowed for library or user export."
+        elif self.incremental and (not self.section_id or self.export_type != 'all'):
+            msg = "Incremental export is only allowed for export of all library items."
+        elif self.incremental and self.file_format != 'json':
+            msg = "Incremental export is only allowed for file_format 'json'."
+        elif self.incremental and (self.individual_files or self.thumb_level or self.art_level or self.logo_level):
+            msg = "Incremental export is not allowed for individual file or image export."
 
         if msg:
             logger.error("Tautulli Exporter :: %s", msg)
@@ -1898,6 +1923,21 @@ class Export(object):
 
         self._process_custom_fields()
 
+        if self.incremental:
+            export_attrs = self._get_export_attrs(self.media_type)
+            child_attrs = [self.PLURAL_MEDIA_TYPES[child_media_type]
+                           for child_media_type in self.CHILD_MEDIA_TYPES[self.media_type]
+                           if self.PLURAL_MEDIA_TYPES[child_media_type] in export_attrs]
+            self.incremental_children = bool(child_attrs)
+            if child_attrs and self.media_type not in self.INCREMENTAL_CHILD_MEDIA_TYPES:
+                msg = "Incremental export is not allowed when exporting child items ({}).".format(
+                    ', '.join(child_attrs))
+            else:
+                msg = self._get_base_export()
+            if msg:
+                logger.error("Tautulli Exporter :: %s", msg)
+                return msg
+
         self.directory = self._filename(directory=True)
         self.filename = self._filename()
         self.title = self._filename(extension=False)
@@ -1930,7 +1970,8 @@ class Export(object):
             'art_level': self.art_level,
             'logo_level': self.logo_level,
             'custom_fields': self.custom_fields,
-            'individual_files': self.individual_files
+            'individual_files': self.individual_files,
+            'base_export_id': self.base_export_id
         }
 
         try:
@@ -2017,8 +2058,12 @@ class Export(object):
         pool = ThreadPool(processes=plexpy.CONFIG.EXPORT_THREADS)
         items = [ExportObject(self, item) for item in items]
 
+        if self.base_export:
+            self._merge_base_export(items)
+
         try:
-            result = pool.map(self._do_export, items)
+            # Results are written as they complete, in item order
+            result = pool.imap(self._do_export, items)
 
             if self.individual_files:
                 for item, item_result in zip(items, result):
@@ -2048,6 +2093,132 @@ class Export(object):
             pool.join()
             self.set_export_state()
 
+    def _get_base_export(self):
+        """
+        Find the export to merge an incremental export with: the base_export_id,
+        or else the latest complete export of the library with the same options.
+        """
+        stmt = select(ExportModel).where(
+            ExportModel.section_id == self.section_id,
+            ExportModel.rating_key.is_(None),
+            ExportModel.media_type == self.media_type,
+            ExportModel.file_format == self.file_format,
+            ExportModel.metadata_level == self.metadata_level,
+            ExportModel.media_info_level == self.media_info_level,
+            func.coalesce(ExportModel.custom_fields, '') == self.custom_fields,
+            func.coalesce(ExportModel.individual_files, 0) == 0,
+            func.coalesce(ExportModel.thumb_level, 0) == 0,
+            func.coalesce(ExportModel.art_level, 0) == 0,
+            func.coalesce(ExportModel.logo_level, 0) == 0,
+            ExportModel.complete == 1,
+        )
+        if self.base_export_id:
+            stmt = stmt.where(ExportModel.id == self.base_export_id)
+        else:
+            stmt = stmt.order_by(ExportModel.timestamp.desc(), ExportModel.id.desc()).limit(1)
+
+        with session_scope() as session:
+            export = session.execute(stmt).scalars().first()
+            base_export = {
+                'export_id': export.id,
+                'timestamp': export.timestamp,
+                'title': export.title,
+                'file_format': export.file_format
+            } if export else None
+
+        if base_export:
+            filename = format_export_filename(base_export['title'], base_export['file_format'])
+            if not check_export_exists(base_export['title'], base_export['timestamp'], filename):
+                base_export = None
+
+        if base_export:
+            self.base_export = base_export
+            self.base_export_id = base_export['export_id']
+        elif self.base_export_id:
+            return "Cannot merge with export_id {}. It must be a complete export of the same library " \
+                   "and export options, and the export file must exist.".format(self.base_export_id)
+        else:
+            logger.info("Tautulli Exporter :: No previous export of section_id %s to merge with, "
+                        "exporting all items.", self.section_id)
+
+    def _get_base_items(self):
+        filepath = get_export_filepath(self.base_export['title'], self.base_export['timestamp'],
+                                       format_export_filename(self.base_export['title'],
+                                                              self.base_export['file_format']))
+        try:
+            with open(filepath, 'r', encoding='utf-8') as infile:
+                data = json.load(infile)
+        except (OSError, ValueError) as e:
+            logger.warn("Tautulli Exporter :: Unable to read export_id %s, exporting all items: %s",
+                        self.base_export_id, e)
+            return {}
+
+        return {item['ratingKey']: item for item in data if isinstance(item, dict) and 'ratingKey' in item}
+
+    def _is_updated(self, obj, data, since):
+        # Read the loaded values, a missing attribute reloads a partial object
+        values = obj.__dict__
+        timestamps = [int(values[attr].timestamp()) for attr in ('updatedAt', 'addedAt')
+                      if isinstance(values.get(attr), datetime)]
+        if not timestamps or max(timestamps) >= since:
+            return True
+
+        # Children added or removed and watch state or rating changes don't update the item
+        for attr in self.INCREMENTAL_COMPARE_ATTRS:
+            if attr in data and attr in values and helpers.datetime_to_iso(values[attr]) != data[attr]:
+                return True
+
+        return False
+
+    def _get_updated_parents(self, since):
+        """
+        Return the rating keys of the library items with a child added, updated,
+        watched or rated since the timestamp, or None if the children can't be searched.
+        """
+        since = datetime.fromtimestamp(since)
+        rating_keys = set()
+
+        for media_type in self.INCREMENTAL_CHILD_MEDIA_TYPES[self.media_type]:
+            for field in self.INCREMENTAL_CHILD_SEARCH_FIELDS:
+                try:
+                    children = self.obj.search(libtype=media_type, filters={field + '>>=': since})
+                except Exception as e:
+                    logger.warn("Tautulli Exporter :: Unable to search %s for changes, exporting all items: %s",
+                                self.PLURAL_MEDIA_TYPES[media_type], e)
+                    return None
+
+                for child in children:
+                    # Read the loaded values, a missing attribute reloads a partial object
+                    values = child.__dict__
+                    rating_keys.add(values.get('grandparentRatingKey') or values.get('parentRatingKey'))
+
+        return rating_keys
+
+    def _merge_base_export(self, items):
+        """Reuse the exported data of the base export for the items not added or updated since it started."""
+        since = self.base_export['timestamp']
+
+        updated_parents = set()
+        if self.incremental_children:
+            updated_parents = self._get_updated_parents(since)
+            if updated_parents is None:
+                return
+
+        base_items = self._get_base_items()
+
+        for item in items:
+            data = base_items.get(item.rating_key)
+            if data is not None and item.rating_key not in updated_parents \
+                    and not self._is_updated(item.obj, data, since):
+                item.base_data = data
+                self.reused_items += 1
+
+        # Only keep the data of the reused items
+        del base_items
+
+        logger.info("Tautulli Exporter :: Reusing %d unchanged item(s) from export_id %s.",
+                    self.reused_items, self.base_export_id)
+
     def _do_export(self, item):
         result = item._export_obj()
         self.exported_items += 1
@@ -2055,6 +2226,7 @@ class Export(object):
         return result
 
     def _save_file(self, result, obj=None):
+        """Write the exported items of the result iterable to the export file of obj as they arrive."""
         filename = obj.filename
         dirpath = get_export_dirpath(self.directory)
         filepath = os.path.join(dirpath, filename)
@@ -2062,34 +2234,57 @@ class Export(object):
         if not os.path.exists(dirpath):
             os.makedirs(dirpath)
 
-        if self.file_format == 'csv':
-            csv_data = helpers.flatten_dict(result)
-            csv_headers = sorted(set().union(*csv_data), key=helpers.sort_attrs)
-            # Move ratingKey, title, and titleSort to front of headers
-            for key in ('titleSort', 'title', 'ratingKey'):
-                csv_headers = helpers.move_to_front(csv_headers, key)
-            with open(filepath, 'w', encoding='utf-8', newline='') as outfile:
-                writer = csv.DictWriter(outfile, csv_headers)
-                writer.writeheader()
-                writer.writerows(csv_data)
-
-        elif self.file_format == 'json':
-            json_data = json.dumps(helpers.sort_obj(result), indent=4, ensure_ascii=False)
-            with open(filepath, 'w', encoding='utf-8') as outfile:
-                outfile.write(json_data)
-
-        elif self.file_format == 'xml':
-            xml_data = self.data_to_xml(result, obj)
-            with open(filepath, 'w', encoding='utf-8') as outfile:
-                outfile.write(xml_data)
-
-        elif self.file_format == 'm3u':
-            m3u_data = self.data_to_m3u(result, obj)
-            with open(filepath, 'w', encoding='utf-8') as outfile:
-                outfile.write(m3u_data)
+        writer_class = EXPORT_WRITERS[self.file_format]
+        writer = writer_class(self, obj, filepath)
+        try:
+            for item in result:
+                writer.write(item)
+        finally:
+            writer.close()
 
         self.file_size += os.path.getsize(filepath)
 
+    def _export_schema(self, media_type):
+        """
+        Return the export attributes of the media type with the child exports
+        expanded, or None if the children can be of any media type.
+        """
+        children = {self.PLURAL_MEDIA_TYPES[child]: child for child in self.CHILD_MEDIA_TYPES.get(media_type, [])}
+        if any(child in ('photoalbum', 'item') for child in children.values()):
+            return None
+
+        schema = {}
+        for attr, sub in self._get_export_attrs(media_type).items():
+            if attr in children:
+                sub = self._export_schema(children[attr])
+                if sub is None:
+                    return None
+            schema[attr] = sub
+        return schema
+
+    def csv_headers(self, media_type=None):
+        """
+        Return the CSV columns for exported items of the media type, or None if
+        they can't be known before the items are exported.
+        """
+        media_type = media_type or self.media_type
+        if media_type in ('photo', 'photoalbum', 'collection', 'playlist'):
+            # Photo libraries mix photo albums and photos, the others contain any media type
+            return None
+
+        schema = self._export_schema(media_type)
+        if schema is None:
+            return None
+        return self.sort_csv_headers(helpers.flatten_dict(schema)[0])
+
+    @staticmethod
+    def sort_csv_headers(headers):
+        csv_headers = sorted(headers, key=helpers.sort_attrs)
+        # Move ratingKey, title, and titleSort to front of headers
+        for key in ('titleSort', 'title', 'ratingKey'):
+            csv_headers = helpers.move_to_front(csv_headers, key)
+        return csv_headers
+
     def _exported_images(self, title):
         dirpath = get_export_dirpath(self.directory)
 
@@ -2248,8 +2443,11 @@ class Export(object):
         return helpers.dict_to_xml(xml_metadata, root_node='export', indent=4)
 
     def data_to_m3u(self, data, obj):
-        items = self._get_m3u_items(data)
+        m3u_items = [self.m3u_item(item) for item in self._get_m3u_items(data)]
+        return self.m3u_header(obj) + '\n'.join(m3u_items)
 
+    @staticmethod
+    def m3u_header(obj):
         m3u_metadata = {'title': obj.title, 'type': obj.media_type}
         if obj.rating_key:
             m3u_metadata['ratingKey'] = obj.rating_key
@@ -2260,22 +2458,19 @@ class Export(object):
 
         m3u = '#EXTM3U\n'
         m3u += '# Playlist: {title}\n# {metadata}\n\n'.format(title=obj.title, metadata=json.dumps(m3u_metadata))
-        m3u_item_template = '# {metadata}\n#EXTINF:{duration},{title}\n{location}\n'
-        m3u_items = []
-
-        for item in items:
-            m3u_values = {
-                'duration': item.pop('duration'),
-                'title': item.pop('title'),
-                'location': item.pop('location'),
-                'metadata': json.dumps(item)
-            }
-            m3u_items.append(m3u_item_template.format(**m3u_values))
-
-        m3u = m3u + '\n'.join(m3u_items)
-
         return m3u
 
+    @staticmethod
+    def m3u_item(item):
+        m3u_item_template = '# {metadata}\n#EXTINF:{duration},{title}\n{location}\n'
+        m3u_values = {
+            'duration': item.pop('duration'),
+            'title': item.pop('title'),
+            'location': item.pop('location'),
+            'metadata': json.dumps(item)
+        }
+        return m3u_item_template.format(**m3u_values)
+
     def _get_m3u_items(self, data):
         items = []
 
@@ -2407,13 +2602,157 @@ class ExportObject(Export):
         self.rating_key = self.obj.ratingKey
         self.filename = self._filename(obj=self.obj)
         self.title = self._filename(obj=self.obj, extension=False)
+        self.base_data = None
 
     def _export_obj(self):
-        result = self.export_obj(self.obj)
+        if self.base_data is not None:
+            result = self.base_data
+        else:
+            result = self.export_obj(self.obj)
         self.obj = None  # Clear the object to prevent memory leak
+        self.base_data = None
         return result
 
 
+class ExportWriter(object):
+    """Writes exported items to an export file one at a time."""
+
+    def __init__(self, export, obj, filepath):
+        self.export = export
+        self.obj = obj
+        self.count = 0
+        self.outfile = open(filepath, 'w', encoding='utf-8', newline=self.NEWLINE)
+        self.start()
+
+    NEWLINE = None
+
+    def start(self):
+        pass
+
+    def write(self, data):
+        self._write(data)
+        self.count += 1
+
+    def _write(self, data):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def close(self):
+        try:
+            self.finish()
+        finally:
+            self.outfile.close()
+
+
+class CSVExportWriter(ExportWriter):
+    """
+    Writes flattened rows with the columns of the export attributes. When the
+    columns depend on the exported items, the rows are spooled to a temporary
+    file until all columns are known.
+    """
+    NEWLINE = ''
+
+    def start(self):
+        self.headers = self.export.csv_headers()
+        self.spool = None
+        self.spool_headers = set()
+        self.unknown_headers = set()
+
+        if self.headers is None:
+            self.spool = tempfile.TemporaryFile(dir=os.path.dirname(self.outfile.name))
+        else:
+            self.writer = csv.DictWriter(self.outfile, self.headers, extrasaction='ignore')
+            self.writer.writeheader()
+            self.header_set = set(self.headers)
+
+    def _write(self, data):
+        rows = helpers.flatten_dict([data])
+
+        if self.spool is not None:
+            for row in rows:
+                self.spool_headers.update(row)
+                pickle.dump(row, self.spool, protocol=pickle.HIGHEST_PROTOCOL)
+            return
+
+        for row in rows:
+            self.unknown_headers.update(k for k in row if k not in self.header_set)
+        self.writer.writerows(rows)
+
+    def finish(self):
+        if self.unknown_headers:
+            logger.warn("Tautulli Exporter :: Skipped unexpected CSV columns: %s", ', '.join(sorted(self.unknown_headers)))
+
+        if self.spool is None:
+            return
+
+        try:
+            writer = csv.DictWriter(self.outfile, self.export.sort_csv_headers(self.spool_headers))
+            writer.writeheader()
+            self.spool.seek(0)
+            while True:
+                try:
+                    writer.writerow(pickle.load(self.spool))
+                except EOFError:
+                    break
+        finally:
+            self.spool.close()
+
+
+class JSONExportWriter(ExportWriter):
+    """Writes the items as a JSON array, formatted like ``json.dumps(items, indent=4)``."""
+    INDENT = 4
+
+    def start(self):
+        self.outfile.write('[')
+
+    def _write(self, data):
+        item = json.dumps(helpers.sort_obj(data), indent=self.INDENT, ensure_ascii=False)
+        item = item.replace('\n', '\n' + ' ' * self.INDENT)
+        self.outfile.write('{}\n{}{}'.format(',' if self.count else '', ' ' * self.INDENT, item))
+
+    def finish(self):
+        self.outfile.write('\n]' if self.count else ']')
+
+
+class XMLExportWriter(ExportWriter):
+    """Writes the items inside the ``export`` root node rendered by ``data_to_xml``."""
+
+    def start(self):
+        xml = self.export.data_to_xml([], self.obj)
+        index = xml.rfind('</export>')
+        self.outfile.write(xml[:index])
+        self.footer = xml[index:]
+
+    def _write(self, data):
+        self.outfile.write(helpers.dict_to_xml([helpers.sort_obj(data)], self.obj.media_type, indent=4, level=1))
+
+    def finish(self):
+        self.outfile.write(self.footer)
+
+
+class M3UExportWriter(ExportWriter):
+    """Writes the playlist entries of the items after the ``m3u_header``."""
+
+    def start(self):
+        self.outfile.write(self.export.m3u_header(self.obj))
+        self.entries = 0
+
+    def _write(self, data):
+        for item in self.export._get_m3u_items([data]):
+            self.outfile.write(('\n' if self.entries else '') + self.export.m3u_item(item))
+            self.entries += 1
+
+
+EXPORT_WRITERS = {
+    'csv': CSVExportWriter,
+    'json': JSONExportWriter,
+    'xml': XMLExportWriter,
+    'm3u': M3UExportWriter
+}
+
+
 def get_export(export_id):
     if not str(export_id).isdigit():
         return None
@@ -2431,6 +2770,7 @@ def get_export(export_id):
             'logo_level': export.logo_level,
             'individual_files': export.individual_files,
             'complete': export.complete,
+            'base_export_id': export.base_export_id,
         }
 
     if result['individual_files']:
@@ -2532,7 +2872,8 @@ def get_export_datatable(section_id=None, user_id=None, rating_key=None, kwargs=
                "exports.file_size",
                "exports.complete",
                "exports.total_items",
-               "exports.exported_items"
+               "exports.exported_items",
+               "exports.base_export_id"
                ]
     try:
         query = data_tables.ssp_query(table_name='exports',
@@ -2579,6 +2920,7 @@ def get_export_datatable(section_id=None, user_id=None, rating_key=None, kwargs=
                'complete': item['complete'],
                'exported_items': item['exported_items'],
                'total_items': item['total_items'],
+               'base_export_id': item['base_export_id'],
                'exists': exists
                }
 
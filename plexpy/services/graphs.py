@@ -18,16 +18,22 @@
 import datetime
 
 import arrow
-from sqlalchemy import Integer, and_, case, cast, distinct, func, or_, select
+from sqlalchemy import Text, and_, case, cast, distinct, func, or_, select
 
 import plexpy
 from plexpy.app import common
 from plexpy.services import libraries
 from plexpy.web import session
 from plexpy.db import queries
-from plexpy.db.models import SessionHistory, SessionHistoryMediaInfo, SessionHistoryMetadata, User
+from plexpy.db import localtime
+from plexpy.db.models import (
+    SessionHistory,
+    SessionHistoryDaily,
+    SessionHistoryMediaInfo,
+    User,
+)
 from plexpy.db.session import session_scope
-from plexpy.db.queries import time as time_queries
+from plexpy.util import concurrency
 from plexpy.util import helpers
 from plexpy.util import logger
 
@@ -37,27 +43,6 @@ class Graphs(object):
     def __init__(self):
         pass
 
-    def _timezone_name(self):
-        timezone = plexpy.SYS_TIMEZONE or 'UTC'
-        tz_name = getattr(timezone, 'zone', None) or str(timezone)
-        return tz_name.replace("'", "''")
-
-    def _localtime_expr(self, column=SessionHistory.started):
-        tz_name = self._timezone_name()
-        return time_queries.timezone(tz_name, time_queries.to_timestamp(column))
-
-    def _local_date_expr(self, column=SessionHistory.started):
-        return time_queries.to_char(self._localtime_expr(column), 'YYYY-MM-DD')
-
-    def _local_month_expr(self, column=SessionHistory.started):
-        return time_queries.to_char(self._localtime_expr(column), 'YYYY-MM')
-
-    def _local_hour_expr(self, column=SessionHistory.started):
-        return time_queries.to_char(self._localtime_expr(column), 'HH24')
-
-    def _local_dow_expr(self, column=SessionHistory.started):
-        return cast(time_queries.extract('dow', self._localtime_expr(column)), Integer)
-
     def _group_key_expr(self, grouping):
         return func.coalesce(SessionHistory.reference_id, SessionHistory.id) if grouping else SessionHistory.id
 
@@ -71,67 +56,53 @@ class Graphs(object):
             else_=0,
         )
 
+    def _rollup_start_date(self, time_range):
+        # First local day shown on a daily graph
+        return localtime.range_start_date(time_range)
+
+    def _rollup_metric(self, y_axis, grouping):
+        if y_axis == 'plays':
+            return SessionHistoryDaily.grouped_plays if grouping else SessionHistoryDaily.plays
+        return SessionHistoryDaily.duration
+
+    def _media_type_sums(self, metric):
+        rollup = SessionHistoryDaily
+        tv_count = func.sum(case((and_(rollup.media_type == 'episode', rollup.live == 0), metric), else_=0))
+        movie_count = func.sum(case((and_(rollup.media_type == 'movie', rollup.live == 0), metric), else_=0))
+        music_count = func.sum(case((and_(rollup.media_type == 'track', rollup.live == 0), metric), else_=0))
+        live_count = func.sum(case((rollup.live == 1, metric), else_=0))
+        return tv_count, movie_count, music_count, live_count
+
+    def _stream_type_sums(self, metric):
+        rollup = SessionHistoryDaily
+        dp_count = func.sum(case((rollup.transcode_decision == 'direct play', metric), else_=0))
+        ds_count = func.sum(case((rollup.transcode_decision == 'copy', metric), else_=0))
+        tc_count = func.sum(case((rollup.transcode_decision == 'transcode', metric), else_=0))
+        return dp_count, ds_count, tc_count
+
     def get_total_plays_per_day(self, time_range='30', y_axis='plays', user_id=None, grouping=None):
         time_range = helpers.cast_to_int(time_range) or 30
-        timestamp = helpers.timestamp() - time_range * 24 * 60 * 60
-        user_filters = self._make_user_cond(user_id)
+        start_date = self._rollup_start_date(time_range)
+        user_filters = self._make_user_cond(user_id, column=SessionHistoryDaily.user_id)
 
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_key = self._group_key_expr(grouping)
-        duration_expr = self._duration_expr()
-        date_played_expr = self._local_date_expr()
+        metric = self._rollup_metric(y_axis, grouping)
+        tv_count, movie_count, music_count, live_count = self._media_type_sums(metric)
 
         try:
-            if y_axis == 'plays':
-                tv_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                movie_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                music_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                live_count = func.count(distinct(case(
-                    (SessionHistoryMetadata.live == 1, group_key),
-                    else_=None,
-                )))
-            else:
-                tv_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                movie_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                music_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                live_count = func.sum(case(
-                    (SessionHistoryMetadata.live == 1, duration_expr),
-                    else_=0,
-                ))
-
             stmt = (
                 select(
-                    date_played_expr.label('date_played'),
+                    SessionHistoryDaily.date_played,
                     tv_count.label('tv_count'),
                     movie_count.label('movie_count'),
                     music_count.label('music_count'),
                     live_count.label('live_count'),
                 )
-                .select_from(SessionHistory)
-                .join(SessionHistoryMetadata, SessionHistoryMetadata.id == SessionHistory.id)
-                .where(SessionHistory.stopped >= timestamp)
-                .group_by(date_played_expr)
-                .order_by(date_played_expr)
+                .where(SessionHistoryDaily.date_played >= start_date)
+                .group_by(SessionHistoryDaily.date_played)
+                .order_by(SessionHistoryDaily.date_played)
             )
             for cond in user_filters:
                 stmt = stmt.where(cond)
@@ -202,15 +173,15 @@ class Graphs(object):
 
     def get_total_plays_per_dayofweek(self, time_range='30', y_axis='plays', user_id=None, grouping=None):
         time_range = helpers.cast_to_int(time_range) or 30
-        timestamp = helpers.timestamp() - time_range * 24 * 60 * 60
-        user_filters = self._make_user_cond(user_id)
+        start_date = self._rollup_start_date(time_range)
+        user_filters = self._make_user_cond(user_id, column=SessionHistoryDaily.user_id)
 
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_key = self._group_key_expr(grouping)
-        duration_expr = self._duration_expr()
-        daynumber_expr = self._local_dow_expr()
+        metric = self._rollup_metric(y_axis, grouping)
+        tv_count, movie_count, music_count, live_count = self._media_type_sums(metric)
+        daynumber_expr = SessionHistoryDaily.day_of_week
         dayofweek_expr = case(
             (daynumber_expr == 0, 'Sunday'),
             (daynumber_expr == 1, 'Monday'),
@@ -222,41 +193,6 @@ class Graphs(object):
         )
 
         try:
-            if y_axis == 'plays':
-                tv_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                movie_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                music_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                live_count = func.count(distinct(case(
-                    (SessionHistoryMetadata.live == 1, group_key),
-                    else_=None,
-                )))
-            else:
-                tv_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                movie_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                music_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                live_count = func.sum(case(
-                    (SessionHistoryMetadata.live == 1, duration_expr),
-                    else_=0,
-                ))
-
             stmt = (
                 select(
                     daynumber_expr.label('daynumber'),
@@ -266,9 +202,7 @@ class Graphs(object):
                     music_count.label('music_count'),
                     live_count.label('live_count'),
                 )
-                .select_from(SessionHistory)
-                .join(SessionHistoryMetadata, SessionHistoryMetadata.id == SessionHistory.id)
-                .where(SessionHistory.stopped >= timestamp)
+                .where(SessionHistoryDaily.date_played >= start_date)
                 .group_by(daynumber_expr, dayofweek_expr)
                 .order_by(daynumber_expr)
             )
@@ -336,52 +270,17 @@ class Graphs(object):
 
     def get_total_plays_per_hourofday(self, time_range='30', y_axis='plays', user_id=None, grouping=None):
         time_range = helpers.cast_to_int(time_range) or 30
-        timestamp = helpers.timestamp() - time_range * 24 * 60 * 60
-        user_filters = self._make_user_cond(user_id)
+        start_date = self._rollup_start_date(time_range)
+        user_filters = self._make_user_cond(user_id, column=SessionHistoryDaily.user_id)
 
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_key = self._group_key_expr(grouping)
-        duration_expr = self._duration_expr()
-        hourofday_expr = self._local_hour_expr()
+        metric = self._rollup_metric(y_axis, grouping)
+        tv_count, movie_count, music_count, live_count = self._media_type_sums(metric)
+        hourofday_expr = func.lpad(cast(SessionHistoryDaily.hour, Text), 2, '0')
 
         try:
-            if y_axis == 'plays':
-                tv_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                movie_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                music_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                live_count = func.count(distinct(case(
-                    (SessionHistoryMetadata.live == 1, group_key),
-                    else_=None,
-                )))
-            else:
-                tv_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                movie_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                music_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                live_count = func.sum(case(
-                    (SessionHistoryMetadata.live == 1, duration_expr),
-                    else_=0,
-                ))
-
             stmt = (
                 select(
                     hourofday_expr.label('hourofday'),
@@ -390,9 +289,7 @@ class Graphs(object):
                     music_count.label('music_count'),
                     live_count.label('live_count'),
                 )
-                .select_from(SessionHistory)
-                .join(SessionHistoryMetadata, SessionHistoryMetadata.id == SessionHistory.id)
-                .where(SessionHistory.stopped >= timestamp)
+                .where(SessionHistoryDaily.date_played >= start_date)
                 .group_by(hourofday_expr)
                 .order_by(hourofday_expr)
             )
@@ -458,69 +355,32 @@ class Graphs(object):
 
     def get_total_plays_per_month(self, time_range='12', y_axis='plays', user_id=None, grouping=None):
         time_range = helpers.cast_to_int(time_range) or 12
-        timestamp = arrow.get(helpers.timestamp()).shift(months=-time_range).floor('month').timestamp()
-        user_filters = self._make_user_cond(user_id)
+        start_date = arrow.now(localtime.timezone_name()).shift(months=-(time_range - 1)).floor('month').format('YYYY-MM-DD')
+        user_filters = self._make_user_cond(user_id, column=SessionHistoryDaily.user_id)
 
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_key = self._group_key_expr(grouping)
-        datestring_expr = self._local_month_expr()
-        duration_expr = self._duration_expr()
+        metric = self._rollup_metric(y_axis, grouping)
+        tv_count, movie_count, music_count, live_count = self._media_type_sums(metric)
+        datestring_expr = func.left(SessionHistoryDaily.date_played, 7)
 
         try:
-            if y_axis == 'plays':
-                metric_label = 'plays'
-                metric_expr = func.count(distinct(group_key))
-            else:
-                metric_label = 'duration'
-                metric_expr = func.sum(duration_expr)
-
-            inner_stmt = (
-                select(
-                    datestring_expr.label('datestring'),
-                    SessionHistory.media_type.label('media_type'),
-                    SessionHistoryMetadata.live.label('live'),
-                    metric_expr.label(metric_label),
-                )
-                .select_from(SessionHistory)
-                .join(SessionHistoryMetadata, SessionHistoryMetadata.id == SessionHistory.id)
-                .where(SessionHistory.stopped >= timestamp)
-                .group_by(datestring_expr, SessionHistory.media_type, SessionHistoryMetadata.live)
-            )
-            for cond in user_filters:
-                inner_stmt = inner_stmt.where(cond)
-            inner = inner_stmt.subquery()
-            metric_col = getattr(inner.c, metric_label)
-
-            tv_count = func.sum(case(
-                (and_(inner.c.media_type == 'episode', inner.c.live == 0), metric_col),
-                else_=0,
-            ))
-            movie_count = func.sum(case(
-                (and_(inner.c.media_type == 'movie', inner.c.live == 0), metric_col),
-                else_=0,
-            ))
-            music_count = func.sum(case(
-                (and_(inner.c.media_type == 'track', inner.c.live == 0), metric_col),
-                else_=0,
-            ))
-            live_count = func.sum(case(
-                (inner.c.live == 1, metric_col),
-                else_=0,
-            ))
-
             stmt = (
                 select(
-                    inner.c.datestring,
+                    datestring_expr.label('datestring'),
                     tv_count.label('tv_count'),
                     movie_count.label('movie_count'),
                     music_count.label('music_count'),
                     live_count.label('live_count'),
                 )
-                .group_by(inner.c.datestring)
-                .order_by(inner.c.datestring)
+                .where(SessionHistoryDaily.date_played >= start_date)
+                .group_by(datestring_expr)
+                .order_by(datestring_expr)
             )
+            for cond in user_filters:
+                stmt = stmt.where(cond)
+
             with session_scope() as db_session:
                 result = queries.fetch_mappings(db_session, stmt)
         except Exception as e:
@@ -588,70 +448,29 @@ class Graphs(object):
 
     def get_total_plays_by_top_10_platforms(self, time_range='30', y_axis='plays', user_id=None, grouping=None):
         time_range = helpers.cast_to_int(time_range) or 30
-        timestamp = helpers.timestamp() - time_range * 24 * 60 * 60
-        user_filters = self._make_user_cond(user_id)
+        start_date = self._rollup_start_date(time_range)
+        user_filters = self._make_user_cond(user_id, column=SessionHistoryDaily.user_id)
 
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_key = self._group_key_expr(grouping)
-        duration_expr = self._duration_expr()
+        metric = self._rollup_metric(y_axis, grouping)
+        tv_count, movie_count, music_count, live_count = self._media_type_sums(metric)
+        total_metric = func.sum(metric).label('total_count' if y_axis == 'plays' else 'total_duration')
 
         try:
-            if y_axis == 'plays':
-                tv_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                movie_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                music_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                live_count = func.count(distinct(case(
-                    (SessionHistoryMetadata.live == 1, group_key),
-                    else_=None,
-                )))
-                total_count = func.count(distinct(group_key))
-                order_by = (total_count.desc(), SessionHistory.platform.asc())
-                total_metric = total_count.label('total_count')
-            else:
-                tv_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                movie_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                music_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                live_count = func.sum(case(
-                    (SessionHistoryMetadata.live == 1, duration_expr),
-                    else_=0,
-                ))
-                total_metric = func.sum(duration_expr).label('total_duration')
-                order_by = (total_metric.desc(),)
-
             stmt = (
                 select(
-                    SessionHistory.platform,
+                    SessionHistoryDaily.platform,
                     tv_count.label('tv_count'),
                     movie_count.label('movie_count'),
                     music_count.label('music_count'),
                     live_count.label('live_count'),
                     total_metric,
                 )
-                .select_from(SessionHistory)
-                .join(SessionHistoryMetadata, SessionHistoryMetadata.id == SessionHistory.id)
-                .where(SessionHistory.stopped >= timestamp)
-                .group_by(SessionHistory.platform)
-                .order_by(*order_by)
+                .where(SessionHistoryDaily.date_played >= start_date)
+                .group_by(SessionHistoryDaily.platform)
+                .order_by(total_metric.desc(), SessionHistoryDaily.platform.asc())
                 .limit(10)
             )
             for cond in user_filters:
@@ -702,59 +521,21 @@ class Graphs(object):
 
     def get_total_plays_by_top_10_users(self, time_range='30', y_axis='plays', user_id=None, grouping=None):
         time_range = helpers.cast_to_int(time_range) or 30
-        timestamp = helpers.timestamp() - time_range * 24 * 60 * 60
-        user_filters = self._make_user_cond(user_id)
+        start_date = self._rollup_start_date(time_range)
+        user_filters = self._make_user_cond(user_id, column=SessionHistoryDaily.user_id)
 
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_key = self._group_key_expr(grouping)
-        duration_expr = self._duration_expr()
+        metric = self._rollup_metric(y_axis, grouping)
+        tv_count, movie_count, music_count, live_count = self._media_type_sums(metric)
+        total_metric = func.sum(metric).label('total_count' if y_axis == 'plays' else 'total_duration')
         friendly_name_expr = case(
             (or_(User.friendly_name.is_(None), func.trim(User.friendly_name) == ''), User.username),
             else_=User.friendly_name,
         )
 
         try:
-            if y_axis == 'plays':
-                tv_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                movie_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                music_count = func.count(distinct(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), group_key),
-                    else_=None,
-                )))
-                live_count = func.count(distinct(case(
-                    (SessionHistoryMetadata.live == 1, group_key),
-                    else_=None,
-                )))
-                total_metric = func.count(distinct(group_key)).label('total_count')
-                order_by = (total_metric.desc(),)
-            else:
-                tv_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'episode', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                movie_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'movie', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                music_count = func.sum(case(
-                    (and_(SessionHistory.media_type == 'track', SessionHistoryMetadata.live == 0), duration_expr),
-                    else_=0,
-                ))
-                live_count = func.sum(case(
-                    (SessionHistoryMetadata.live == 1, duration_expr),
-                    else_=0,
-                ))
-                total_metric = func.sum(duration_expr).label('total_duration')
-                order_by = (total_metric.desc(),)
-
             stmt = (
                 select(
                     User.user_id,
@@ -766,12 +547,11 @@ class Graphs(object):
                     live_count.label('live_count'),
                     total_metric,
                 )
-                .select_from(SessionHistory)
-                .join(SessionHistoryMetadata, SessionHistoryMetadata.id == SessionHistory.id)
-                .join(User, User.user_id == SessionHistory.user_id)
-                .where(SessionHistory.stopped >= timestamp)
+                .select_from(SessionHistoryDaily)
+                .join(User, User.user_id == SessionHistoryDaily.user_id)
+                .where(SessionHistoryDaily.date_played >= start_date)
                 .group_by(User.user_id, User.username, User.friendly_name)
-                .order_by(*order_by)
+                .order_by(total_metric.desc())
                 .limit(10)
             )
             for cond in user_filters:
@@ -827,56 +607,26 @@ class Graphs(object):
 
     def get_total_plays_per_stream_type(self, time_range='30', y_axis='plays', user_id=None, grouping=None):
         time_range = helpers.cast_to_int(time_range) or 30
-        timestamp = helpers.timestamp() - time_range * 24 * 60 * 60
-        user_filters = self._make_user_cond(user_id)
+        start_date = self._rollup_start_date(time_range)
+        user_filters = self._make_user_cond(user_id, column=SessionHistoryDaily.user_id)
 
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_key = self._group_key_expr(grouping)
-        duration_expr = self._duration_expr()
-        date_played_expr = self._local_date_expr()
+        metric = self._rollup_metric(y_axis, grouping)
+        dp_count, ds_count, tc_count = self._stream_type_sums(metric)
 
         try:
-            if y_axis == 'plays':
-                dp_count = func.count(distinct(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'direct play', group_key),
-                    else_=None,
-                )))
-                ds_count = func.count(distinct(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'copy', group_key),
-                    else_=None,
-                )))
-                tc_count = func.count(distinct(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'transcode', group_key),
-                    else_=None,
-                )))
-            else:
-                dp_count = func.sum(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'direct play', duration_expr),
-                    else_=0,
-                ))
-                ds_count = func.sum(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'copy', duration_expr),
-                    else_=0,
-                ))
-                tc_count = func.sum(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'transcode', duration_expr),
-                    else_=0,
-                ))
-
             stmt = (
                 select(
-                    date_played_expr.label('date_played'),
+                    SessionHistoryDaily.date_played,
                     dp_count.label('dp_count'),
                     ds_count.label('ds_count'),
                     tc_count.label('tc_count'),
                 )
-                .select_from(SessionHistory)
-                .join(SessionHistoryMediaInfo, SessionHistoryMediaInfo.id == SessionHistory.id)
-                .where(SessionHistory.stopped >= timestamp)
-                .group_by(date_played_expr)
-                .order_by(date_played_expr)
+                .where(SessionHistoryDaily.date_played >= start_date)
+                .group_by(SessionHistoryDaily.date_played)
+                .order_by(SessionHistoryDaily.date_played)
             )
             for cond in user_filters:
                 stmt = stmt.where(cond)
@@ -927,36 +677,12 @@ class Graphs(object):
     def get_total_concurrent_streams_per_stream_type(self, time_range='30', user_id=None):
         time_range = helpers.cast_to_int(time_range) or 30
         timestamp = helpers.timestamp() - time_range * 24 * 60 * 60
-
         user_filters = self._make_user_cond(user_id)
-        date_played_expr = self._local_date_expr()
-        
-        def calc_most_concurrent(result):
-            times = []
-            for item in result:
-                times.append({'time': str(item['started']) + 'B', 'count': 1})
-                times.append({'time': str(item['stopped']) + 'A', 'count': -1})
-            times = sorted(times, key=lambda k: k['time'])
-
-            count = 0
-            final_count = 0
-            last_count = 0
-
-            for d in times:
-                if d['count'] == 1:
-                    count += d['count']
-                else:
-                    if count >= last_count:
-                        last_count = count
-                        final_count = count
-                    count += d['count']
-
-            return final_count
 
         try:
             stmt = (
                 select(
-                    date_played_expr.label('date_played'),
+                    SessionHistory.local_date,
                     SessionHistory.started,
                     SessionHistory.stopped,
                     SessionHistoryMediaInfo.transcode_decision,
@@ -964,19 +690,24 @@ class Graphs(object):
                 .select_from(SessionHistory)
                 .join(SessionHistoryMediaInfo, SessionHistoryMediaInfo.id == SessionHistory.id)
                 .where(SessionHistory.stopped >= timestamp)
-                .order_by(SessionHistory.started)
             )
             for cond in user_filters:
                 stmt = stmt.where(cond)
 
             with session_scope() as db_session:
-                result = queries.fetch_mappings(db_session, stmt)
+                result = db_session.execute(stmt).all()
         except Exception as e:
-            logger.warn("Tautulli Graphs :: Unable to execute database query for get_total_plays_per_stream_type: %s." % e)
+            logger.warn("Tautulli Graphs :: Unable to execute database query for get_total_concurrent_streams_per_stream_type: %s." % e)
             return None
 
-        result_by_date_and_decision = helpers.group_by_keys(result, ('date_played', 'transcode_decision'))
-        result_by_date = helpers.group_by_keys(result, 'date_played')
+        # One sweep over all days, per day and per day and decision
+        peaks = concurrency.peak_concurrency(
+            (started, stopped, (date_played, (date_played, transcode_decision)))
+            for date_played, started, stopped, transcode_decision in result
+        )
+
+        def peak_count(key):
+            return peaks[key]['count'] if key in peaks else 0
 
         # create our date range as some days may not have any data
         # but we still want to display them
@@ -993,23 +724,10 @@ class Graphs(object):
             date_string = date_item.strftime('%Y-%m-%d')
             categories.append(date_string)
 
-            series_1_value = calc_most_concurrent(
-                result_by_date_and_decision.get((date_string, 'direct play'), [])
-            )
-            series_2_value = calc_most_concurrent(
-                result_by_date_and_decision.get((date_string, 'copy'), [])
-            )
-            series_3_value = calc_most_concurrent(
-                result_by_date_and_decision.get((date_string, 'transcode'), [])
-            )
-            series_4_value = calc_most_concurrent(
-                result_by_date.get(date_string, [])
-            )
-
-            series_1.append(series_1_value)
-            series_2.append(series_2_value)
-            series_3.append(series_3_value)
-            series_4.append(series_4_value)
+            series_1.append(peak_count((date_string, 'direct play')))
+            series_2.append(peak_count((date_string, 'copy')))
+            series_3.append(peak_count((date_string, 'transcode')))
+            series_4.append(peak_count(date_string))
 
         series_1_output = {'name': 'Direct Play',
                            'data': series_1}
@@ -1231,60 +949,28 @@ class Graphs(object):
 
     def get_stream_type_by_top_10_platforms(self, time_range='30', y_axis='plays', user_id=None, grouping=None):
         time_range = helpers.cast_to_int(time_range) or 30
-        timestamp = helpers.timestamp() - time_range * 24 * 60 * 60
-        user_filters = self._make_user_cond(user_id)
+        start_date = self._rollup_start_date(time_range)
+        user_filters = self._make_user_cond(user_id, column=SessionHistoryDaily.user_id)
 
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_key = self._group_key_expr(grouping)
-        duration_expr = self._duration_expr()
+        metric = self._rollup_metric(y_axis, grouping)
+        dp_count, ds_count, tc_count = self._stream_type_sums(metric)
+        total_metric = func.sum(metric).label('total_count' if y_axis == 'plays' else 'total_duration')
 
         try:
-            if y_axis == 'plays':
-                dp_count = func.count(distinct(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'direct play', group_key),
-                    else_=None,
-                )))
-                ds_count = func.count(distinct(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'copy', group_key),
-                    else_=None,
-                )))
-                tc_count = func.count(distinct(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'transcode', group_key),
-                    else_=None,
-                )))
-                total_metric = func.count(distinct(group_key)).label('total_count')
-                order_by = (total_metric.desc(),)
-            else:
-                dp_count = func.sum(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'direct play', duration_expr),
-                    else_=0,
-                ))
-                ds_count = func.sum(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'copy', duration_expr),
-                    else_=0,
-                ))
-                tc_count = func.sum(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'transcode', duration_expr),
-                    else_=0,
-                ))
-                total_metric = func.sum(duration_expr).label('total_duration')
-                order_by = (total_metric.desc(),)
-
             stmt = (
                 select(
-                    SessionHistory.platform,
+                    SessionHistoryDaily.platform,
                     dp_count.label('dp_count'),
                     ds_count.label('ds_count'),
                     tc_count.label('tc_count'),
                     total_metric,
                 )
-                .select_from(SessionHistory)
-                .join(SessionHistoryMediaInfo, SessionHistoryMediaInfo.id == SessionHistory.id)
-                .where(SessionHistory.stopped >= timestamp)
-                .group_by(SessionHistory.platform)
-                .order_by(*order_by)
+                .where(SessionHistoryDaily.date_played >= start_date)
+                .group_by(SessionHistoryDaily.platform)
+                .order_by(total_metric.desc())
                 .limit(10)
             )
             for cond in user_filters:
@@ -1322,51 +1008,21 @@ class Graphs(object):
 
     def get_stream_type_by_top_10_users(self, time_range='30', y_axis='plays', user_id=None, grouping=None):
         time_range = helpers.cast_to_int(time_range) or 30
-        timestamp = helpers.timestamp() - time_range * 24 * 60 * 60
-        user_filters = self._make_user_cond(user_id)
+        start_date = self._rollup_start_date(time_range)
+        user_filters = self._make_user_cond(user_id, column=SessionHistoryDaily.user_id)
 
         if grouping is None:
             grouping = plexpy.CONFIG.GROUP_HISTORY_TABLES
 
-        group_key = self._group_key_expr(grouping)
-        duration_expr = self._duration_expr()
+        metric = self._rollup_metric(y_axis, grouping)
+        dp_count, ds_count, tc_count = self._stream_type_sums(metric)
+        total_metric = func.sum(metric).label('total_count' if y_axis == 'plays' else 'total_duration')
         friendly_name_expr = case(
             (or_(User.friendly_name.is_(None), func.trim(User.friendly_name) == ''), User.username),
             else_=User.friendly_name,
         )
 
         try:
-            if y_axis == 'plays':
-                dp_count = func.count(distinct(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'direct play', group_key),
-                    else_=None,
-                )))
-                ds_count = func.count(distinct(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'copy', group_key),
-                    else_=None,
-                )))
-                tc_count = func.count(distinct(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'transcode', group_key),
-                    else_=None,
-                )))
-                total_metric = func.count(distinct(group_key)).label('total_count')
-                order_by = (total_metric.desc(),)
-            else:
-                dp_count = func.sum(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'direct play', duration_expr),
-                    else_=0,
-                ))
-                ds_count = func.sum(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'copy', duration_expr),
-                    else_=0,
-                ))
-                tc_count = func.sum(case(
-                    (SessionHistoryMediaInfo.transcode_decision == 'transcode', duration_expr),
-                    else_=0,
-                ))
-                total_metric = func.sum(duration_expr).label('total_duration')
-                order_by = (total_metric.desc(),)
-
             stmt = (
                 select(
                     User.user_id,
@@ -1377,12 +1033,11 @@ class Graphs(object):
                     tc_count.label('tc_count'),
                     total_metric,
                 )
-                .select_from(SessionHistory)
-                .join(SessionHistoryMediaInfo, SessionHistoryMediaInfo.id == SessionHistory.id)
-                .join(User, User.user_id == SessionHistory.user_id)
-                .where(SessionHistory.stopped >= timestamp)
+                .select_from(SessionHistoryDaily)
+                .join(User, User.user_id == SessionHistoryDaily.user_id)
+                .where(SessionHistoryDaily.date_played >= start_date)
                 .group_by(User.user_id, User.username, User.friendly_name)
-                .order_by(*order_by)
+                .order_by(total_metric.desc())
                 .limit(10)
             )
             for cond in user_filters:
@@ -1423,18 +1078,18 @@ class Graphs(object):
 
         return output
 
-    def _make_user_cond(self, user_id):
+    def _make_user_cond(self, user_id, column=SessionHistory.user_id):
         """
         Expects user_id to be a comma-separated list of ints.
-        Returns a list of SQLAlchemy filter expressions.
+        Returns a list of SQLAlchemy filter expressions on column.
         """
         user_filters = []
 
         session_user_id = session.get_session_user_id()
         if session_user_id and user_id and user_id != str(session_user_id):
-            user_filters.append(SessionHistory.user_id == helpers.cast_to_int(session_user_id))
+            user_filters.append(column == helpers.cast_to_int(session_user_id))
         elif user_id:
             user_ids = helpers.split_strip(user_id)
             if all(id.isdigit() for id in user_ids):
-                user_filters.append(SessionHistory.user_id.in_(list(map(helpers.cast_to_int, user_ids))))
+                user_filters.append(column.in_(list(map(helpers.cast_to_int, user_ids))))
         return user_filters
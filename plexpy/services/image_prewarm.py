@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Scheduled pre-warming of the image cache.
+
+Collects the images the home stats cards, the recently added dashboard row
+and self-hosted newsletter images request through ``pms_image_proxy``, with
+the same sizes and effects as the templates, and fetches the ones missing
+from the image cache with ``IMAGE_PREWARM_THREADS`` concurrent requests.
+Fetches go through ``image_cache.fetch``, so a page requesting an image that
+is being pre-warmed waits for it instead of requesting it again.
+"""
+
+from multiprocessing.dummy import Pool as ThreadPool
+import os
+
+import plexpy
+from plexpy.db import datafactory
+from plexpy.integrations import image_cache
+from plexpy.integrations import pmsconnect
+from plexpy.services import newsletters
+from plexpy.services import notification_handler
+from plexpy.util import helpers
+from plexpy.util import logger
+
+
+# Number of recently added items shown on the home page
+RECENTLY_ADDED_COUNT = 50
+# Home stats cards that show item posters and art
+MEDIA_STATS = ('top_movies', 'popular_movies', 'top_tv', 'popular_tv', 'top_music', 'popular_music', 'last_watched')
+
+
+def _image(img=None, rating_key=None, width=750, height=1000, opacity=100, background='000000', blur=0,
+           fallback=None):
+    return (img or None, str(rating_key) if rating_key else None, width, height, opacity, background, blur, fallback)
+
+
+def home_stats_images():
+    """Images of the home stats cards, as rendered by home_stats.html."""
+    images = []
+
+    data_factory = datafactory.DataFactory()
+    for stat in data_factory.get_home_stats() or []:
+        if not stat['rows']:
+            continue
+        stat_id = stat['stat_id']
+        row = stat['rows'][0]
+
+        if stat_id in MEDIA_STATS:
+            images.append(_image(row.get('art'), row.get('rating_key'), 500, 280, 40, '282828', 3,
+                                 fallback='art-live' if row.get('live') else 'art'))
+            if stat_id in ('top_music', 'popular_music'):
+                images.append(_image(row.get('thumb'), row.get('rating_key'), 300, 300, 60, '282828', 3,
+                                     fallback='cover'))
+                height, fallback = 300, 'cover'
+            elif row.get('live'):
+                height, fallback = 450, 'poster-live'
+            else:
+                height, fallback = 450, 'poster'
+            images.append(_image(row.get('thumb'), row.get('grandparent_rating_key') or row.get('rating_key'),
+                                 300, height, fallback=fallback))
+
+        elif stat_id == 'top_libraries':
+            images.append(_image(row.get('art') or row.get('library_art'), None, 500, 280, 40, '282828', 3,
+                                 fallback='art-live' if row.get('live') else row.get('library_art')))
+            if (row.get('library_thumb') or '').startswith('http'):
+                images.append(_image(row.get('library_thumb'), None, 100, 100, fallback='cover'))
+
+    return images
+
+
+def recently_added_images(recently_added):
+    """Posters of the recently added row, as rendered by recently_added.html."""
+    images = []
+
+    for item in recently_added:
+        media_type = item['media_type']
+        if media_type in ('movie', 'show'):
+            images.append(_image(item['thumb'], item['rating_key'], 300, 450, fallback='poster'))
+        elif media_type == 'season':
+            if item['thumb']:
+                images.append(_image(item['thumb'], item['rating_key'], 300, 450, fallback='poster'))
+            else:
+                images.append(_image(item['parent_thumb'], item['parent_rating_key'], 300, 450, fallback='poster'))
+        elif media_type == 'episode':
+            images.append(_image(item['grandparent_thumb'], item['grandparent_rating_key'], 300, 450,
+                                 fallback='poster'))
+        elif media_type == 'album':
+            images.append(_image(item['thumb'], item['rating_key'], 300, 300, fallback='cover'))
+
+    return images
+
+
+def newsletter_images(recently_added):
+    """
+    Self-hosted newsletter images of the recently added items, as hashed by
+    the recently added newsletter. Episodes and seasons are listed by show.
+    """
+    images = []
+
+    for item in recently_added:
+        media_type = item['media_type']
+        if media_type in ('movie', 'show', 'album'):
+            thumb, art = item['thumb'], item['art']
+        elif media_type == 'season':
+            thumb, art = item['parent_thumb'], item['art']
+        elif media_type == 'episode':
+            thumb, art = item['grandparent_thumb'], item['art']
+        else:
+            continue
+
+        if media_type == 'album':
+            images.append(_image(thumb, None, 150, 150, fallback='cover'))
+        else:
+            images.append(_image(thumb, None, 150, 225, fallback='poster'))
+        if art:
+            images.append(_image(art, None, 500, 280, 25, '282828', 3, fallback='art'))
+
+    return images
+
+
+def warm_image(image):
+    """Fetch the image into the image cache if it is missing. Returns True if it was fetched."""
+    img, rating_key, width, height, opacity, background, blur, fallback = image
+
+    if not img and not rating_key:
+        return False
+    if img and img.startswith('interfaces/default/images'):
+        return False
+
+    img, rating_key = image_cache.normalize_image(img=img, rating_key=rating_key, fallback=fallback)
+    if 'indexes' in img:
+        return False
+
+    img_hash = notification_handler.set_hash_image_info(
+        img=img, rating_key=rating_key, width=width, height=height,
+        opacity=opacity, background=background, blur=blur, fallback=fallback,
+        add_to_db=False)
+    path = image_cache.cache_path(img_hash, 'png')
+    if os.path.isfile(path):
+        return False
+
+    def get_image():
+        pms_connect = pmsconnect.PmsConnect()
+        pms_connect.request_handler._silent = True
+        return pms_connect.get_image(img=img,
+                                     width=width,
+                                     height=height,
+                                     opacity=opacity,
+                                     background=background,
+                                     blur=blur,
+                                     img_format='png')
+
+    try:
+        result = image_cache.fetch(path, get_image)
+    except Exception as e:
+        logger.debug("Tautulli ImagePrewarm :: Failed to pre-warm image %s: %s" % (img, e))
+        return False
+
+    return bool(result and result[0])
+
+
+def prewarm_images():
+    if not plexpy.CONFIG.CACHE_IMAGES:
+        return
+
+    images = []
+
+    try:
+        images.extend(home_stats_images())
+    except Exception as e:
+        logger.warn("Tautulli ImagePrewarm :: Unable to get home stats images: %s." % e)
+
+    try:
+        pms_connect = pmsconnect.PmsConnect()
+        result = pms_connect.get_recently_added_details(count=str(RECENTLY_ADDED_COUNT))
+        recently_added = result['recently_added'] if result else []
+    except Exception as e:
+        logger.warn("Tautulli ImagePrewarm :: Unable to get recently added images: %s." % e)
+        recently_added = []
+
+    images.extend(recently_added_images(recently_added))
+
+    if helpers.get_img_service(include_self=True) == 'self-hosted' and \
+            any(n['active'] for n in newsletters.get_newsletters()):
+        images.extend(newsletter_images(recently_added))
+
+    # Keep the first occurrence of every image
+    images = list(dict.fromkeys(images))
+    if not images:
+        return
+
+    logger.debug("Tautulli ImagePrewarm :: Pre-warming %s images." % len(images))
+
+    pool = ThreadPool(processes=max(1, plexpy.CONFIG.IMAGE_PREWARM_THREADS))
+    try:
+        fetched = sum(pool.map(warm_image, images))
+    finally:
+        pool.close()
+        pool.join()
+
+    if fetched:
+        logger.info("Tautulli ImagePrewarm :: Pre-warmed %s of %s images in the image cache." % (fetched, len(images)))
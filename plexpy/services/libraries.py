@@ -48,46 +48,33 @@ def refresh_libraries():
     library_sections = pmsconnect.PmsConnect().get_library_details()
 
     if library_sections:
-        library_keys = []
-        new_keys = []
-
         # Keep track of section_id to update is_active status
         section_ids = [common.LIVE_TV_SECTION_ID]  # Live TV library always considered active
+        section_keys = {}
+        rows = []
 
-        with session_scope() as db_session:
-            for section in library_sections:
-                section_id = helpers.cast_to_int(section['section_id'])
-                section_ids.append(section_id)
-
-                section_values = {'server_id': server_id,
-                                  'section_id': section_id,
-                                  'section_name': section['section_name'],
-                                  'section_type': section['section_type'],
-                                  'agent': section['agent'],
-                                  'thumb': section['thumb'],
-                                  'art': section['art'],
-                                  'count': section['count'],
-                                  'parent_count': section.get('parent_count', None),
-                                  'child_count': section.get('child_count', None),
-                                  'is_active': section['is_active']
-                                  }
+        for section in library_sections:
+            section_id = helpers.cast_to_int(section['section_id'])
+            section_ids.append(section_id)
+            section_keys[section_id] = section['section_id']
+
+            rows.append({'server_id': server_id,
+                         'section_id': section_id,
+                         'section_name': section['section_name'],
+                         'section_type': section['section_type'],
+                         'agent': section['agent'],
+                         'thumb': section['thumb'],
+                         'art': section['art'],
+                         'count': section['count'],
+                         'parent_count': section.get('parent_count', None),
+                         'child_count': section.get('child_count', None),
+                         'is_active': section['is_active']
+                         })
 
-                stmt = (
-                    update(LibrarySection)
-                    .where(
-                        LibrarySection.server_id == server_id,
-                        LibrarySection.section_id == section_id,
-                    )
-                    .values(**section_values)
-                )
-                update_result = db_session.execute(stmt)
-                if not update_result.rowcount or update_result.rowcount == 0:
-                    stmt = insert(LibrarySection).values(**section_values).returning(LibrarySection.id)
-                    inserted_id = db_session.execute(stmt).scalar_one_or_none()
-                    if inserted_id is not None:
-                        new_keys.append(section['section_id'])
-
-                library_keys.append(section['section_id'])
+        with session_scope() as db_session:
+            upserted = queries.upsert_many(db_session, LibrarySection.__table__, rows, ['server_id', 'section_id'],
+                                           returning=['section_id'])
+            new_keys = [section_keys[row['section_id']] for row in upserted if row['inserted']]
 
         add_live_tv_library(refresh=True)
 
@@ -142,17 +129,7 @@ def add_live_tv_library(refresh=False):
                           'is_active': 1
                           }
 
-        stmt = (
-            update(LibrarySection)
-            .where(
-                LibrarySection.server_id == plexpy.CONFIG.PMS_IDENTIFIER,
-                LibrarySection.section_id == common.LIVE_TV_SECTION_ID,
-            )
-            .values(**section_values)
-        )
-        update_result = db_session.execute(stmt)
-        if not update_result.rowcount or update_result.rowcount == 0:
-            db_session.execute(insert(LibrarySection).values(**section_values))
+        queries.upsert_many(db_session, LibrarySection.__table__, [section_values], ['server_id', 'section_id'])
 
 
 def has_library_type(section_type):
@@ -441,7 +418,7 @@ class Libraries(object):
 
         try:
             with session_scope() as db_session:
-                result = queries.fetch_mappings(db_session, stmt)
+                results = queries.fetch_datatable_rows(db_session, stmt, json_data, default_sort='section_name')
                 total_count = queries.fetch_scalar(
                     db_session,
                     select(func.count(LibrarySection.id)),
@@ -452,7 +429,7 @@ class Libraries(object):
             return default_return
 
         rows = []
-        for item in result:
+        for item in results['results']:
             if item['media_type'] == 'episode' and item['parent_thumb']:
                 thumb = item['parent_thumb']
             elif item['media_type'] == 'episode':
@@ -507,11 +484,9 @@ class Libraries(object):
 
             rows.append(row)
 
-        results = helpers.process_datatable_rows(rows, json_data, default_sort='section_name')
-
         data = {'recordsFiltered': results['filtered_count'],
                 'recordsTotal': total_count,
-                'data': session.mask_session_info(results['results']),
+                'data': session.mask_session_info(rows),
                 'draw': int(json_data.get('draw', 0))
                 }
 
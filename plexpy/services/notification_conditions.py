@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compiled custom notification conditions.
+
+``compile_conditions`` turns the custom conditions and condition logic of a
+notifier into a predicate over the notification parameters. The logic string
+is parsed and the condition values are cast once, so evaluating the predicate
+only casts the parameter values and compares them.
+
+Predicates are cached per notifier ID. ``notifiers.set_notifier_config`` and
+``notifiers.delete_notifier`` call ``invalidate`` for the notifier. The cache
+isn't used with the durable notification queue, since a notifier can be
+edited by another process sharing the queue.
+"""
+
+import threading
+
+from plexpy.util import helpers
+from plexpy.util import logger
+
+
+# Looked up on call, helpers is still initializing when this module is imported
+CASTS = {
+    'str': lambda v: str(v).strip().lower(),
+    'int': lambda v: helpers.cast_to_int(v),
+    'float': lambda v: helpers.cast_to_float(v),
+}
+
+OPERATORS = {
+    'contains': lambda p, values: any(c in p for c in values),
+    'does not contain': lambda p, values: all(c not in p for c in values),
+    'is': lambda p, values: any(p == c for c in values),
+    'is not': lambda p, values: all(p != c for c in values),
+    'begins with': lambda p, values: p.startswith(values),
+    'does not begin with': lambda p, values: not p.startswith(values),
+    'ends with': lambda p, values: p.endswith(values),
+    'does not end with': lambda p, values: not p.endswith(values),
+    'is greater than': lambda p, values: any(p > c for c in values),
+    'is less than': lambda p, values: any(p < c for c in values),
+}
+
+_LOCK = threading.Lock()
+_PREDICATES = {}
+_GENERATION = [0]
+
+
+def _always(result):
+    def predicate(parameters):
+        return result
+    return predicate
+
+
+def compile_conditions(custom_conditions, custom_conditions_logic=''):
+    """
+    Return a function evaluating the custom conditions against a parameters
+    dict. Conditions that can't be compiled evaluate to False.
+    """
+    custom_conditions = custom_conditions or []
+
+    if not (custom_conditions_logic or any(c for c in custom_conditions if c['value'])):
+        return _always(True)
+
+    logic_groups = None
+    if custom_conditions_logic:
+        try:
+            # Parse and validate the custom conditions logic
+            logic_groups = helpers.parse_condition_logic_string(custom_conditions_logic, len(custom_conditions))
+        except ValueError as e:
+            logger.error("Tautulli NotificationConditions :: Unable to parse custom condition logic '%s': %s."
+                         % (custom_conditions_logic, e))
+            return _always(False)
+
+    # (parameter, cast, operator, values) for each condition, None for blank conditions
+    compiled = []
+
+    for i, condition in enumerate(custom_conditions):
+        parameter = condition['parameter']
+        operator = condition['operator']
+        values = condition['value']
+        parameter_type = condition['type']
+
+        # Set blank conditions to True (skip)
+        if not parameter or not operator or not values:
+            compiled.append(None)
+            continue
+
+        # Make sure the condition values is in a list
+        if not isinstance(values, list):
+            values = [values]
+
+        cast = CASTS.get(parameter_type)
+        if cast is None:
+            logger.error("Tautulli NotificationConditions :: {%s} Unable to cast condition '%s', values '%s', to type '%s'."
+                         % (i+1, parameter, values, parameter_type))
+            return _always(False)
+
+        # Cast the condition values to the correct type
+        if parameter_type == 'str':
+            values = tuple('' if v == '~' else cast(v) for v in values)
+        else:
+            values = tuple(cast(v) for v in values)
+
+        operator_func = OPERATORS.get(operator)
+        if operator_func is None:
+            logger.warn("Tautulli NotificationConditions :: {%s} Invalid condition operator '%s' > None."
+                        % (i+1, operator))
+
+        compiled.append((parameter, cast, operator_func, values))
+
+    def predicate(parameters):
+        evaluated_conditions = [None]  # Set condition {0} to None
+
+        for condition in compiled:
+            if condition is None:
+                evaluated_conditions.append(True)
+                continue
+
+            parameter, cast, operator_func, values = condition
+            if operator_func is None:
+                evaluated_conditions.append(None)
+            else:
+                evaluated_conditions.append(operator_func(cast(parameters.get(parameter, "")), values))
+
+        if logic_groups:
+            # Evaluate the parsed logic
+            try:
+                evaluated_logic = helpers.eval_logic_groups_to_bool(logic_groups, evaluated_conditions)
+            except Exception as e:
+                logger.error("Tautulli NotificationConditions :: Unable to evaluate custom condition logic: %s." % e)
+                return False
+        else:
+            evaluated_logic = all(evaluated_conditions[1:])
+
+        logger.debug("Tautulli NotificationConditions :: Custom conditions evaluated to '%s'. Conditions: %s."
+                     % (evaluated_logic, evaluated_conditions[1:]))
+        return evaluated_logic
+
+    return predicate
+
+
+def generation():
+    """Return the cache generation, pass it to ``cache`` with a predicate compiled after it."""
+    with _LOCK:
+        return _GENERATION[0]
+
+
+def get_predicate(notifier_id):
+    """Return the cached predicate of the notifier, or None."""
+    with _LOCK:
+        return _PREDICATES.get(notifier_id)
+
+
+def cache(notifier_id, predicate, generation):
+    """Cache the predicate unless the cache was invalidated since generation."""
+    with _LOCK:
+        if _GENERATION[0] == generation:
+            _PREDICATES[notifier_id] = predicate
+
+
+def invalidate(notifier_id=None):
+    """Drop the cached predicate of the notifier, or all predicates."""
+    with _LOCK:
+        _GENERATION[0] += 1
+        if notifier_id is None:
+            _PREDICATES.clear()
+        else:
+            _PREDICATES.pop(notifier_id, None)
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-agent delivery pools for notifications.
+
+Queued notifications are handed to a pool of ``NOTIFICATION_AGENT_THREADS``
+workers for their notification agent, so a slow SMTP server or webhook only
+delays the notifications of that agent. Each pool has a bounded queue
+(``NOTIFICATION_AGENT_QUEUE_SIZE``, submitting blocks when it is full), a
+pooled ``requests.Session`` used by ``Notifier.make_request`` and a token
+bucket allowing ``NOTIFICATION_AGENT_RATE_LIMIT`` sends per minute. A 429
+response pauses the bucket for the ``Retry-After`` time. On a pool worker the
+request is retried once if that is at most ``MAX_RETRY_AFTER`` seconds;
+synchronous sends (API and test notifications) fail instead of blocking the
+web request. The durable notification queue waits for the result of its
+sends with ``call``, so they go through the pool and its rate limit too.
+
+``get_stats`` returns the queue depth, in-flight, sent, failed and rate
+limited counts, the time spent queued and the send latency of every agent.
+"""
+
+from http.cookiejar import DefaultCookiePolicy
+import queue
+import threading
+import time
+
+import requests
+
+import plexpy
+from plexpy.util import helpers
+from plexpy.util import logger
+
+
+# Burst size of the token buckets
+RATE_LIMIT_BURST = 5
+# Pause used for a 429 response without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 5
+# Longest Retry-After a send waits for before retrying once
+MAX_RETRY_AFTER = 60
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+# Marks the worker threads of the pools
+_LOCAL = threading.local()
+
+
+class TokenBucket(object):
+    """Token bucket with ``rate`` tokens per second, which can be paused after a 429."""
+
+    def __init__(self, rate, burst=RATE_LIMIT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.rate > 0:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.paused_until > now:
+                    wait = self.paused_until - now
+                elif self.rate <= 0:
+                    return
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class AgentPool(object):
+    def __init__(self, name, num_threads=1, queue_size=100, rate_per_minute=0):
+        self.name = name
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.bucket = TokenBucket(rate_per_minute / 60.0)
+        self.session = requests.Session()
+        # The session is shared by all notifiers of the agent, don't keep cookies between them
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.stats_lock = threading.Lock()
+        self.stats = {'in_flight': 0, 'sent': 0, 'failed': 0, 'rate_limited': 0,
+                      'wait_total': 0.0, 'wait_max': 0.0, 'latency_total': 0.0, 'latency_max': 0.0}
+        self.threads = []
+        self.stopped = threading.Event()
+
+        for x in range(max(1, num_threads)):
+            thread = threading.Thread(target=self.process_queue, name='notify-%s-%s' % (name, x))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, func, callback=None):
+        """Queue func, waiting for a free slot. Returns False if the pool was stopped first."""
+        if self.stopped.is_set():
+            return False
+
+        try:
+            self.queue.put_nowait((func, callback, time.monotonic()))
+            return True
+        except queue.Full:
+            logger.warn("Tautulli NotificationDelivery :: %s delivery queue is full. Waiting for a free slot."
+                        % self.name)
+
+        while not self.stopped.is_set():
+            try:
+                self.queue.put((func, callback, time.monotonic()), timeout=1)
+                return True
+            except queue.Full:
+                pass
+
+        logger.warn("Tautulli NotificationDelivery :: %s delivery pool stopped, notification not sent." % self.name)
+        return False
+
+    def process_queue(self):
+        _LOCAL.worker = True
+        while not self.stopped.is_set():
+            task = self.queue.get()
+            if task is None:
+                self.queue.task_done()
+                break
+
+            func, callback, queued_at = task
+            self.bucket.acquire()
+
+            if self.stopped.is_set():
+                self._callback(callback, None)
+                self.queue.task_done()
+                break
+
+            start = time.monotonic()
+            with self.stats_lock:
+                self.stats['in_flight'] += 1
+                self.stats['wait_total'] += start - queued_at
+                self.stats['wait_max'] = max(self.stats['wait_max'], start - queued_at)
+
+            try:
+                result = func()
+            except Exception as e:
+                logger.exception("Tautulli NotificationDelivery :: %s delivery exception: %s" % (self.name, e))
+                result = None
+
+            latency = time.monotonic() - start
+            with self.stats_lock:
+                self.stats['in_flight'] -= 1
+                self.stats['sent' if result else 'failed'] += 1
+                self.stats['latency_total'] += latency
+                self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+
+            self._callback(callback, result)
+            self.queue.task_done()
+
+    def _callback(self, callback, result):
+        if callback:
+            try:
+                callback(result)
+            except Exception as e:
+                logger.exception("Tautulli NotificationDelivery :: %s delivery callback exception: %s"
+                                 % (self.name, e))
+
+    def rate_limited(self, retry_after):
+        with self.stats_lock:
+            self.stats['rate_limited'] += 1
+        self.bucket.pause(retry_after)
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        completed = stats['sent'] + stats['failed']
+        stats['queued'] = self.queue.qsize()
+        stats['wait_avg'] = stats['wait_total'] / completed if completed else 0.0
+        stats['latency_avg'] = stats['latency_total'] / completed if completed else 0.0
+        return stats
+
+    def stop(self):
+        # Don't block on a full queue, the workers exit after the notification they are sending
+        # and the notifications still queued are reported as not sent
+        self.stopped.set()
+        while True:
+            try:
+                task = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None:
+                self._callback(task[1], None)
+            self.queue.task_done()
+
+        for thread in self.threads:
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                break
+        self.session.close()
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+
+def get_pool(name):
+    with _POOLS_LOCK:
+        pool = _POOLS.get(name)
+        if pool is None:
+            pool = _POOLS[name] = AgentPool(name,
+                                            num_threads=plexpy.CONFIG.NOTIFICATION_AGENT_THREADS,
+                                            queue_size=plexpy.CONFIG.NOTIFICATION_AGENT_QUEUE_SIZE,
+                                            rate_per_minute=plexpy.CONFIG.NOTIFICATION_AGENT_RATE_LIMIT)
+        return pool
+
+
+def submit(name, func, callback=None):
+    """Run func on the delivery pool of the agent and call callback with its result."""
+    return get_pool(name).submit(func, callback=callback)
+
+
+def call(name, func):
+    """
+    Run func on the delivery pool of the agent and wait for its result. Returns
+    None if func raised or the pool was stopped before it ran.
+    """
+    if in_worker():
+        return func()
+
+    pool = get_pool(name)
+    done = threading.Event()
+    result = []
+
+    def callback(value):
+        result.append(value)
+        done.set()
+
+    if not pool.submit(func, callback=callback):
+        return None
+
+    while not done.wait(1):
+        if pool.stopped.is_set() and not pool.is_alive():
+            return None
+
+    return result[0]
+
+
+def get_session(name):
+    """
+    Return the pooled HTTP session of the agent. It is shared by the notifiers
+    of the agent, so it doesn't store cookies and auth must be passed per request.
+    """
+    return get_pool(name).session
+
+
+def in_worker():
+    """Return True if called from a delivery pool worker, which may wait for a rate limit to pass."""
+    return getattr(_LOCAL, 'worker', False)
+
+
+def parse_retry_after(value):
+    """Return the seconds to wait from a Retry-After header (seconds or HTTP date)."""
+    if value is None:
+        return DEFAULT_RETRY_AFTER
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0, int(parsedate_to_datetime(value).timestamp() - helpers.timestamp()))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def rate_limited(name, retry_after=None):
+    """Pause the agent after a 429 response. Returns the seconds to wait."""
+    seconds = parse_retry_after(retry_after)
+    get_pool(name).rate_limited(seconds)
+    return seconds
+
+
+def get_stats():
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    return {pool.name: pool.get_stats() for pool in pools}
+
+
+def stop():
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.stop()
@@ -16,7 +16,7 @@
 #  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
 
 import bleach
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict
 from functools import partial
 import hashlib
 from itertools import groupby
@@ -45,11 +45,21 @@ from plexpy.db.models import Notifier as NotifierModel
 from plexpy.db.models import TheMovieDbLookup, TvmazeLookup
 from plexpy.db.session import session_scope
 from plexpy.services import activity_processor
+from plexpy.services import notification_conditions
+from plexpy.services import notification_queue
 from plexpy.services.newsletter_handler import notify as notify_newsletter
 from plexpy.util import helpers
 from plexpy.util import logger
 
 
+# Notify states of active sessions, by session key and (rating_key, user_id)
+NOTIFY_STATE_MAX_SESSIONS = 1000
+_NOTIFY_STATES = OrderedDict()
+_NOTIFY_STATES_LOCK = threading.Lock()
+# Bumped by every notify_log write, a read started before a write is not cached
+_NOTIFY_STATES_GENERATION = [0]
+
+
 def _update_or_insert(db_session, model, key_values=None, values=None, returning_id=False):
     values = values or {}
     cleaned_keys = {key: value for key, value in (key_values or {}).items() if value is not None}
@@ -57,6 +67,14 @@ def _update_or_insert(db_session, model, key_values=None, values=None, returning
     if not insert_values:
         return None
 
+    table = model.__table__
+    if cleaned_keys and queries.has_unique_key(table, cleaned_keys):
+        rows = queries.upsert_many(db_session, table, [insert_values], list(cleaned_keys),
+                                   update_columns=list(values), returning=['id'])
+        if returning_id and rows and rows[0]['inserted']:
+            return rows[0]['id']
+        return None
+
     if cleaned_keys:
         conditions = [getattr(model, key) == value for key, value in cleaned_keys.items()]
         stmt = update(model).where(*conditions).values(**values)
@@ -95,12 +113,7 @@ def process_queue():
             break
         elif params:
             try:
-                if 'newsletter' in params:
-                    notify_newsletter(**params)
-                elif 'notification' in params:
-                    notify(**params)
-                else:
-                    add_notifier_each(**params)
+                process_item(params, asynchronous=True)
             except Exception as e:
                 logger.exception("Tautulli NotificationHandler :: Notification thread exception: %s" % e)
 
@@ -109,6 +122,20 @@ def process_queue():
     logger.info("Tautulli NotificationHandler :: Notification thread exiting...")
 
 
+def process_item(params, asynchronous=False, pooled=False, state=None):
+    """
+    Handle one notification queue item. Returns the notification id for sent
+    notifications, or None if the notification was handed to the delivery pool
+    of the agent with asynchronous. See ``notify`` for pooled and state.
+    """
+    if 'newsletter' in params:
+        return notify_newsletter(**params)
+    elif 'notification' in params:
+        return notify(asynchronous=asynchronous, pooled=pooled, state=state, **params)
+    else:
+        return add_notifier_each(**params)
+
+
 def start_threads(num_threads=1):
     logger.info("Tautulli NotificationHandler :: Starting background notification handler ({} threads).".format(num_threads))
     for x in range(num_threads):
@@ -116,6 +143,9 @@ def start_threads(num_threads=1):
         thread.daemon = True
         thread.start()
 
+    if plexpy.CONFIG.NOTIFICATION_QUEUE_DURABLE:
+        notification_queue.start_threads(num_threads=num_threads)
+
 
 def add_notifier_each(notifier_id=None, notify_action=None, stream_data=None, timeline_data=None, manual_trigger=False, **kwargs):
     if not notify_action:
@@ -286,150 +316,45 @@ def notify_conditions(notify_action=None, stream_data=None, timeline_data=None,
 
 
 def notify_custom_conditions(notifier_id=None, parameters=None):
-    notifier_config = notifiers.get_notifier_config(notifier_id=notifier_id)
-
-    custom_conditions_logic = notifier_config['custom_conditions_logic']
-    custom_conditions = notifier_config['custom_conditions']
-
-    if custom_conditions_logic or any(c for c in custom_conditions if c['value']):
-        logger.debug("Tautulli NotificationHandler :: Checking custom notification conditions for notifier_id %s."
-                     % notifier_id)
-
-        logic_groups = None
-        if custom_conditions_logic:
-            try:
-                # Parse and validate the custom conditions logic
-                logic_groups = helpers.parse_condition_logic_string(custom_conditions_logic, len(custom_conditions))
-            except ValueError as e:
-                logger.error("Tautulli NotificationHandler :: Unable to parse custom condition logic '%s': %s."
-                             % (custom_conditions_logic, e))
-                return False
-
-        evaluated_conditions = [None]  # Set condition {0} to None
-
-        for i, condition in enumerate(custom_conditions):
-            parameter = condition['parameter']
-            operator = condition['operator']
-            values = condition['value']
-            parameter_type = condition['type']
-            parameter_value = parameters.get(parameter, "")
-
-            # Set blank conditions to True (skip)
-            if not parameter or not operator or not values:
-                evaluated = True
-                evaluated_conditions.append(evaluated)
-                logger.debug("Tautulli NotificationHandler :: {%s} Blank condition > %s" % (i+1, evaluated))
-                continue
-
-            # Make sure the condition values is in a list
-            if not isinstance(values, list):
-                values = [values]
-
-            # Cast the condition values to the correct type
-            try:
-                if parameter_type == 'str':
-                    values = ['' if v == '~' else str(v).strip().lower() for v in values]
-
-                elif parameter_type == 'int':
-                    values = [helpers.cast_to_int(v) for v in values]
-
-                elif parameter_type == 'float':
-                    values = [helpers.cast_to_float(v) for v in values]
-
-                else:
-                    raise ValueError
-
-            except ValueError as e:
-                logger.error("Tautulli NotificationHandler :: {%s} Unable to cast condition '%s', values '%s', to type '%s'."
-                             % (i+1, parameter, values, parameter_type))
-                return False
-
-            # Cast the parameter value to the correct type
-            try:
-                if parameter_type == 'str':
-                    parameter_value = str(parameter_value).strip().lower()
-
-                elif parameter_type == 'int':
-                    parameter_value = helpers.cast_to_int(parameter_value)
-
-                elif parameter_type == 'float':
-                    parameter_value = helpers.cast_to_float(parameter_value)
-
-                else:
-                    raise ValueError
-
-            except ValueError as e:
-                logger.error("Tautulli NotificationHandler :: {%s} Unable to cast parameter '%s', value '%s', to type '%s'."
-                             % (i+1, parameter, parameter_value, parameter_type))
-                return False
-
-            # Check each condition
-            if operator == 'contains':
-                evaluated = any(c in parameter_value for c in values)
-
-            elif operator == 'does not contain':
-                evaluated = all(c not in parameter_value for c in values)
-
-            elif operator == 'is':
-                evaluated = any(parameter_value == c for c in values)
-
-            elif operator == 'is not':
-                evaluated = all(parameter_value != c for c in values)
-
-            elif operator == 'begins with':
-                evaluated = parameter_value.startswith(tuple(values))
-
-            elif operator == 'does not begin with':
-                evaluated = not parameter_value.startswith(tuple(values))
-
-            elif operator == 'ends with':
-                evaluated = parameter_value.endswith(tuple(values))
-
-            elif operator == 'does not end with':
-                evaluated = not parameter_value.endswith(tuple(values))
-
-            elif operator == 'is greater than':
-                evaluated = any(parameter_value > c for c in values)
-
-            elif operator == 'is less than':
-                evaluated = any(parameter_value < c for c in values)
-
-            else:
-                evaluated = None
-                logger.warn("Tautulli NotificationHandler :: {%s} Invalid condition operator '%s' > %s."
-                            % (i+1, operator, evaluated))
-
-            evaluated_conditions.append(evaluated)
-            logger.debug("Tautulli NotificationHandler :: {%s} %s | %s | %s > '%s' > %s"
-                         % (i+1, parameter, operator, ' or '.join(["'%s'" % v for v in values]), parameter_value, evaluated))
-
-        if logic_groups:
-            # Format and evaluate the logic string
-            try:
-                evaluated_logic = helpers.eval_logic_groups_to_bool(logic_groups, evaluated_conditions)
-                logger.debug("Tautulli NotificationHandler :: Condition logic: %s > %s"
-                             % (custom_conditions_logic, evaluated_logic))
-            except Exception as e:
-                logger.error("Tautulli NotificationHandler :: Unable to evaluate custom condition logic: %s." % e)
-                return False
-        else:
-            evaluated_logic = all(evaluated_conditions[1:])
-            logger.debug("Tautulli NotificationHandler :: Condition logic [blank]: %s > %s"
-                         % (' and '.join(['{%s}' % (i+1) for i in range(len(custom_conditions))]), evaluated_logic))
-
-        logger.debug("Tautulli NotificationHandler :: Custom conditions evaluated to '{}'. Conditions: {}.".format(
-            evaluated_logic, evaluated_conditions[1:]))
-
-        return evaluated_logic
-
-    return True
-
-
-def notify(notifier_id=None, notify_action=None, stream_data=None, timeline_data=None, parameters=None, **kwargs):
+    notifier_id = helpers.cast_to_int(notifier_id)
+    # Notifiers edited in other processes sharing the durable queue can't invalidate the cache
+    use_cache = not notification_queue.enabled()
+    predicate = notification_conditions.get_predicate(notifier_id) if use_cache else None
+
+    if predicate is None:
+        generation = notification_conditions.generation()
+        notifier_config = notifiers.get_notifier_config(notifier_id=notifier_id)
+        if not notifier_config:
+            return False
+
+        predicate = notification_conditions.compile_conditions(notifier_config['custom_conditions'],
+                                                               notifier_config['custom_conditions_logic'])
+        if use_cache:
+            notification_conditions.cache(notifier_id, predicate, generation)
+
+    logger.debug("Tautulli NotificationHandler :: Checking custom notification conditions for notifier_id %s."
+                 % notifier_id)
+    return predicate(parameters or {})
+
+
+def notify(notifier_id=None, notify_action=None, stream_data=None, timeline_data=None, parameters=None,
+           asynchronous=False, pooled=False, notification_id=None, state=None, **kwargs):
+    """
+    Send the notification. A notification_id from a previous attempt is reused
+    instead of logging the notification again. The state dict, if given, is
+    filled with the 'notification_id' and whether the 'notifier_exists'.
+
+    With asynchronous the notification is handed to the delivery pool of the
+    agent, with pooled it is sent on the delivery pool and the result is waited
+    for. Otherwise it is sent on the calling thread.
+    """
     logger.info("Tautulli NotificationHandler :: Preparing notification for notifier_id %s." % notifier_id)
 
     notifier_config = notifiers.get_notifier_config(notifier_id=notifier_id)
 
+    if state is not None:
+        state['notifier_exists'] = bool(notifier_config)
+
     if not notifier_config:
         return
 
@@ -452,13 +377,21 @@ def notify(notifier_id=None, notify_action=None, stream_data=None, timeline_data
                                                        as_json=notifier_config['config'].get('as_json', False))
 
     # Set the notification state in the db
-    notification_id = set_notify_state(session=stream_data or timeline_data,
-                                       notifier=notifier_config,
-                                       notify_action=notify_action,
-                                       subject=subject,
-                                       body=body,
-                                       script_args=script_args,
-                                       parameters=parameters)
+    if not notification_id:
+        notification_id = set_notify_state(session=stream_data or timeline_data,
+                                           notifier=notifier_config,
+                                           notify_action=notify_action,
+                                           subject=subject,
+                                           body=body,
+                                           script_args=script_args,
+                                           parameters=parameters)
+
+    if state is not None:
+        state['notification_id'] = notification_id
+
+    def sent(success):
+        if success:
+            set_notify_success(notification_id)
 
     # Send the notification
     success = notifiers.send_notification(notifier_id=notifier_config['id'],
@@ -468,6 +401,8 @@ def notify(notifier_id=None, notify_action=None, stream_data=None, timeline_data
                                           notify_action=notify_action,
                                           notification_id=notification_id,
                                           parameters=parameters or {},
+                                          callback=sent if asynchronous else None,
+                                          pooled=pooled,
                                           **kwargs)
 
     if success:
@@ -479,6 +414,13 @@ def get_notify_state(session):
     session_key = helpers.cast_to_int(session.get('session_key'))
     rating_key = helpers.cast_to_int(session.get('rating_key'))
     user_id = helpers.cast_to_int(session.get('user_id'))
+
+    with _NOTIFY_STATES_LOCK:
+        states = _NOTIFY_STATES.get(session_key, {}).get((rating_key, user_id))
+        if states is not None:
+            return [dict(state) for state in states]
+        generation = _NOTIFY_STATES_GENERATION[0]
+
     with session_scope() as db_session:
         stmt = (
             select(
@@ -494,9 +436,35 @@ def get_notify_state(session):
             .order_by(NotifyLogModel.id.desc())
         )
         result = queries.fetch_mappings(db_session, stmt)
+
+    # Durable queue workers in other processes write notify_log rows this cache doesn't see
+    if notification_queue.enabled():
+        return result
+
+    with _NOTIFY_STATES_LOCK:
+        if _NOTIFY_STATES_GENERATION[0] != generation:
+            return result
+        _NOTIFY_STATES.setdefault(session_key, {})[(rating_key, user_id)] = [dict(state) for state in result]
+        _NOTIFY_STATES.move_to_end(session_key)
+        while len(_NOTIFY_STATES) > NOTIFY_STATE_MAX_SESSIONS:
+            _NOTIFY_STATES.popitem(last=False)
+
     return result
 
 
+def _invalidate_notify_state(keys):
+    """Drop the cached notify states of the session of a new notify_log row."""
+    with _NOTIFY_STATES_LOCK:
+        _NOTIFY_STATES_GENERATION[0] += 1
+        _NOTIFY_STATES.get(keys['session_key'], {}).pop((keys['rating_key'], keys['user_id']), None)
+
+
+def clear_notify_state(session_key):
+    """Drop the cached notify states when the session ends."""
+    with _NOTIFY_STATES_LOCK:
+        _NOTIFY_STATES.pop(helpers.cast_to_int(session_key), None)
+
+
 def get_notify_state_enabled(session, notify_action, notified=True):
     notify_column = getattr(NotifierModel, notify_action, None)
     if notify_column is None:
@@ -567,13 +535,17 @@ def set_notify_state(notifier, notify_action, subject='', body='', script_args='
         _normalize_int_columns(NotifyLogModel, values)
 
         with session_scope() as db_session:
-            return _update_or_insert(
+            notification_id = _update_or_insert(
                 db_session,
                 NotifyLogModel,
                 key_values=keys,
                 values=values,
                 returning_id=True,
             )
+
+        _invalidate_notify_state(keys)
+
+        return notification_id
     else:
         logger.error("Tautulli NotificationHandler :: Unable to set notify state.")
 
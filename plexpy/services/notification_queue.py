@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Durable notification queue in the ``notify_queue`` table.
+
+With ``NOTIFICATION_QUEUE_DURABLE`` enabled, items put on
+``plexpy.NOTIFY_QUEUE`` are stored as JSON rows instead of being kept in
+memory, so pending notifications survive a restart and can be processed by
+every Tautulli process sharing the database. Items that can't be stored
+(not JSON serializable, database errors) stay on the in-memory queue. The
+workers are started at startup, or by the first stored item when the setting
+is enabled later.
+
+Workers claim batches of rows with ``FOR UPDATE SKIP LOCKED`` and lease them
+for ``LEASE_SECONDS``; rows of a worker that died are claimed again once the
+lease expires. Notifications are sent on the delivery pool of their agent,
+so its rate limit applies, and the worker waits for the result. A notifier
+send that fails or raises is retried with an exponential backoff until
+``NOTIFICATION_QUEUE_MAX_ATTEMPTS``, reusing the notify_log row of the first
+attempt. Rows of a deleted notifier are dropped instead of retried. At most
+``NOTIFICATION_QUEUE_AGENT_CONCURRENCY`` rows of the same notification agent
+are leased at a time, enforced across processes with an advisory lock per
+agent while claiming.
+"""
+
+import json
+import os
+import platform
+import queue
+import threading
+
+from sqlalchemy import Integer, cast, delete, func, insert, literal, or_, select, update
+
+import plexpy
+from plexpy.db.models import Notifier as NotifierModel
+from plexpy.db.models import NotifyQueue
+from plexpy.db.session import session_scope
+from plexpy.util import helpers
+from plexpy.util import logger
+
+
+# Seconds a claimed row stays leased to the worker
+LEASE_SECONDS = 300
+# Seconds between polls of an idle worker
+POLL_SECONDS = 5
+# Retry backoff, doubled for every attempt
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 3600
+# First key of the per-agent advisory locks
+AGENT_LOCK_SPACE = 0x4e51
+
+WORKER_ID = '%s:%s' % (platform.node(), os.getpid())
+
+_WAKEUP = threading.Event()
+_STOP = threading.Event()
+_THREADS = []
+_THREADS_LOCK = threading.Lock()
+
+
+class NotificationQueue(queue.Queue):
+    """``plexpy.NOTIFY_QUEUE``, which hands items to the durable queue when it is enabled."""
+
+    def put(self, item, block=True, timeout=None):
+        if item is not None and enabled() and enqueue(item):
+            return
+        super(NotificationQueue, self).put(item, block=block, timeout=timeout)
+
+
+def enabled():
+    config = getattr(plexpy, 'CONFIG', None)
+    return bool(config and config.NOTIFICATION_QUEUE_DURABLE)
+
+
+def enqueue(item):
+    """Store a notification queue item. Returns False if it was not stored."""
+    try:
+        payload = json.dumps(item)
+    except (TypeError, ValueError):
+        return False
+
+    notifier_id = helpers.cast_to_int(item.get('notifier_id')) if item.get('notification') else None
+    agent_id = (
+        select(NotifierModel.agent_id).where(NotifierModel.id == notifier_id).scalar_subquery()
+        if notifier_id else None
+    )
+    now = helpers.timestamp()
+
+    try:
+        with session_scope() as db_session:
+            db_session.execute(
+                insert(NotifyQueue).values(
+                    created_at=now,
+                    available_at=now,
+                    notifier_id=notifier_id,
+                    agent_id=agent_id,
+                    notify_action=item.get('notify_action'),
+                    payload=payload,
+                )
+            )
+    except Exception as e:
+        logger.warn("Tautulli NotificationQueue :: Unable to queue notification: %s." % e)
+        return False
+
+    # The durable queue can be enabled after startup, unless shutting down
+    if not _STOP.is_set():
+        start_threads()
+    _WAKEUP.set()
+    return True
+
+
+def claim(batch_size=None, agent_concurrency=None):
+    """Lease up to batch_size available rows to this worker and return them."""
+    if batch_size is None:
+        batch_size = max(1, plexpy.CONFIG.NOTIFICATION_QUEUE_BATCH_SIZE)
+    if agent_concurrency is None:
+        agent_concurrency = max(1, plexpy.CONFIG.NOTIFICATION_QUEUE_AGENT_CONCURRENCY)
+
+    now = helpers.timestamp()
+
+    with session_scope() as db_session:
+        # Look further ahead than the batch in case rows of busy agents are skipped
+        candidates = db_session.execute(
+            select(NotifyQueue.id, NotifyQueue.agent_id)
+            .where(
+                NotifyQueue.available_at <= now,
+                or_(NotifyQueue.locked_until.is_(None), NotifyQueue.locked_until <= now),
+            )
+            .order_by(NotifyQueue.available_at, NotifyQueue.id)
+            .limit(batch_size * 4)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not candidates:
+            return []
+
+        # Serialize claims per agent so the leased count can't be exceeded by concurrent workers
+        slots = {}
+        for agent_id in sorted({row.agent_id for row in candidates if row.agent_id is not None}):
+            locked = db_session.execute(
+                select(func.pg_try_advisory_xact_lock(cast(literal(AGENT_LOCK_SPACE), Integer),
+                                                     cast(literal(agent_id), Integer)))
+            ).scalar()
+            if locked:
+                leased = db_session.execute(
+                    select(func.count())
+                    .select_from(NotifyQueue)
+                    .where(NotifyQueue.agent_id == agent_id, NotifyQueue.locked_until > now)
+                ).scalar()
+                slots[agent_id] = agent_concurrency - leased
+            else:
+                slots[agent_id] = 0
+
+        claimed = []
+        for row in candidates:
+            if len(claimed) >= batch_size:
+                break
+            if row.agent_id is not None:
+                if slots[row.agent_id] <= 0:
+                    continue
+                slots[row.agent_id] -= 1
+            claimed.append(row.id)
+
+        if not claimed:
+            return []
+
+        result = db_session.execute(
+            update(NotifyQueue)
+            .where(NotifyQueue.id.in_(claimed))
+            .values(locked_until=now + LEASE_SECONDS,
+                    locked_by=WORKER_ID,
+                    attempts=NotifyQueue.attempts + 1)
+            .returning(NotifyQueue.id, NotifyQueue.attempts, NotifyQueue.payload)
+        )
+        rows = [dict(row) for row in result.mappings()]
+
+    return sorted(rows, key=lambda row: claimed.index(row['id']))
+
+
+def complete(row_id):
+    with session_scope() as db_session:
+        db_session.execute(delete(NotifyQueue).where(NotifyQueue.id == row_id))
+
+
+def retry(row_id, attempts, error, payload=None):
+    """
+    Release a failed row for another attempt, or drop it after the last attempt.
+    The payload of the row is replaced if a new one is given.
+    """
+    if attempts >= max(1, plexpy.CONFIG.NOTIFICATION_QUEUE_MAX_ATTEMPTS):
+        logger.error("Tautulli NotificationQueue :: Dropping queued notification %s after %s attempts: %s"
+                     % (row_id, attempts, error))
+        complete(row_id)
+        return
+
+    backoff = min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+    logger.warn("Tautulli NotificationQueue :: Queued notification %s failed (attempt %s), retrying in %s seconds: %s"
+                % (row_id, attempts, backoff, error))
+
+    values = {'available_at': helpers.timestamp() + backoff,
+              'locked_until': None,
+              'locked_by': None,
+              'last_error': str(error)}
+    if payload is not None:
+        values['payload'] = payload
+
+    with session_scope() as db_session:
+        db_session.execute(
+            update(NotifyQueue)
+            .where(NotifyQueue.id == row_id)
+            .values(**values)
+        )
+
+
+def process_row(row):
+    # Imported here, notification_handler starts the workers
+    from plexpy.services import notification_handler
+
+    state = {}
+    try:
+        params = json.loads(row['payload'])
+        result = notification_handler.process_item(params, pooled=True, state=state)
+    except Exception as e:
+        logger.exception("Tautulli NotificationQueue :: Notification worker exception: %s" % e)
+        retry(row['id'], row['attempts'], e, payload=_retry_payload(row, state))
+        return
+
+    if params.get('notification') and state.get('notifier_exists') is False:
+        logger.warn("Tautulli NotificationQueue :: Dropping queued notification %s, notifier_id %s does not exist."
+                    % (row['id'], params.get('notifier_id')))
+        complete(row['id'])
+    elif params.get('notification') and not result:
+        retry(row['id'], row['attempts'], 'notification not sent', payload=_retry_payload(row, state))
+    else:
+        complete(row['id'])
+
+
+def _retry_payload(row, state):
+    """Return the payload with the notify_log id of the failed attempt, so a retry doesn't log it again."""
+    if not state.get('notification_id'):
+        return None
+    params = json.loads(row['payload'])
+    params['notification_id'] = state['notification_id']
+    return json.dumps(params)
+
+
+def process_queue():
+    while not _STOP.is_set():
+        try:
+            rows = claim()
+        except Exception as e:
+            logger.warn("Tautulli NotificationQueue :: Unable to claim queued notifications: %s." % e)
+            rows = []
+
+        if not rows:
+            _WAKEUP.wait(POLL_SECONDS)
+            _WAKEUP.clear()
+            continue
+
+        for row in rows:
+            try:
+                process_row(row)
+            except Exception as e:
+                # The lease expires and the row is claimed again
+                logger.warn("Tautulli NotificationQueue :: Unable to update queued notification %s: %s."
+                            % (row['id'], e))
+
+    logger.info("Tautulli NotificationQueue :: Notification worker exiting...")
+
+
+def start_threads(num_threads=None):
+    """Start the durable notification workers, unless they are running."""
+    if num_threads is None:
+        num_threads = max(1, plexpy.CONFIG.NOTIFICATION_THREADS)
+
+    with _THREADS_LOCK:
+        if _THREADS:
+            return
+
+        logger.info("Tautulli NotificationQueue :: Starting durable notification workers ({} threads).".format(num_threads))
+        _STOP.clear()
+        for x in range(num_threads):
+            thread = threading.Thread(target=process_queue)
+            thread.daemon = True
+            thread.start()
+            _THREADS.append(thread)
+
+
+def stop_threads():
+    with _THREADS_LOCK:
+        _STOP.set()
+        _WAKEUP.set()
+        del _THREADS[:]
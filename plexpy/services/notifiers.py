@@ -54,6 +54,8 @@ import plexpy
 from plexpy.app import common
 from plexpy.integrations import pmsconnect
 from plexpy.services import mobile_app
+from plexpy.services import notification_conditions
+from plexpy.services import notification_delivery
 from plexpy.services import users
 from plexpy.util import request
 from plexpy.db import queries
@@ -533,6 +535,7 @@ def delete_notifier(notifier_id=None):
         with session_scope() as db_session:
             stmt = delete(NotifierModel).where(NotifierModel.id == notifier_id)
             db_session.execute(stmt)
+        notification_conditions.invalidate(int(notifier_id))
         return True
     else:
         return False
@@ -714,6 +717,7 @@ def set_notifier_config(notifier_id=None, agent_id=None, **kwargs):
                 insert_values = {'id': notifier_id}
                 insert_values.update(values)
                 db_session.execute(insert(NotifierModel).values(**insert_values))
+        notification_conditions.invalidate(helpers.cast_to_int(notifier_id))
         logger.info("Tautulli Notifiers :: Updated notification agent: %s (notifier_id %s)."
                     % (agent['label'], notifier_id))
         blacklist_logger()
@@ -727,16 +731,31 @@ def set_notifier_config(notifier_id=None, agent_id=None, **kwargs):
         return False
 
 
-def send_notification(notifier_id=None, subject='', body='', notify_action='', notification_id=None, **kwargs):
+def send_notification(notifier_id=None, subject='', body='', notify_action='', notification_id=None,
+                      callback=None, pooled=False, **kwargs):
+    """
+    Send the notification. With a callback the notification is handed to the
+    delivery pool of the agent and the callback is called with the result.
+    With pooled it is sent on the delivery pool and the result is waited for.
+    """
     notifier_config = get_notifier_config(notifier_id=notifier_id)
     if notifier_config:
         agent = get_agent_class(agent_id=notifier_config['agent_id'],
                                 config=notifier_config['config'])
-        return agent.notify(subject=subject,
-                            body=body,
-                            action=notify_action.split('on_')[-1],
-                            notification_id=notification_id,
-                            **kwargs)
+
+        def send():
+            return agent.notify(subject=subject,
+                                body=body,
+                                action=notify_action.split('on_')[-1],
+                                notification_id=notification_id,
+                                **kwargs)
+
+        if callback:
+            notification_delivery.submit(agent.NAME, send, callback=callback)
+            return
+        elif pooled:
+            return notification_delivery.call(agent.NAME, send)
+        return send()
     else:
         logger.debug("Tautulli Notifiers :: Notification requested but no notifier_id received.")
 
@@ -998,7 +1017,17 @@ class Notifier(object):
 
     def make_request(self, url, method='POST', **kwargs):
         logger.info("Tautulli Notifiers :: Sending {name} notification...".format(name=self.NAME))
-        response, err_msg, req_msg = request.request_response2(url, method, **kwargs)
+        session = notification_delivery.get_session(self.NAME)
+        response, err_msg, req_msg = request.request_response2(url, method, session=session, **kwargs)
+
+        if response is not None and response.status_code == 429:
+            retry_after = notification_delivery.rate_limited(self.NAME, response.headers.get('Retry-After'))
+            # Only wait on a delivery pool worker, not on a web request thread
+            if notification_delivery.in_worker() and retry_after <= notification_delivery.MAX_RETRY_AFTER:
+                logger.warn("Tautulli Notifiers :: {name} notification rate limited, retrying in {sec} seconds."
+                            .format(name=self.NAME, sec=retry_after))
+                time.sleep(retry_after)
+                response, err_msg, req_msg = request.request_response2(url, method, session=session, **kwargs)
 
         if response and not err_msg:
             logger.info("Tautulli Notifiers :: {name} notification sent.".format(name=self.NAME))
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Process-wide directory of the ``users`` table for session enrichment.
+
+The whole table is loaded with one query and kept in memory, indexed by
+user ID and by lower-cased username. Writers to the users table call
+``invalidate`` and the next lookup reloads it; the directory is also reloaded
+after ``MAX_AGE`` seconds in case a row changed elsewhere.
+
+Lookups that miss are remembered for ``MISS_BACKOFF`` seconds so that an
+unknown user only triggers one plex.tv user refresh in that time.
+"""
+
+import threading
+
+from sqlalchemy import select
+
+from plexpy.db import queries
+from plexpy.db.models import User
+from plexpy.db.session import session_scope
+from plexpy.util import helpers
+from plexpy.util import logger
+
+
+# Reload the directory at least this often
+MAX_AGE = 3600
+# Don't refresh the users list again for the same unknown user within this time
+MISS_BACKOFF = 300
+
+# Columns of a user row, labelled like Users.get_user_details
+USER_COLUMNS = (
+    User.id.label('row_id'),
+    User.user_id,
+    User.username,
+    User.friendly_name,
+    User.thumb.label('user_thumb'),
+    User.custom_avatar_url.label('custom_thumb'),
+    User.email,
+    User.is_active,
+    User.is_admin,
+    User.is_home_user,
+    User.is_allow_sync,
+    User.is_restricted,
+    User.do_notify,
+    User.keep_history,
+    User.deleted_user,
+    User.allow_guest,
+    User.shared_libraries,
+)
+
+_LOCK = threading.Lock()
+_DIRECTORY = {'loaded': 0, 'by_id': {}, 'by_username': {}}
+_MISSES = {}
+
+
+def _load():
+    try:
+        with session_scope() as db_session:
+            rows = queries.fetch_mappings(db_session, select(*USER_COLUMNS).order_by(User.id))
+    except Exception as e:
+        logger.warn("Tautulli UserDirectory :: Unable to execute database query for load: %s." % e)
+        return None
+
+    by_id = {}
+    by_username = {}
+    for row in rows:
+        if row['user_id'] is not None:
+            by_id[row['user_id']] = row
+        if row['username']:
+            by_username.setdefault(row['username'].lower(), row)
+
+    return {'loaded': helpers.timestamp(), 'by_id': by_id, 'by_username': by_username}
+
+
+def _directory():
+    global _DIRECTORY
+
+    with _LOCK:
+        directory = _DIRECTORY
+    if directory['loaded'] and helpers.timestamp() - directory['loaded'] <= MAX_AGE:
+        return directory
+
+    loaded = _load()
+    if loaded is None:
+        return directory
+
+    with _LOCK:
+        # Don't install the load if the directory was invalidated meanwhile
+        if _DIRECTORY is directory:
+            _DIRECTORY = loaded
+    return loaded
+
+
+def get_user(user_id=None, username=None):
+    """
+    Return a copy of the user row for the user ID, or the username if no
+    user ID is given, or None if the user is not in the database.
+    """
+    directory = _directory()
+
+    if str(user_id).isdigit():
+        row = directory['by_id'].get(helpers.cast_to_int(user_id))
+    elif username:
+        row = directory['by_username'].get(username.lower())
+    else:
+        row = None
+
+    return dict(row, last_seen=None) if row is not None else None
+
+
+def allow_refresh(key):
+    """
+    Return True if a users list refresh may be requested for the missing user
+    key, and remember the miss for ``MISS_BACKOFF`` seconds.
+    """
+    now = helpers.timestamp()
+    key = str(key).lower()
+
+    with _LOCK:
+        for missed_key, missed_at in list(_MISSES.items()):
+            if now - missed_at > MISS_BACKOFF:
+                del _MISSES[missed_key]
+
+        if key in _MISSES:
+            return False
+        _MISSES[key] = now
+        return True
+
+
+def invalidate():
+    """Drop the loaded directory, the next lookup reloads it."""
+    global _DIRECTORY
+
+    with _LOCK:
+        _DIRECTORY = {'loaded': 0, 'by_id': {}, 'by_username': {}}
@@ -31,6 +31,7 @@ from plexpy.db.engine import get_engine
 from plexpy.db.models import SessionHistory, SessionHistoryMediaInfo, SessionHistoryMetadata, User, UserLogin
 from plexpy.db.session import session_scope
 from plexpy.services import libraries
+from plexpy.services import user_directory
 from plexpy.web import session
 from plexpy.integrations import plextv
 from plexpy.util import helpers
@@ -49,55 +50,57 @@ def refresh_users():
     if result:
         # Keep track of user_id to update is_active status
         user_ids = [0]  # Local user always considered active
-        new_users = []
-        with session_scope() as db_session:
-            for item in result:
-                if item.get('shared_libraries'):
-                    item['shared_libraries'] = ';'.join(item['shared_libraries'])
-                    # Only append user if libraries are shared
-                    user_ids.append(helpers.cast_to_int(item['user_id']))
-                elif item.get('server_token'):
+        rows = []
+        shared_sections = None
+        for item in result:
+            if item.get('shared_libraries'):
+                item['shared_libraries'] = ';'.join(item['shared_libraries'])
+                # Only append user if libraries are shared
+                user_ids.append(helpers.cast_to_int(item['user_id']))
+            elif item.get('server_token'):
+                if shared_sections is None:
                     libs = libraries.Libraries().get_sections()
-                    item['shared_libraries'] = ';'.join([str(l['section_id']) for l in libs])
-                    # Only append user if libraries are shared
-                    user_ids.append(helpers.cast_to_int(item['user_id']))
-
-                keys_dict = {"user_id": helpers.cast_to_int(item.pop('user_id'))}
+                    shared_sections = ';'.join([str(l['section_id']) for l in libs])
+                item['shared_libraries'] = shared_sections
+                # Only append user if libraries are shared
+                user_ids.append(helpers.cast_to_int(item['user_id']))
+
+            item['user_id'] = helpers.cast_to_int(item['user_id'])
+
+            # The custom avatar is only replaced if it was not changed, see the conflict update below
+            item['custom_avatar_url'] = item['thumb'] if item['user_id'] else None
+
+            # Check if title is the same as the username
+            if item['title'] == item['username']:
+                item['title'] = None
+
+            # Check if username is blank (Managed Users)
+            if not item['username']:
+                item['username'] = item['title']
+
+            rows.append(item)
+
+        def keep_custom_avatar(excluded):
+            # Check if we've set a custom avatar if so don't overwrite it.
+            custom_avatar_url = case(
+                (excluded.user_id == 0, User.custom_avatar_url),
+                (or_(User.custom_avatar_url.is_(None),
+                     User.custom_avatar_url == '',
+                     User.custom_avatar_url == User.thumb), excluded.custom_avatar_url),
+                else_=User.custom_avatar_url,
+            )
+            return {'custom_avatar_url': custom_avatar_url}
 
-                # Check if we've set a custom avatar if so don't overwrite it.
-                if keys_dict['user_id']:
-                    stmt = (
-                        select(User.thumb, User.custom_avatar_url)
-                        .where(User.user_id == keys_dict['user_id'])
-                    )
-                    avatar_urls = db_session.execute(stmt).mappings().first()
-                    if avatar_urls:
-                        if not avatar_urls['custom_avatar_url'] or \
-                                avatar_urls['custom_avatar_url'] == avatar_urls['thumb']:
-                            item['custom_avatar_url'] = item['thumb']
-                    else:
-                        item['custom_avatar_url'] = item['thumb']
-
-                # Check if title is the same as the username
-                if item['title'] == item['username']:
-                    item['title'] = None
-
-                # Check if username is blank (Managed Users)
-                if not item['username']:
-                    item['username'] = item['title']
-
-                stmt = update(User).where(User.user_id == keys_dict['user_id']).values(**item)
-                update_result = db_session.execute(stmt)
-                if not update_result.rowcount or update_result.rowcount == 0:
-                    insert_values = {**item, **keys_dict}
-                    stmt = insert(User).values(**insert_values).returning(User.id)
-                    inserted_id = db_session.execute(stmt).scalar_one_or_none()
-                    if inserted_id is not None:
-                        new_users.append(item['username'])
+        with session_scope() as db_session:
+            upserted = queries.upsert_many(db_session, User.__table__, rows, ['user_id'],
+                                           set_values=keep_custom_avatar, returning=['username'])
+            new_users = [row['username'] for row in upserted if row['inserted']]
 
             stmt = update(User).where(User.user_id.notin_(user_ids)).values(is_active=0)
             db_session.execute(stmt)
 
+        user_directory.invalidate()
+
         # Add new users to logger username filter
         logger.filter_usernames(new_users)
 
@@ -200,7 +203,9 @@ class Users(object):
                 last_sh.c.id.label('history_row_id'),
                 SessionHistoryMetadata.full_title.label('last_played'),
                 last_sh.c.ip_address,
-                last_sh.c.platform,
+                # Rename Mystery platform names, in SQL so searching and sorting use the displayed names
+                case(common.PLATFORM_NAME_OVERRIDES, value=last_sh.c.platform,
+                     else_=last_sh.c.platform).label('platform'),
                 last_sh.c.player,
                 last_sh.c.rating_key,
                 SessionHistoryMetadata.media_type,
@@ -233,7 +238,7 @@ class Users(object):
 
         try:
             with session_scope() as db_session:
-                users = queries.fetch_mappings(db_session, stmt)
+                results = queries.fetch_datatable_rows(db_session, stmt, json_data, default_sort='friendly_name')
                 total_count = queries.fetch_scalar(
                     db_session,
                     select(func.count(User.id)),
@@ -244,7 +249,7 @@ class Users(object):
             return default_return
 
         rows = []
-        for item in users:
+        for item in results['results']:
             if item['media_type'] == 'episode' and item['parent_thumb']:
                 thumb = item['parent_thumb']
             elif item['media_type'] == 'episode':
@@ -259,9 +264,6 @@ class Users(object):
             else:
                 user_thumb = common.DEFAULT_USER_THUMB
 
-            # Rename Mystery platform names
-            platform = common.PLATFORM_NAME_OVERRIDES.get(item['platform'], item['platform'])
-
             row = {'row_id': item['row_id'],
                    'user_id': item['user_id'],
                    'username': item['username'],
@@ -275,7 +277,7 @@ class Users(object):
                    'last_played': item['last_played'],
                    'history_row_id': item['history_row_id'],
                    'ip_address': item['ip_address'],
-                   'platform': platform,
+                   'platform': item['platform'],
                    'player': item['player'],
                    'rating_key': item['rating_key'],
                    'media_type': item['media_type'],
@@ -296,11 +298,9 @@ class Users(object):
 
             rows.append(row)
 
-        results = helpers.process_datatable_rows(rows, json_data, default_sort='friendly_name')
-
         data = {'recordsFiltered': results['filtered_count'],
                 'recordsTotal': total_count,
-                'data': session.friendly_name_to_username(results['results']),
+                'data': session.friendly_name_to_username(rows),
                 'draw': int(json_data.get('draw', 0))
                 }
 
@@ -442,6 +442,8 @@ class Users(object):
                         db_session.execute(insert(User).values(**insert_values))
             except Exception as e:
                 logger.warn("Tautulli Users :: Unable to execute database query for set_config: %s." % e)
+            finally:
+                user_directory.invalidate()
 
     def get_details(self, user_id=None, user=None, email=None, include_last_seen=False):
         default_return = {'row_id': 0,
@@ -472,6 +474,10 @@ class Users(object):
         if user_details:
             return user_details
 
+        elif not user_directory.allow_refresh(user_id or user or email):
+            # A refresh was already requested for this user recently
+            return default_return
+
         else:
             logger.warn("Tautulli Users :: Unable to retrieve user %s from database. Requesting user list refresh."
                         % user_id if user_id else user)
@@ -493,48 +499,35 @@ class Users(object):
 
     def get_user_details(self, user_id=None, user=None, email=None, include_last_seen=False):
         try:
-            if include_last_seen:
-                last_seen_column = (
-                    select(func.max(SessionHistory.started))
-                    .where(SessionHistory.user_id == User.user_id)
-                    .scalar_subquery()
-                    .label('last_seen')
-                )
+            if not include_last_seen and (str(user_id).isdigit() or user):
+                # Served from the in-memory user directory
+                user_row = user_directory.get_user(user_id=user_id, username=user)
+                result = [user_row] if user_row else []
+
             else:
-                last_seen_column = literal(None).label('last_seen')
+                if include_last_seen:
+                    last_seen_column = (
+                        select(func.max(SessionHistory.started))
+                        .where(SessionHistory.user_id == User.user_id)
+                        .scalar_subquery()
+                        .label('last_seen')
+                    )
+                else:
+                    last_seen_column = literal(None).label('last_seen')
 
-            stmt = select(
-                User.id.label('row_id'),
-                User.user_id,
-                User.username,
-                User.friendly_name,
-                User.thumb.label('user_thumb'),
-                User.custom_avatar_url.label('custom_thumb'),
-                User.email,
-                User.is_active,
-                User.is_admin,
-                User.is_home_user,
-                User.is_allow_sync,
-                User.is_restricted,
-                User.do_notify,
-                User.keep_history,
-                User.deleted_user,
-                User.allow_guest,
-                User.shared_libraries,
-                last_seen_column,
-            )
+                stmt = select(*user_directory.USER_COLUMNS, last_seen_column)
 
-            if str(user_id).isdigit():
-                stmt = stmt.where(User.user_id == helpers.cast_to_int(user_id))
-            elif user:
-                stmt = stmt.where(User.username.ilike(user))
-            elif email:
-                stmt = stmt.where(User.email.ilike(email))
-            else:
-                raise Exception("Missing user_id, username, or email")
+                if str(user_id).isdigit():
+                    stmt = stmt.where(User.user_id == helpers.cast_to_int(user_id))
+                elif user:
+                    stmt = stmt.where(User.username.ilike(user))
+                elif email:
+                    stmt = stmt.where(User.email.ilike(email))
+                else:
+                    raise Exception("Missing user_id, username, or email")
 
-            with session_scope() as db_session:
-                result = queries.fetch_mappings(db_session, stmt)
+                with session_scope() as db_session:
+                    result = queries.fetch_mappings(db_session, stmt)
         except Exception as e:
             logger.warn("Tautulli Users :: Unable to execute database query for get_user_details: %s." % e)
             result = []
@@ -876,6 +869,7 @@ class Users(object):
                             .values(deleted_user=1, keep_history=0, do_notify=0)
                         )
                         db_session.execute(stmt)
+                    user_directory.invalidate()
                     return delete_success
                 except Exception as e:
                     logger.warn("Tautulli Users :: Unable to execute database query for delete: %s." % e)
@@ -917,6 +911,8 @@ class Users(object):
 
         except Exception as e:
             logger.warn("Tautulli Users :: Unable to execute database query for undelete: %s." % e)
+        finally:
+            user_directory.invalidate()
 
     # Keep method for legacy imports
     def get_user_id(self, user=None):
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sweep-line peak concurrency for play history.
+
+Every interval belongs to one or more buckets (e.g. a day and a transcode
+decision). All start and stop events are encoded as integers and sorted once,
+then a single sweep tracks the running count and the peak window of every
+bucket at the same time.
+"""
+
+
+def peak_concurrency(intervals):
+    """
+    Expects an iterable of (started, stopped, bucket_keys) tuples.
+
+    Returns a dict of bucket key -> {'count', 'started', 'stopped'} with the
+    highest number of overlapping intervals in the bucket and the window in
+    which it was last reached. A stop at the same second as a start is
+    processed first, so back-to-back plays do not overlap.
+    """
+    bucket_keys = []
+    events = []
+    for started, stopped, keys in intervals:
+        if started is None or stopped is None:
+            continue
+        index = len(bucket_keys)
+        bucket_keys.append(keys)
+        # Low bit is the event type: 0 = stop, 1 = start
+        events.append((int(started) << 1 | 1, index))
+        events.append((int(stopped) << 1, index))
+    events.sort()
+
+    counts = {}
+    peaks = {}
+    peak_starts = {}
+
+    for event, index in events:
+        time = event >> 1
+        is_start = event & 1
+
+        for key in bucket_keys[index]:
+            count = counts.get(key, 0)
+            peak = peaks.get(key)
+            peak_count = peak['count'] if peak else 0
+
+            if is_start:
+                count += 1
+                if count >= peak_count:
+                    peak_starts[key] = time
+            else:
+                if count >= peak_count:
+                    peaks[key] = {'count': count,
+                                  'started': peak_starts.get(key),
+                                  'stopped': time}
+                count -= 1
+
+            counts[key] = count
+
+    return peaks
@@ -43,13 +43,13 @@ import sys
 import time
 import unicodedata
 from urllib.parse import urlencode
-from xml.dom import minidom
 import xmltodict
 
 import plexpy
 from plexpy.app import common
 from plexpy.util import logger
 from plexpy.util import request
+from plexpy.util import xmltree
 from plexpy.web.api2 import API2
 
 
@@ -581,7 +581,7 @@ def hex_to_int(hex):
 def parse_xml(unparsed=None):
     if unparsed:
         try:
-            xml_parse = minidom.parseString(unparsed)
+            xml_parse = xmltree.parse(unparsed)
             return xml_parse
         except Exception as e:
             logger.warn("Error parsing XML. %s" % e)
@@ -125,7 +125,7 @@ def request_response(url, method="get", auto_raise=True,
 
 
 def request_response2(url, method="get", auto_raise=True,
-                      whitelist_status_code=None, lock=fake_lock, **kwargs):
+                      whitelist_status_code=None, lock=fake_lock, session=None, **kwargs):
     """
     Convenient wrapper for `requests.get', which will capture the exceptions
     and log them. On success, the Response object is returned. In case of a
@@ -136,6 +136,9 @@ def request_response2(url, method="get", auto_raise=True,
     other request with the same lock is executed. The request limit is the
     minimal time between two requests (and so 1/request_limit is the number of
     requests per seconds).
+
+    A `requests.Session' can be given to send the request over its pooled
+    connections.
     """
 
     # Convert whitelist_status_code to a list if needed
@@ -150,7 +153,7 @@ def request_response2(url, method="get", auto_raise=True,
 
     # Map method to the request.XXX method. This is a simple hack, but it
     # allows requests to apply more magic per method. See lib/requests/api.py.
-    request_method = getattr(requests, method.lower())
+    request_method = getattr(session or requests, method.lower())
 
     response = None
     err_msg = http_err = req_msg = None
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Tautulli.
+#
+#  Tautulli is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Tautulli is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Tautulli.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Lightweight XML tree for Plex responses.
+
+Responses are parsed with the C ElementTree parser and wrapped in thin
+adapters exposing the subset of the ``xml.dom.minidom`` API that the Plex
+clients use (``getElementsByTagName``, ``getAttribute``, ``childNodes``, ...).
+Tag searches run in C over the element tree instead of walking a Python DOM,
+and wrappers are only created for the elements that are returned.
+"""
+
+from xml.etree import ElementTree
+
+
+ELEMENT_NODE = 1
+TEXT_NODE = 3
+DOCUMENT_NODE = 9
+
+
+class XmlText(object):
+    __slots__ = ('data',)
+
+    nodeType = TEXT_NODE
+    nodeName = '#text'
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def nodeValue(self):
+        return self.data
+
+
+class XmlElement(object):
+    __slots__ = ('element',)
+
+    nodeType = ELEMENT_NODE
+
+    def __init__(self, element):
+        self.element = element
+
+    def __eq__(self, other):
+        return isinstance(other, XmlElement) and other.element is self.element
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return id(self.element)
+
+    def __repr__(self):
+        return '<XmlElement %s>' % self.element.tag
+
+    @property
+    def tagName(self):
+        return self.element.tag
+
+    @property
+    def nodeName(self):
+        return self.element.tag
+
+    @property
+    def attributes(self):
+        return self.element.attrib
+
+    def getAttribute(self, name):
+        return self.element.get(name, '')
+
+    def hasAttribute(self, name):
+        return name in self.element.attrib
+
+    def getElementsByTagName(self, name):
+        """Return all descendant elements with the tag name, like minidom."""
+        elements = self.element.iter(None if name == '*' else name)
+        if name == '*' or self.element.tag == name:
+            # iter() starts with the element itself
+            next(elements, None)
+        return [XmlElement(e) for e in elements]
+
+    @property
+    def childNodes(self):
+        nodes = []
+        if self.element.text:
+            nodes.append(XmlText(self.element.text))
+        for child in self.element:
+            nodes.append(XmlElement(child))
+            if child.tail:
+                nodes.append(XmlText(child.tail))
+        return nodes
+
+    @property
+    def firstChild(self):
+        if self.element.text:
+            return XmlText(self.element.text)
+        for child in self.element:
+            return XmlElement(child)
+        return None
+
+    def hasChildNodes(self):
+        return bool(self.element.text) or len(self.element) > 0
+
+
+class XmlDocument(object):
+    __slots__ = ('root',)
+
+    nodeType = DOCUMENT_NODE
+    nodeName = '#document'
+
+    def __init__(self, root):
+        self.root = root
+
+    @property
+    def documentElement(self):
+        return XmlElement(self.root)
+
+    @property
+    def childNodes(self):
+        return [XmlElement(self.root)]
+
+    @property
+    def firstChild(self):
+        return XmlElement(self.root)
+
+    def getElementsByTagName(self, name):
+        """Return all elements with the tag name, including the root element."""
+        return [XmlElement(e) for e in self.root.iter(None if name == '*' else name)]
+
+
+def parse(data):
+    """Parse an XML string or bytes into an XmlDocument."""
+    return XmlDocument(ElementTree.fromstring(data))
@@ -18,9 +18,11 @@
 # Mostly borrowed from https://github.com/trakt/Plex-Trakt-Scrobbler
 
 import json
+import queue
 import ssl
 import threading
 import time
+import zlib
 
 import certifi
 import websocket
@@ -41,6 +43,110 @@ pong_timer = None
 pong_count = 0
 ws_lock = threading.Lock()
 ws_thread = None
+event_dispatcher = None
+
+# Maximum number of queued events per dispatch worker
+EVENT_QUEUE_SIZE = 1000
+
+
+class EventDispatcher(object):
+    """
+    Hands websocket events off the receive thread to a pool of workers.
+
+    Every event has a key and events with the same key are always handled by
+    the same worker in the order they were received, so the events of one
+    session never race each other. A queued progress event that has not been
+    picked up yet is replaced by a newer one for the same session and state,
+    so a backlog never holds more than one progress update per session.
+    Stopping doesn't wait for full queues and drops the events still queued.
+    """
+
+    def __init__(self, num_threads=1, queue_size=EVENT_QUEUE_SIZE):
+        self.num_threads = max(1, num_threads)
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(self.num_threads)]
+        self.threads = []
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def start(self):
+        logger.info("Tautulli WebSocket :: Starting websocket event handler ({} threads).".format(self.num_threads))
+        for event_queue in self.queues:
+            thread = threading.Thread(target=self.process_queue, args=(event_queue,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        # Don't block on a full queue, its worker exits after the event it is handling
+        self.stopped.set()
+        for event_queue in self.queues:
+            try:
+                event_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        self.threads = []
+
+    def is_alive(self):
+        return bool(self.threads) and all(thread.is_alive() for thread in self.threads)
+
+    def put(self, event_type, key, data, coalesce_state=None):
+        event = {'event_type': event_type, 'key': key, 'data': data, 'state': coalesce_state}
+
+        if coalesce_state is not None:
+            with self.pending_lock:
+                queued = self.pending.get(key)
+                if queued is not None and queued['state'] == coalesce_state:
+                    # Superseded progress update, the worker will only see the newest one
+                    queued['data'] = data
+                    return
+                self.pending[key] = event
+
+        event_queue = self.queues[zlib.crc32(str(key).encode('utf-8')) % self.num_threads]
+        try:
+            event_queue.put_nowait(event)
+        except queue.Full:
+            logger.warn("Tautulli WebSocket :: Websocket event queue is full, waiting for the event handler.")
+            while not self.stopped.is_set():
+                try:
+                    event_queue.put(event, timeout=1)
+                    break
+                except queue.Full:
+                    pass
+
+    def process_queue(self, event_queue):
+        while not self.stopped.is_set():
+            event = event_queue.get()
+            if event is None:
+                event_queue.task_done()
+                break
+
+            if event['state'] is not None:
+                with self.pending_lock:
+                    if self.pending.get(event['key']) is event:
+                        del self.pending[event['key']]
+
+            try:
+                handle_event(event['event_type'], event['data'])
+            finally:
+                event_queue.task_done()
+
+
+def start_dispatcher():
+    global event_dispatcher
+    with ws_lock:
+        if event_dispatcher is not None and event_dispatcher.is_alive():
+            return
+        event_dispatcher = EventDispatcher(num_threads=plexpy.CONFIG.WEBSOCKET_EVENT_THREADS)
+        event_dispatcher.start()
+
+
+def stop_dispatcher():
+    global event_dispatcher
+    with ws_lock:
+        if event_dispatcher is not None:
+            event_dispatcher.stop()
+            event_dispatcher = None
 
 
 def start_thread():
@@ -53,6 +159,8 @@ def start_thread():
         ws_thread = threading.Thread(target=run)
         ws_thread.daemon = True
 
+    start_dispatcher()
+
     try:
         # Check for any existing sessions on start up
         activity_pinger.check_active_sessions(ws_request=True)
@@ -120,6 +228,7 @@ def shutdown():
     global ws_shutdown
     ws_shutdown = True
     close()
+    stop_dispatcher()
 
 
 def close():
@@ -299,11 +408,11 @@ def process(opcode, data):
             logger.debug("Tautulli WebSocket :: Session event found but unable to get websocket data.")
             return False
 
-        try:
-            activity = activity_handler.ActivityHandler(timeline=event_data[0])
-            activity.process()
-        except Exception as e:
-            logger.exception("Tautulli WebSocket :: Failed to process session data: %s." % e)
+        timeline = event_data[0]
+        # Progress events only replace a queued event for the same item, stream and state
+        state = (timeline.get('state'), timeline.get('ratingKey'), timeline.get('key'),
+                 timeline.get('transcodeSession'))
+        dispatch(event_type, ('session', timeline.get('sessionKey')), timeline, coalesce_state=state)
 
     if event_type == 'timeline':
         event_data = event.get('TimelineEntry', event.get('_children', {}))
@@ -312,11 +421,8 @@ def process(opcode, data):
             logger.debug("Tautulli WebSocket :: Timeline event found but unable to get websocket data.")
             return False
 
-        try:
-            activity = activity_handler.TimelineHandler(timeline=event_data[0])
-            activity.process()
-        except Exception as e:
-            logger.exception("Tautulli WebSocket :: Failed to process timeline data: %s." % e)
+        # Timeline events share the recently added queue, keep them on a single worker
+        dispatch(event_type, ('timeline',), event_data[0])
 
     if event_type == 'reachability':
         event_data = event.get('ReachabilityNotification', event.get('_children', {}))
@@ -325,10 +431,37 @@ def process(opcode, data):
             logger.debug("Tautulli WebSocket :: Reachability event found but unable to get websocket data.")
             return False
 
+        dispatch(event_type, ('reachability',), event_data[0])
+
+    return True
+
+
+def dispatch(event_type, key, data, coalesce_state=None):
+    dispatcher = event_dispatcher
+    if dispatcher is None:
+        handle_event(event_type, data)
+    else:
+        dispatcher.put(event_type, key, data, coalesce_state=coalesce_state)
+
+
+def handle_event(event_type, data):
+    if event_type == 'playing':
         try:
-            activity = activity_handler.ReachabilityHandler(data=event_data[0])
+            activity = activity_handler.ActivityHandler(timeline=data)
             activity.process()
         except Exception as e:
-            logger.exception("Tautulli WebSocket :: Failed to process reachability data: %s." % e)
+            logger.exception("Tautulli WebSocket :: Failed to process session data: %s." % e)
 
-    return True
+    elif event_type == 'timeline':
+        try:
+            activity = activity_handler.TimelineHandler(timeline=data)
+            activity.process()
+        except Exception as e:
+            logger.exception("Tautulli WebSocket :: Failed to process timeline data: %s." % e)
+
+    elif event_type == 'reachability':
+        try:
+            activity = activity_handler.ReachabilityHandler(data=data)
+            activity.process()
+        except Exception as e:
+            logger.exception("Tautulli WebSocket :: Failed to process reachability data: %s." % e)
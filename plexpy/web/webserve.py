@@ -47,6 +47,8 @@ from plexpy.app import common
 from plexpy.db import datafactory
 from plexpy.db import maintenance
 from plexpy.integrations import http_handler
+from plexpy.integrations import image_cache
+from plexpy.integrations import metadata_cache
 from plexpy.integrations import pmsconnect
 from plexpy.services import exporter
 from plexpy.services import graphs
@@ -63,6 +65,7 @@ from plexpy.integrations import plextv
 from plexpy.services import activity_pinger
 from plexpy.services import activity_processor
 from plexpy.services import newsletter_handler
+from plexpy.services import notification_delivery
 from plexpy.services import notification_handler
 from plexpy.util import helpers
 from plexpy.util import logger
@@ -1852,7 +1855,7 @@ class WebInterface(object):
     @requireAuth()
     @sanitize_out()
     @addtoapi()
-    def get_history(self, user=None, user_id=None, grouping=None, include_activity=None, **kwargs):
+    def get_history(self, user=None, user_id=None, grouping=None, include_activity=None, cursor=None, **kwargs):
         """ Get the Tautulli history.
 
             ```
@@ -1880,6 +1883,11 @@ class WebInterface(object):
                 start (int):                    Row to start from, 0
                 length (int):                   Number of items to return, 25
                 search (str):                   A string to search for, "Thrones"
+                cursor (str):                   The "next_cursor" from the previous page for keyset pagination,
+                                                use an empty string for the first page. History is returned
+                                                ungrouped without current activity, newest first, and
+                                                "start", "order_column", "recordsFiltered" and "total_duration"
+                                                are not used
 
             Returns:
                 json:
@@ -1888,6 +1896,7 @@ class WebInterface(object):
                      "recordsFiltered": 250,
                      "total_duration": "42 days 5 hrs 18 mins",
                      "filter_duration": "10 hrs 12 mins",
+                     "next_cursor": "MTQ2MjY4ODEwNzoxMTI0",
                      "data":
                         [{"date": 1462687607,
                           "friendly_name": "Mother of Dragons",
@@ -2039,7 +2048,8 @@ class WebInterface(object):
 
         data_factory = datafactory.DataFactory()
         history = data_factory.get_datatables_history(kwargs=kwargs, custom_where=custom_where,
-                                                      grouping=grouping, include_activity=include_activity)
+                                                      grouping=grouping, include_activity=include_activity,
+                                                      cursor=cursor)
 
         return history
 
@@ -3059,6 +3069,82 @@ class WebInterface(object):
 
         return {'result': res, 'message': msg}
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    @addtoapi()
+    def get_notification_delivery_stats(self, **kwargs):
+        """ Get the delivery statistics of the notification agents since Tautulli was started.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                None
+
+            Returns:
+                json:
+                    {"Discord": {"failed": 0,
+                                 "in_flight": 0,
+                                 "latency_avg": 0.412,
+                                 "latency_max": 1.873,
+                                 "latency_total": 8.24,
+                                 "queued": 0,
+                                 "rate_limited": 1,
+                                 "sent": 20,
+                                 "wait_avg": 0.051,
+                                 "wait_max": 0.73,
+                                 "wait_total": 1.02
+                                 },
+                     {...},
+                     }
+            ```
+        """
+        return notification_delivery.get_stats()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @requireAuth(member_of("admin"))
+    @addtoapi()
+    def get_cache_stats(self, **kwargs):
+        """ Get the statistics of the image cache and the session metadata cache since Tautulli was started.
+
+            ```
+            Required parameters:
+                None
+
+            Optional parameters:
+                None
+
+            Returns:
+                json:
+                    {"image_cache": {"bytes": 52428800,
+                                     "coalesced": 3,
+                                     "evicted_bytes": 0,
+                                     "evictions": 0,
+                                     "fetch_errors": 0,
+                                     "fetches": 120,
+                                     "files": 812,
+                                     "hits": 2400,
+                                     "in_flight": 0,
+                                     "max_bytes": 524288000,
+                                     "misses": 123,
+                                     "scanned": 1793834400,
+                                     "writes": 120
+                                     },
+                     "metadata_cache": {"evictions": 0,
+                                        "hits": 512,
+                                        "items": 4,
+                                        "max_items": 100,
+                                        "misses": 8
+                                        }
+                     }
+            ```
+        """
+        return {'image_cache': image_cache.get_stats(),
+                'metadata_cache': metadata_cache.get_stats()}
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     @requireAuth(member_of("admin"))
@@ -4744,23 +4830,7 @@ class WebInterface(object):
 
         return_hash = helpers.bool_true(kwargs.get('return_hash'))
 
-        if rating_key and not img:
-            if fallback and fallback.startswith('art'):
-                img = '/library/metadata/{}/art'.format(rating_key)
-            else:
-                img = '/library/metadata/{}/thumb'.format(rating_key)
-
-        if img and not img.startswith('http'):
-            parts = 5
-            if img.startswith('/playlists'):
-                parts -= 1
-            rating_key_idx = parts - 2
-            parts += int('composite' in img)
-            img_split = img.split('/')
-            img = '/'.join(img_split[:parts])
-            img_rating_key = img_split[rating_key_idx]
-            if rating_key != img_rating_key:
-                rating_key = img_rating_key
+        img, rating_key = image_cache.normalize_image(img=img, rating_key=rating_key, fallback=fallback)
 
         img_hash = notification_handler.set_hash_image_info(
             img=img, rating_key=rating_key, width=width, height=height,
@@ -4773,42 +4843,53 @@ class WebInterface(object):
         if img_format not in ('png', 'jpg'):
             img_format = 'png'
 
-        fp = '{}.{}'.format(img_hash, img_format)  # we want to be able to preview the thumbs
-        c_dir = os.path.abspath(os.path.join(plexpy.CONFIG.CACHE_DIR, 'images'))
-        ffp = os.path.join(c_dir, fp)
-
-        if not os.path.exists(c_dir):
-            os.makedirs(c_dir, exist_ok=True)
+        ffp = image_cache.cache_path(img_hash, img_format)  # we want to be able to preview the thumbs
+        content_type = image_cache.content_type(img_format)
 
         clip = helpers.bool_true(clip)
+        cache_image = plexpy.CONFIG.CACHE_IMAGES and 'indexes' not in img
 
         try:
-            if not plexpy.CONFIG.CACHE_IMAGES or refresh or 'indexes' in img:
+            stat = image_cache.lookup(ffp) if cache_image and not refresh else None
+            if not stat:
                 raise NotFound
 
-            return serve_file(path=ffp, content_type='image/png')
+            etag = image_cache.etag(img_hash, img_format, stat)
+            cherrypy.response.headers['ETag'] = etag
+            if image_cache.etag_matches(etag, cherrypy.request.headers.get('If-None-Match')):
+                cherrypy.response.status = 304
+                return
+
+            # Stream the file in chunks instead of buffering the body
+            cherrypy.response.stream = True
+            return serve_file(path=ffp, content_type=content_type)
 
         except NotFound:
             # the image does not exist, download it from pms
-            try:
+            def get_image():
                 pms_connect = pmsconnect.PmsConnect()
                 pms_connect.request_handler._silent = True
-                result = pms_connect.get_image(img=img,
-                                               width=width,
-                                               height=height,
-                                               opacity=opacity,
-                                               background=background,
-                                               blur=blur,
-                                               img_format=img_format,
-                                               clip=clip,
-                                               refresh=refresh)
+                return pms_connect.get_image(img=img,
+                                             width=width,
+                                             height=height,
+                                             opacity=opacity,
+                                             background=background,
+                                             blur=blur,
+                                             img_format=img_format,
+                                             clip=clip,
+                                             refresh=refresh)
+
+            try:
+                # Concurrent requests for the same image share one PMS request
+                result = image_cache.fetch(ffp, get_image, store=cache_image)
 
                 if result and result[0]:
                     cherrypy.response.headers['Content-type'] = result[1]
-                    if plexpy.CONFIG.CACHE_IMAGES and 'indexes' not in img:
-                        with open(ffp, 'wb') as f:
-                            f.write(result[0])
-
+                    if cache_image:
+                        try:
+                            cherrypy.response.headers['ETag'] = image_cache.etag(img_hash, img_format, os.stat(ffp))
+                        except OSError:
+                            pass
                     return result[0]
                 else:
                     raise Exception('PMS image request failed')
@@ -4816,6 +4897,7 @@ class WebInterface(object):
             except Exception as e:
                 logger.warn("Failed to get image %s, falling back to %s." % (img, fallback))
                 cherrypy.response.headers['Cache-Control'] = "max-age=0,no-cache,no-store"
+                cherrypy.response.headers.pop('ETag', None)
                 if fallback in common.DEFAULT_IMAGES:
                     fbi = common.DEFAULT_IMAGES[fallback]
                     fp = os.path.join(plexpy.ASSETS_DIR, fbi)
@@ -4853,7 +4935,7 @@ class WebInterface(object):
 
             if img_info:
                 kwargs.update(img_info)
-                return self.real_pms_image_proxy(refresh=True, **kwargs)
+                return self.real_pms_image_proxy(**kwargs)
 
         return
 
@@ -7038,7 +7120,8 @@ class WebInterface(object):
     def export_metadata(self, section_id=None, user_id=None, rating_key=None, file_format='csv',
                         metadata_level=1, media_info_level=1,
                         thumb_level=0, art_level=0, logo_level=0,
-                        custom_fields='', export_type='all', individual_files=False, **kwargs):
+                        custom_fields='', export_type='all', individual_files=False,
+                        incremental=False, base_export_id=None, **kwargs):
         """ Export library or media metadata to a file
 
             ```
@@ -7059,6 +7142,15 @@ class WebInterface(object):
                 export_type (str):         'collection' or 'playlist' for library/user export,
                                            otherwise default to all library items
                 individual_files (bool):   Export each item as an individual file for library/user export.
+                incremental (bool):        Only export the library items added or updated since the latest
+                                           export of the library with the same options and merge them
+                                           with it (json library export without images only).
+                                           Items are also exported again if their child count, watch state
+                                           or rating changed, or if the export includes child items
+                                           (e.g. seasons of shows) and a child was added, updated,
+                                           watched or rated.
+                base_export_id (int):      The export_id of the export to merge an incremental export with,
+                                           instead of the latest export
 
             Returns:
                 json:
@@ -7066,6 +7158,7 @@ class WebInterface(object):
             ```
         """
         individual_files = helpers.bool_true(individual_files)
+        incremental = helpers.bool_true(incremental)
         result = exporter.Export(section_id=section_id,
                                  user_id=user_id,
                                  rating_key=rating_key,
@@ -7077,7 +7170,9 @@ class WebInterface(object):
                                  logo_level=logo_level,
                                  custom_fields=custom_fields,
                                  export_type=export_type,
-                                 individual_files=individual_files).export()
+                                 individual_files=individual_files,
+                                 incremental=incremental,
+                                 base_export_id=base_export_id).export()
 
         if isinstance(result, int):
             return {'result': 'success', 'message': 'Metadata export has started.', 'export_id': result}
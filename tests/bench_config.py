@@ -0,0 +1,45 @@
+"""
+Benchmark ``plexpy.CONFIG`` setting reads from the snapshot against the
+uncached ``Config.get_setting`` path. Not collected by pytest, run it directly:
+
+    python -m tests.bench_config [reads]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from plexpy.config.core import Config
+
+
+SETTINGS = ('GROUP_HISTORY_TABLES', 'MOVIE_WATCHED_PERCENT', 'TV_WATCHED_PERCENT', 'DATE_FORMAT',
+            'HOME_STATS_CARDS', 'PMS_IDENTIFIER', 'BUFFER_THRESHOLD', 'WATCHED_MARKER')
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    value = func()
+    print('%-24s %8.3fs' % (label, time.perf_counter() - start))
+    return value
+
+
+def main(reads=200000):
+    with tempfile.TemporaryDirectory() as tmp:
+        config = Config(os.path.join(tmp, 'config.ini'), is_import=True)
+
+        def uncached():
+            return [config.get_setting(name) for _ in range(reads // len(SETTINGS)) for name in SETTINGS]
+
+        def snapshot():
+            return [getattr(config, name) for _ in range(reads // len(SETTINGS)) for name in SETTINGS]
+
+        print('%d reads' % reads)
+        expected = timed('get_setting', uncached)
+        result = timed('snapshot', snapshot)
+
+        assert result == expected, 'snapshot values differ from get_setting'
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
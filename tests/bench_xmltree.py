@@ -0,0 +1,69 @@
+"""
+Benchmark ``plexpy.util.xmltree`` against ``xml.dom.minidom`` on a synthetic
+library listing. Not collected by pytest, run it directly:
+
+    python -m tests.bench_xmltree [items]
+"""
+
+import sys
+import time
+from xml.dom import minidom
+
+from plexpy.util import xmltree
+
+
+def make_media_container(items):
+    rows = []
+    for i in range(items):
+        rows.append(
+            '<Video ratingKey="%d" key="/library/metadata/%d" type="movie" title="Movie &amp; %d" '
+            'year="%d" addedAt="%d" duration="%d">'
+            '<Media id="%d" videoResolution="1080" bitrate="8000" container="mkv">'
+            '<Part id="%d" file="/media/movie %d.mkv" size="%d"/></Media>'
+            '<Genre tag="Drama"/><Genre tag="Comedy"/><Director tag="Director %d"/>'
+            '</Video>' % (i, i, i, 1950 + i % 70, 1600000000 + i, 5400000, i, i, i, 10 ** 9 + i, i % 500)
+        )
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<MediaContainer size="%d" librarySectionID="1">%s</MediaContainer>'
+            % (items, ''.join(rows))).encode('utf-8')
+
+
+def walk(document):
+    # Mirrors the access pattern of PmsConnect.get_library_children_details
+    result = []
+    for container in document.getElementsByTagName('MediaContainer'):
+        for item in container.getElementsByTagName('Video'):
+            media = item.getElementsByTagName('Media')
+            parts = item.getElementsByTagName('Part')
+            result.append((
+                item.getAttribute('ratingKey'),
+                item.getAttribute('title'),
+                media[0].getAttribute('videoResolution') if media else '',
+                parts[0].getAttribute('file') if parts else '',
+                [genre.getAttribute('tag') for genre in item.getElementsByTagName('Genre')],
+            ))
+    return result
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    value = func()
+    print('%-24s %8.3fs' % (label, time.perf_counter() - start))
+    return value
+
+
+def main(items=50000):
+    data = make_media_container(items)
+    print('%d items, %.1f MB' % (items, len(data) / 1024.0 / 1024.0))
+
+    dom = timed('minidom parse', lambda: minidom.parseString(data))
+    dom_rows = timed('minidom walk', lambda: walk(dom))
+
+    tree = timed('xmltree parse', lambda: xmltree.parse(data))
+    tree_rows = timed('xmltree walk', lambda: walk(tree))
+
+    assert dom_rows == tree_rows, 'xmltree results differ from minidom'
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
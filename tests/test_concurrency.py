@@ -0,0 +1,113 @@
+import random
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from plexpy.util.concurrency import peak_concurrency
+
+
+BASE = 1700000000
+DAY = 86400
+DECISIONS = ('direct play', 'copy', 'transcode')
+
+
+def calc_most_concurrent(result):
+    # Previous DataFactory.get_home_stats implementation
+    times = []
+    for item in result:
+        times.append({'time': str(item['started']) + 'B', 'count': 1})
+        times.append({'time': str(item['stopped']) + 'A', 'count': -1})
+    times = sorted(times, key=lambda k: k['time'])
+
+    count = 0
+    last_count = 0
+    last_start = ''
+    concurrent = {'count': 0, 'started': None, 'stopped': None}
+
+    for d in times:
+        if d['count'] == 1:
+            count += d['count']
+            if count >= last_count:
+                last_start = d['time']
+        else:
+            if count >= last_count:
+                last_count = count
+                concurrent['count'] = count
+                concurrent['started'] = int(last_start[:-1]) if last_start else None
+                concurrent['stopped'] = int(d['time'][:-1])
+            count += d['count']
+
+    return concurrent
+
+
+def random_rows(seed, count=200, days=3):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        # Coarse times so that starts and stops often fall on the same second
+        started = BASE + rng.randrange(days * DAY // 600) * 600
+        stopped = started + rng.randrange(0, 12) * 600
+        rows.append({'started': started,
+                     'stopped': stopped,
+                     'day': (started - BASE) // DAY,
+                     'decision': rng.choice(DECISIONS)})
+    return rows
+
+
+def expected(rows):
+    return {'count': 0, 'started': None, 'stopped': None} if not rows else calc_most_concurrent(rows)
+
+
+def actual(peaks, key):
+    return peaks.get(key, {'count': 0, 'started': None, 'stopped': None})
+
+
+def test_stop_at_start_time_does_not_overlap():
+    rows = [{'started': BASE, 'stopped': BASE + 60},
+            {'started': BASE + 60, 'stopped': BASE + 120}]
+    peaks = peak_concurrency((r['started'], r['stopped'], ('all',)) for r in rows)
+
+    assert peaks['all'] == {'count': 1, 'started': BASE + 60, 'stopped': BASE + 120}
+    assert peaks['all'] == calc_most_concurrent(rows)
+
+
+def test_matches_previous_algorithm():
+    for seed in range(50):
+        rows = random_rows(seed)
+        peaks = peak_concurrency((r['started'], r['stopped'], ('all',)) for r in rows)
+
+        assert actual(peaks, 'all') == expected(rows), seed
+
+
+def test_per_decision_buckets():
+    for seed in range(50):
+        rows = random_rows(seed)
+        peaks = peak_concurrency((r['started'], r['stopped'], (r['decision'], 'all')) for r in rows)
+
+        assert actual(peaks, 'all') == expected(rows), seed
+        for decision in DECISIONS:
+            decision_rows = [r for r in rows if r['decision'] == decision]
+            assert actual(peaks, decision) == expected(decision_rows), (seed, decision)
+
+
+def test_per_day_windows():
+    for seed in range(50):
+        rows = random_rows(seed)
+        peaks = peak_concurrency((r['started'], r['stopped'], (r['day'], (r['day'], r['decision'])))
+                                 for r in rows)
+
+        for day in range(3):
+            day_rows = [r for r in rows if r['day'] == day]
+            assert actual(peaks, day) == expected(day_rows), (seed, day)
+            for decision in DECISIONS:
+                decision_rows = [r for r in day_rows if r['decision'] == decision]
+                assert actual(peaks, (day, decision)) == expected(decision_rows), (seed, day, decision)
+
+
+def test_skips_incomplete_rows():
+    peaks = peak_concurrency([(BASE, None, ('all',)), (None, BASE, ('all',)), (BASE, BASE + 1, ('all',))])
+
+    assert peaks['all'] == {'count': 1, 'started': BASE, 'stopped': BASE + 1}
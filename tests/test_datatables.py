@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from plexpy.db import datatables
+
+
+def test_row_expression():
+    assert datatables.row_expression('session_history.platform') == 'session_history.platform'
+    assert datatables.row_expression('MAX(session_history.platform)') == 'session_history.platform'
+    assert datatables.row_expression('min(started)') == 'started'
+    assert datatables.row_expression("MAX((CASE WHEN live = 1 THEN 'live' ELSE media_type END))") \
+        == "(CASE WHEN live = 1 THEN 'live' ELSE media_type END)"
+    assert datatables.row_expression('MAX(stopped) - MIN(started)') is None
+    assert datatables.row_expression('SUM(paused_counter)') is None
+    assert datatables.row_expression('COUNT(*)') is None
+
+
+def test_build_row_where():
+    columns = datatables.extract_columns(['MAX(session_history.user) AS user',
+                                          'MAX(session_history_metadata.full_title) AS full_title',
+                                          'COUNT(*) AS group_count',
+                                          'session_history.reference_id'])
+    dt_columns = [{'data': 'user', 'searchable': True},
+                  {'data': 'full_title', 'searchable': False},
+                  {'data': 'group_count', 'searchable': True},
+                  {'data': 'reference_id', 'searchable': True},
+                  {'data': 'bogus', 'searchable': True}]
+
+    where, args = datatables.build_row_where('foo', columns, dt_columns)
+
+    assert where == 'session_history.user ILIKE ? OR session_history.reference_id ILIKE ?'
+    assert args == ['%foo%', '%foo%']
+    assert datatables.build_row_where('', columns, dt_columns) == ('', [])
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+import plexpy
+from plexpy.integrations import image_cache
+
+
+@pytest.fixture
+def cache_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(plexpy, 'CONFIG', SimpleNamespace(CACHE_DIR=str(tmp_path), IMAGE_CACHE_MAX_MB=0),
+                        raising=False)
+    return tmp_path
+
+
+def test_etag_survives_touch(cache_config):
+    path = image_cache.cache_path('abc', 'png')
+    image_cache.write(path, b'0123456789')
+
+    two_hours_ago = time.time() - 2 * 3600
+    os.utime(path, (two_hours_ago, two_hours_ago))
+    tag = image_cache.etag('abc', 'png', os.stat(path))
+
+    stat = image_cache.lookup(path)
+
+    assert os.stat(path).st_atime > two_hours_ago + 3600  # Marked as recently used
+    assert image_cache.etag('abc', 'png', stat) == tag
+    assert image_cache.etag('abc', 'png', image_cache.lookup(path)) == tag
+    assert image_cache.etag_matches(tag, 'W/' + tag)
+
+
+def test_etag_changes_on_write(cache_config):
+    path = image_cache.cache_path('abc', 'png')
+    image_cache.write(path, b'0123456789')
+    os.utime(path, (1000, 1000))
+    tag = image_cache.etag('abc', 'png', image_cache.lookup(path))
+
+    image_cache.write(path, b'0123456789')
+
+    assert image_cache.etag('abc', 'png', image_cache.lookup(path)) != tag
+
+
+def test_lookup_miss(cache_config):
+    assert image_cache.lookup(image_cache.cache_path('missing', 'png')) is None
+
+
+def test_prune_evicts_least_recently_used(cache_config):
+    now = time.time()
+    paths = []
+    for i in range(4):
+        path = image_cache.cache_path('img%d' % i, 'png')
+        image_cache.write(path, b'x' * 400 * 1024)
+        paths.append(path)
+
+    # Oldest written, but most recently used
+    os.utime(paths[0], (now, now - 4000))
+    for i, path in enumerate(paths[1:], 1):
+        os.utime(path, (now - 4000 + i * 100, now))
+
+    image_cache.prune(max_bytes=1000 * 1024)
+
+    assert [os.path.exists(path) for path in paths] == [True, False, False, True]
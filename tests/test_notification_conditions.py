@@ -0,0 +1,167 @@
+import itertools
+import random
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from plexpy.services import notification_conditions
+from plexpy.util import helpers
+
+
+OPERATORS = ('contains', 'does not contain', 'is', 'is not', 'begins with', 'does not begin with',
+             'ends with', 'does not end with', 'is greater than', 'is less than', 'bogus')
+TYPES = ('str', 'int', 'float', 'bogus')
+VALUES = {
+    'str': ['Movie', 'movie ', '~', 'Episode', 'the', 'ie', ''],
+    'int': ['0', '1', '5', 10, 'x', ''],
+    'float': ['0.5', '1', '2.25', 3.0, 'x', ''],
+    'bogus': ['1'],
+}
+PARAMETERS = {
+    'str': ['movie', ' The Movie ', 'episode', '', None, 'MOVIE'],
+    'int': [0, 1, '5', 10, '', None, 'x'],
+    'float': [0.5, '1', 2.25, '', None],
+    'bogus': ['1'],
+}
+LOGIC = ('', '{1} and {2}', '{1} or {2}', '({1} or {2}) and not {3}', '{1} and {4}', '{1} and (', 'not {2}')
+
+
+def old_notify_custom_conditions(custom_conditions, custom_conditions_logic, parameters):
+    # Previous notification_handler.notify_custom_conditions without the debug logging
+    if custom_conditions_logic or any(c for c in custom_conditions if c['value']):
+        logic_groups = None
+        if custom_conditions_logic:
+            try:
+                logic_groups = helpers.parse_condition_logic_string(custom_conditions_logic, len(custom_conditions))
+            except ValueError:
+                return False
+
+        evaluated_conditions = [None]
+
+        for i, condition in enumerate(custom_conditions):
+            parameter = condition['parameter']
+            operator = condition['operator']
+            values = condition['value']
+            parameter_type = condition['type']
+            parameter_value = parameters.get(parameter, "")
+
+            if not parameter or not operator or not values:
+                evaluated_conditions.append(True)
+                continue
+
+            if not isinstance(values, list):
+                values = [values]
+
+            try:
+                if parameter_type == 'str':
+                    values = ['' if v == '~' else str(v).strip().lower() for v in values]
+                elif parameter_type == 'int':
+                    values = [helpers.cast_to_int(v) for v in values]
+                elif parameter_type == 'float':
+                    values = [helpers.cast_to_float(v) for v in values]
+                else:
+                    raise ValueError
+            except ValueError:
+                return False
+
+            try:
+                if parameter_type == 'str':
+                    parameter_value = str(parameter_value).strip().lower()
+                elif parameter_type == 'int':
+                    parameter_value = helpers.cast_to_int(parameter_value)
+                elif parameter_type == 'float':
+                    parameter_value = helpers.cast_to_float(parameter_value)
+                else:
+                    raise ValueError
+            except ValueError:
+                return False
+
+            if operator == 'contains':
+                evaluated = any(c in parameter_value for c in values)
+            elif operator == 'does not contain':
+                evaluated = all(c not in parameter_value for c in values)
+            elif operator == 'is':
+                evaluated = any(parameter_value == c for c in values)
+            elif operator == 'is not':
+                evaluated = all(parameter_value != c for c in values)
+            elif operator == 'begins with':
+                evaluated = parameter_value.startswith(tuple(values))
+            elif operator == 'does not begin with':
+                evaluated = not parameter_value.startswith(tuple(values))
+            elif operator == 'ends with':
+                evaluated = parameter_value.endswith(tuple(values))
+            elif operator == 'does not end with':
+                evaluated = not parameter_value.endswith(tuple(values))
+            elif operator == 'is greater than':
+                evaluated = any(parameter_value > c for c in values)
+            elif operator == 'is less than':
+                evaluated = any(parameter_value < c for c in values)
+            else:
+                evaluated = None
+
+            evaluated_conditions.append(evaluated)
+
+        if logic_groups:
+            try:
+                return helpers.eval_logic_groups_to_bool(logic_groups, evaluated_conditions)
+            except Exception:
+                return False
+        return all(evaluated_conditions[1:])
+
+    return True
+
+
+def outcome(func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        return type(e)
+
+
+def compiled(custom_conditions, custom_conditions_logic, parameters):
+    predicate = notification_conditions.compile_conditions(custom_conditions, custom_conditions_logic)
+    return predicate(parameters)
+
+
+def check(custom_conditions, custom_conditions_logic, parameters):
+    old = outcome(old_notify_custom_conditions, custom_conditions, custom_conditions_logic, parameters)
+    new = outcome(compiled, custom_conditions, custom_conditions_logic, parameters)
+    assert new == old, (custom_conditions, custom_conditions_logic, parameters)
+
+
+def condition(parameter, operator, value, parameter_type):
+    return {'parameter': parameter, 'operator': operator, 'value': value, 'type': parameter_type}
+
+
+def test_each_operator_and_type():
+    for operator, parameter_type in itertools.product(OPERATORS, TYPES):
+        values = VALUES[parameter_type]
+        for value in values + [values[:2], values[1:4], []]:
+            for parameter in PARAMETERS[parameter_type] + ['missing']:
+                parameters = {} if parameter == 'missing' else {'p': parameter}
+                check([condition('p', operator, value, parameter_type)], '', parameters)
+
+
+def test_blank_conditions():
+    for conditions in ([], [condition('', 'is', 'a', 'str')], [condition('p', '', 'a', 'str')],
+                       [condition('p', 'is', '', 'str')], [condition('p', 'is', [], 'str')]):
+        for logic in ('', '{1}'):
+            check(conditions, logic, {'p': 'a'})
+
+
+def test_logic_strings():
+    rng = random.Random(0)
+    for _ in range(2000):
+        conditions = []
+        for _ in range(rng.randint(1, 3)):
+            parameter_type = rng.choice(TYPES[:3])
+            operator = rng.choice(('is', 'is not', 'is greater than', 'is less than') if parameter_type != 'str'
+                                  else OPERATORS[:8])
+            conditions.append(condition(rng.choice(('a', 'b')), operator,
+                                        rng.choice(VALUES[parameter_type]), parameter_type))
+        parameters = {'a': rng.choice(PARAMETERS['str'] + PARAMETERS['int']),
+                      'b': rng.choice(PARAMETERS['float'] + PARAMETERS['str'])}
+        check(conditions, rng.choice(LOGIC), parameters)
@@ -0,0 +1,149 @@
+import os
+import random
+import sys
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+import plexpy
+from plexpy.db import regroup
+from plexpy.db.engine import create_engine_from_config
+from plexpy.db.session import init_session_factory, session_scope
+from plexpy.services.activity_processor import ActivityProcessor
+from plexpy.util import helpers
+
+
+@pytest.fixture
+def history_db():
+    db_url = os.getenv("TAUTULLI_TEST_DATABASE_URL")
+    if not db_url:
+        pytest.skip("TAUTULLI_TEST_DATABASE_URL not set")
+
+    url = make_url(db_url)
+    if url.get_backend_name() != "postgresql":
+        pytest.skip("TAUTULLI_TEST_DATABASE_URL is not PostgreSQL")
+
+    cfg = SimpleNamespace(
+        DB_USER=url.username,
+        DB_PASSWORD=url.password,
+        DB_HOST=url.host,
+        DB_PORT=url.port,
+        DB_NAME=url.database,
+        DB_SSLMODE=url.query.get("sslmode") if url.query else None,
+        DB_POOL_SIZE=1,
+        DB_MAX_OVERFLOW=0,
+        DB_POOL_TIMEOUT=5,
+    )
+
+    schema = "test_regroup_%s" % uuid.uuid4().hex[:8]
+    engine = create_engine_from_config(cfg)
+
+    @event.listens_for(engine, "connect")
+    def set_search_path(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SET search_path TO %s" % schema)
+        cursor.close()
+
+    # Only the columns used by grouping, without the users foreign key
+    with engine.begin() as conn:
+        conn.execute(text("CREATE SCHEMA %s" % schema))
+        conn.execute(text(
+            "CREATE TABLE %s.session_history (id serial PRIMARY KEY, user_id integer, rating_key integer, "
+            "view_offset integer DEFAULT 0, media_type text, reference_id integer, started integer)" % schema
+        ))
+        conn.execute(text(
+            "CREATE TABLE %s.session_history_metadata (id integer PRIMARY KEY, duration integer DEFAULT 0, "
+            "guid text, live integer DEFAULT 0, marker_credits_first integer, marker_credits_final integer)"
+            % schema
+        ))
+
+    init_session_factory(engine)
+
+    old_config = plexpy.CONFIG
+    plexpy.CONFIG = SimpleNamespace(MOVIE_WATCHED_PERCENT=85, TV_WATCHED_PERCENT=85,
+                                    MUSIC_WATCHED_PERCENT=85, WATCHED_MARKER=3)
+    try:
+        yield engine
+    finally:
+        plexpy.CONFIG = old_config
+        with engine.begin() as conn:
+            conn.execute(text("DROP SCHEMA %s CASCADE" % schema))
+        engine.dispose()
+
+
+def _insert_history(engine, rows=600, seed=7):
+    rng = random.Random(seed)
+    now = helpers.timestamp()
+
+    with engine.begin() as conn:
+        for row_id in range(1, rows + 1):
+            live = 1 if rng.random() < 0.1 else 0
+            duration = rng.choice([0, 1200000, 2400000, 6000000])
+            conn.execute(
+                text("INSERT INTO session_history (id, user_id, rating_key, view_offset, media_type, started) "
+                     "VALUES (:id, :user_id, :rating_key, :view_offset, :media_type, :started)"),
+                {
+                    'id': row_id,
+                    'user_id': rng.choice([1, 2, 3, None]),
+                    'rating_key': rng.choice([10, 11, 12, None]),
+                    'view_offset': rng.choice([None, 0, rng.randint(0, duration or 1)]),
+                    'media_type': rng.choice(['movie', 'episode', 'track', 'clip', 'photo']),
+                    # Half an interval away from the one day live TV grouping window
+                    'started': now - (rows - row_id) * 600 - 300,
+                },
+            )
+            if rng.random() < 0.95:
+                conn.execute(
+                    text("INSERT INTO session_history_metadata "
+                         "(id, duration, guid, live, marker_credits_first, marker_credits_final) "
+                         "VALUES (:id, :duration, :guid, :live, :first, :final)"),
+                    {
+                        'id': row_id,
+                        'duration': duration,
+                        'guid': rng.choice(['guid-a', 'guid-b', None]),
+                        'live': live,
+                        'first': rng.choice([None, 0, int(duration * 0.8)]),
+                        'final': rng.choice([None, int(duration * 0.9)]),
+                    },
+                )
+
+
+def _reference_ids(engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(text("SELECT id, reference_id FROM session_history ORDER BY id")).all())
+
+
+def _legacy_regroup():
+    ap = ActivityProcessor()
+    with session_scope() as db_session:
+        rows = db_session.execute(text(
+            "SELECT h.id, h.user_id, h.rating_key, h.view_offset, h.media_type, m.duration, "
+            "m.marker_credits_first, m.marker_credits_final, m.live, m.guid "
+            "FROM session_history h JOIN session_history_metadata m ON m.id = h.id ORDER BY h.id"
+        )).mappings().all()
+    for row in rows:
+        ap.group_history(row['id'], dict(row))
+
+
+@pytest.mark.parametrize("watched_marker", [0, 1, 2, 3])
+def test_regroup_matches_group_history(history_db, watched_marker):
+    plexpy.CONFIG.WATCHED_MARKER = watched_marker
+    _insert_history(history_db)
+
+    _legacy_regroup()
+    expected = _reference_ids(history_db)
+
+    with history_db.begin() as conn:
+        conn.execute(text("UPDATE session_history SET reference_id = NULL"))
+
+    regroup.regroup_history(chunk_users=2)
+
+    assert _reference_ids(history_db) == expected